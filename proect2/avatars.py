@@ -0,0 +1,248 @@
+import argparse
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_app_context, request, send_file, url_for, abort
+
+from config import PROJECT_ROOT, resolve_path
+
+logger = logging.getLogger(__name__)
+
+AVATAR_SIZES = (50, 100)
+# Формат по умолчанию - JPEG, WebP отдаётся браузерам, которые его принимают
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+CACHE_MAX_AGE = 365 * 24 * 60 * 60
+UPLOAD_FOLDER = 'static/avatars'
+
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+_executor = None
+_executor_lock = threading.Lock()
+# Хэши, для которых копии уже строятся: повторные запросы не ставят задачу ещё раз
+_pending = set()
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='avatars')
+        return _executor
+
+
+def _folder(root, digest):
+    # Раскладываем по подкаталогам из первых двух символов хэша, чтобы не держать всё в одном каталоге
+    return os.path.join(root, digest[:2])
+
+
+def original_path(root, digest):
+    folder = _folder(root, digest)
+    if os.path.isdir(folder):
+        for name in os.listdir(folder):
+            if name.startswith(digest + '.'):
+                return os.path.join(folder, name)
+    return None
+
+
+def variant_path(root, digest, size, ext):
+    return os.path.join(_folder(root, digest), f"{digest}_{size}.{ext}")
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def make_variants(root, digest, data=None):
+    from PIL import Image, ImageOps
+
+    if data is None:
+        with open(original_path(root, digest), 'rb') as f:
+            data = f.read()
+    # Декодируем один раз, все размеры и форматы строим из одного изображения
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    for size in AVATAR_SIZES:
+        thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        for ext, (pil_format, _, options) in FORMATS.items():
+            path = variant_path(root, digest, size, ext)
+            if os.path.exists(path):
+                continue
+            frame = thumbnail
+            if pil_format == 'JPEG' and frame.mode == 'RGBA':
+                background = Image.new('RGB', frame.size, (255, 255, 255))
+                background.paste(frame, mask=frame.split()[3])
+                frame = background
+            buffer = io.BytesIO()
+            frame.save(buffer, pil_format, **options)
+            _write_atomic(path, buffer.getvalue())
+    return digest
+
+
+def _make_variants_logged(app, root, digest, data):
+    try:
+        make_variants(root, digest, data)
+        if app is not None:
+            # Страницы ссылались на оригинал: новая версия строк владельцев сменит их ETag
+            from repository import get_repository
+            with app.app_context():
+                get_repository().touch_avatar(digest)
+    except Exception:
+        logger.exception("Ошибка при обработке аватара %s", digest)
+    finally:
+        with _executor_lock:
+            _pending.discard(digest)
+
+
+def _submit_variants(root, digest, data=None):
+    with _executor_lock:
+        if digest in _pending:
+            return
+        _pending.add(digest)
+    app = current_app._get_current_object() if has_app_context() else None
+    try:
+        _get_executor().submit(_make_variants_logged, app, root, digest, data)
+    except RuntimeError:
+        with _executor_lock:
+            _pending.discard(digest)
+        raise
+
+
+def variants_ready(root, digest):
+    # Копии пишутся по очереди атомарной заменой файла: есть последняя - есть и все остальные
+    return os.path.exists(variant_path(root, digest, AVATAR_SIZES[-1], list(FORMATS)[-1]))
+
+
+def store_avatar(data, filename, root=None, background=True):
+    # Сохраняет оригинал под его sha256, одинаковые файлы хранятся один раз.
+    # Уменьшенные копии строятся в фоновом потоке.
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        # Читается только заголовок, полного декодирования здесь нет
+        with Image.open(io.BytesIO(data)) as image:
+            image_format = (image.format or '').lower()
+    except (UnidentifiedImageError, OSError) as e:
+        raise InvalidImage(f"Файл {filename} не является изображением") from e
+
+    root = root or current_app.config['UPLOAD_FOLDER']
+    digest = hashlib.sha256(data).hexdigest()
+    path = original_path(root, digest)
+    if path is None:
+        ext = {'jpeg': 'jpg'}.get(image_format, image_format) or 'bin'
+        path = os.path.join(_folder(root, digest), f"{digest}.{ext}")
+        _write_atomic(path, data)
+        logger.info("Аватар сохранен: %s", path)
+    # В users.avatar хранится путь от каталога проекта (static/avatars/...), а не абсолютный
+    path = os.path.relpath(path, PROJECT_ROOT)
+    if variants_ready(root, digest):
+        return digest, path
+    if background:
+        _submit_variants(root, digest, data)
+    else:
+        make_variants(root, digest, data)
+    return digest, path
+
+
+def avatar_url(user, size=50):
+    digest = user['avatar_hash'] if 'avatar_hash' in user.keys() else None
+    if not digest:
+        return user['avatar']
+    # Пока копий нет, страница ссылается на оригинал. Когда они появятся, версия строки владельца
+    # сменится (touch_avatar), и страница под новым ETag получит постоянный адрес копии
+    avatar = user['avatar'] or ''
+    if avatar.startswith('static/') and not variants_ready(current_app.config['UPLOAD_FOLDER'], digest):
+        return url_for('static', filename=avatar[len('static/'):])
+    return url_for('avatar', digest=digest, size=size)
+
+
+def serve_avatar(digest, size):
+    if not _DIGEST.match(digest) or size not in AVATAR_SIZES:
+        abort(404)
+    root = current_app.config['UPLOAD_FOLDER']
+    ext = 'webp' if 'image/webp' in request.accept_mimetypes.values() else 'jpg'
+    path = variant_path(root, digest, size, ext)
+    if os.path.exists(path):
+        # Содержимое по этому адресу никогда не меняется
+        response = send_file(os.path.abspath(path), mimetype=FORMATS[ext][1], max_age=CACHE_MAX_AGE,
+                             etag=f"{digest}-{size}-{ext}", conditional=True)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.vary.add('Accept')
+        return response
+    # Уменьшенная копия ещё не готова - отдаём оригинал без долгого кэширования
+    path = original_path(root, digest)
+    if path is None:
+        abort(404)
+    _submit_variants(root, digest)
+    response = send_file(os.path.abspath(path), max_age=0)
+    response.cache_control.no_cache = True
+    return response
+
+
+def init_app(app):
+    app.config.setdefault('UPLOAD_FOLDER', UPLOAD_FOLDER)
+    app.add_url_rule('/avatars/<digest>/<int:size>', 'avatar', serve_avatar)
+    app.jinja_env.globals['avatar_url'] = avatar_url
+
+
+def backfill(root=UPLOAD_FOLDER):
+    # Переносит уже загруженные аватарки в хранилище по хэшу и строит уменьшенные копии
+    digests = {}
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        try:
+            digest, _ = store_avatar(data, name, root=root, background=False)
+        except InvalidImage as e:
+            logger.warning("%s", e)
+            continue
+        digests[name] = digest
+        logger.info("%s -> %s", name, digest)
+
+    from repository import get_repository
+
+    repository = get_repository()
+    pairs = []
+    for row in repository.users_missing_avatar_hash():
+        # Старые записи содержат пути вида static/avatars\i.jpg
+        name = os.path.basename(row['avatar'].replace('\\', '/'))
+        digest = digests.get(name)
+        if digest and not row['avatar'].startswith(('http://', 'https://')):
+            pairs.append((digest, row['id']))
+    repository.set_avatar_hashes(pairs)
+    return len(digests), len(pairs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Обработка аватарок")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = subparsers.add_parser('backfill', help="обработать уже загруженные файлы")
+    backfill_parser.add_argument('--folder', default=resolve_path(UPLOAD_FOLDER))
+    args = parser.parse_args()
+
+    from teamfinder import create_app
+    # Через приложение: то же хранилище (SQLite или PostgreSQL) и поток записи, что у сайта
+    app = create_app({'STEAM_JOBS_WORKER': False})
+    with app.app_context():
+        files, users = backfill(args.folder)
+    print(f"Обработано файлов: {files}, обновлено пользователей: {users}")
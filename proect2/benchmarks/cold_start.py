@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Выполняется в новом процессе: импорт пакета, создание приложения и первый запрос
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+from teamfinder import create_app
+imported = time.perf_counter()
+app = create_app({'DATABASE': sys.argv[1], 'SECRET_KEY': 'bench', 'LOG_LEVEL': 'WARNING'})
+created = time.perf_counter()
+response = app.test_client().get(sys.argv[2])
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_request': served - created,
+    'heavy_modules_loaded': [name for name in ('requests', 'PIL') if name in sys.modules],
+}))
+"""
+
+
+def run_once(database, path):
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD, database, path], cwd=PROJECT_ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    total = time.perf_counter() - started
+    result = json.loads(output.strip().splitlines()[-1])
+    # Время от запуска интерпретатора до готового ответа, включая старт самого Python
+    result['total'] = total
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время холодного старта воркера до первого ответа")
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/')
+    parser.add_argument('--database', help="по умолчанию - временная копия baze.db")
+    parser.add_argument('--output', help="куда сохранить результат в JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = args.database
+        if database is None:
+            database = os.path.join(tmp, 'baze.db')
+            shutil.copy(os.path.join(PROJECT_ROOT, 'baze.db'), database)
+        # Первый запуск применяет миграции к копии, его не учитываем
+        run_once(database, args.path)
+        runs = [run_once(database, args.path) for _ in range(args.runs)]
+
+    summary = {}
+    for key in ('import', 'create_app', 'first_request', 'total'):
+        values = sorted(run[key] for run in runs)
+        summary[key] = {
+            'median_ms': statistics.median(values) * 1000,
+            'min_ms': values[0] * 1000,
+            'max_ms': values[-1] * 1000,
+        }
+    summary['heavy_modules_loaded'] = runs[-1]['heavy_modules_loaded']
+    summary['runs'] = args.runs
+
+    for key in ('import', 'create_app', 'first_request', 'total'):
+        print(f"{key:>14}: {summary[key]['median_ms']:8.1f} мс (мин {summary[key]['min_ms']:.1f}, "
+              f"макс {summary[key]['max_ms']:.1f})")
+    print(f"Загружены тяжёлые модули: {', '.join(summary['heavy_modules_loaded']) or 'нет'}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
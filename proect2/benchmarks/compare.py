@@ -0,0 +1,49 @@
+import argparse
+import json
+import sys
+
+
+def _rows(results):
+    # micro: {'scenarios': {...}}, load: {'routes': {...}, 'overall': {...}}
+    rows = dict(results.get('scenarios') or results.get('routes') or {})
+    if 'overall' in results:
+        rows['overall'] = results['overall']
+    return rows
+
+
+def compare(baseline, current, metric, threshold):
+    regressions = []
+    base_rows, current_rows = _rows(baseline), _rows(current)
+    for name in sorted(set(base_rows) & set(current_rows)):
+        before = base_rows[name][metric]
+        after = current_rows[name][metric]
+        change = (after - before) / before * 100 if before else 0.0
+        marker = ''
+        if change > threshold:
+            marker = '  <-- регрессия'
+            regressions.append(name)
+        print(f"{name:>36}: {before:9.3f} -> {after:9.3f} мс ({change:+6.1f}%){marker}")
+    if 'rps' in baseline and 'rps' in current:
+        print(f"{'req/s':>36}: {baseline['rps']:9.1f} -> {current['rps']:9.1f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение двух результатов бенчмарков")
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--metric', default='p95_ms', choices=['p50_ms', 'p95_ms', 'p99_ms', 'mean_ms'])
+    parser.add_argument('--threshold', type=float, default=10.0, help="допустимый рост задержки, %%")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    print(f"{baseline['meta']['revision']} -> {current['meta']['revision']}, метрика {args.metric}")
+    regressions = compare(baseline, current, args.metric, args.threshold)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import argparse
+import os
+import random
+import sqlite3
+import time
+
+from common import PROJECT_ROOT  # импорт common добавляет корень проекта в sys.path
+
+import schema
+
+PRESETS = {
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+}
+
+# Распределения подобраны на глаз по живой базе: шутеры и RPG заметно популярнее варгеймов
+GAME_TYPES = [
+    ('Шутеры', 28), ('RPG', 16), ('MMORPG', 10), ('Action', 10), ('RTS', 7), ('Хоррор', 6),
+    ('Симулятор', 6), ('Файтинг', 5), ('Платформер', 4), ('Глобальные стратегии', 5), ('Wargames', 3),
+]
+PLATFORMS = [('PC', 60), ('PlayStation', 15), ('Xbox', 8), ('Nintendo Switch', 5), ('Mobile', 7), (None, 5)]
+REGIONS = [('СНГ', 45), ('Европа', 30), ('Северная Америка', 10), ('Азия', 8), ('Южная Америка', 4),
+           ('Океания', 1), (None, 2)]
+APPIDS = [730, 570, 440, 578080, 1172470, 271590, 359550, 252490, 292030, 1091500, 105600, 4000, 236390, 230410]
+SYLLABLES = ['ка', 'ми', 'ро', 'ла', 'ни', 'та', 'све', 'ан', 'дрей', 'ма', 'ша', 'лё', 'ва', 'ди', 'ма', 'ксим',
+             'ol', 'ga', 'ser', 'gey', 'ni', 'ko', 'pro', 'ny', 'x', 'dark', 'wolf']
+WORDS = ['ищу', 'команду', 'для', 'рейдов', 'вечером', 'играю', 'спокойно', 'без', 'токсичности', 'микрофон',
+         'есть', 'ранкед', 'кооп', 'по', 'выходным', 'фан', 'турниры', 'учусь', 'новичок', 'опытный']
+
+BENCH_PASSWORD = 'password'
+
+
+def weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+
+def make_user(rng, number, password_hash):
+    name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+    age = min(60, max(14, int(rng.gauss(24, 7))))
+    description = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 15)))
+    steam_url = f"https://steamcommunity.com/profiles/{76561197960265728 + number}" if rng.random() < 0.6 else ''
+    return (f"user{number}", password_hash, name, age, description, weighted(rng, GAME_TYPES),
+            f"static/avatars/{number % 8}.png", steam_url, weighted(rng, PLATFORMS), weighted(rng, REGIONS))
+
+
+def generate(path, users, reviews_per_user=3.0, games_per_user=5, seed=42, chunk=10_000):
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(seed)
+    # Один настоящий хэш на всех: считать миллион хэшей незачем, пароль у всех BENCH_PASSWORD
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    schema.migrate(conn)
+    # Генерация не должна быть надёжной, она должна быть быстрой
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+
+    started = time.perf_counter()
+    conn.execute("BEGIN")
+    for offset in range(0, users, chunk):
+        rows = [make_user(rng, number, password_hash) for number in range(offset, min(users, offset + chunk))]
+        conn.executemany("""
+            INSERT INTO users (username, password, name, age, description, game_type, avatar, steam_profile_url,
+                               platform, region)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+    conn.executemany("INSERT OR IGNORE INTO games (appid, name) VALUES (?, ?)",
+                     [(appid, f"Game {appid}") for appid in APPIDS])
+
+    # Отзывы распределены по Парето: у немногих популярных игроков их сотни
+    total_reviews = int(users * reviews_per_user)
+    for offset in range(0, total_reviews, chunk):
+        rows = []
+        for _ in range(min(chunk, total_reviews - offset)):
+            target = min(users, int(rng.paretovariate(1.2))) if rng.random() < 0.3 else rng.randint(1, users)
+            rows.append((target, ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 25))),
+                         f"user{rng.randrange(users)}",
+                         f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} "
+                         f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}"))
+        conn.executemany("INSERT INTO reviews (user_id, review_text, reviewer_username, created_at) VALUES (?, ?, ?, ?)",
+                         rows)
+
+    for offset in range(1, users + 1, chunk):
+        rows = []
+        for user_id in range(offset, min(users + 1, offset + chunk)):
+            for appid in rng.sample(APPIDS, rng.randint(0, games_per_user)):
+                rows.append((user_id, appid, rng.randint(0, 5000)))
+        conn.executemany("INSERT INTO user_games (user_id, appid, playtime) VALUES (?, ?, ?)", rows)
+
+    conn.execute("UPDATE users SET review_count = (SELECT COUNT(*) FROM reviews WHERE reviews.user_id = users.id)")
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетическая база для бенчмарков")
+    parser.add_argument('size', help=f"число пользователей или пресет: {', '.join(PRESETS)}")
+    parser.add_argument('--output', default=None, help="путь к файлу БД, по умолчанию benchmarks/data/bench-<size>.db")
+    parser.add_argument('--reviews-per-user', type=float, default=3.0)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    users = PRESETS.get(args.size.lower()) or int(args.size)
+    output = args.output or os.path.join(PROJECT_ROOT, 'benchmarks', 'data', f"bench-{args.size.lower()}.db")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    elapsed = generate(output, users, args.reviews_per_user, seed=args.seed)
+    print(f"{output}: {users} пользователей, {int(users * args.reviews_per_user)} отзывов за {elapsed:.1f} с, "
+          f"{os.path.getsize(output) / 1024 / 1024:.1f} МБ")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import argparse
+import gc
+import os
+import random
+import sqlite3
+import time
+import tracemalloc
+
+from common import save_results, summarize
+
+import funcs
+import snapshot
+from repository import get_repository
+from search import encode_cursor
+from teamfinder import create_app
+
+GAME_TYPES = ['Шутеры', 'RPG', 'MMORPG', 'Wargames']
+PLATFORMS = ['PC', 'PlayStation', 'Xbox']
+REGIONS = ['Европа', 'СНГ', 'Азия']
+
+
+def queries(rng, deep_cursor):
+    # Запросы главной без текстового поиска: (сортировка, возраст, тип игр, платформа, регион, курсор)
+    return {
+        'name': lambda: ('name', None, None, None, None, None),
+        'age': lambda: ('age', None, None, None, None, None),
+        'game_type': lambda: ('name', None, rng.choice(GAME_TYPES), None, None, None),
+        'age+game_type': lambda: ('age', rng.randint(14, 40), rng.choice(GAME_TYPES), None, None, None),
+        'platform+region': lambda: ('name', None, None, rng.choice(PLATFORMS), rng.choice(REGIONS), None),
+        'rare': lambda: ('game_type', 45, 'Wargames', 'Xbox', 'Азия', None),
+        'deep': lambda: ('name', None, None, None, None, deep_cursor),
+    }
+
+
+def _sql(sort_by, age, game_type, platform, region, after):
+    repository = get_repository()
+    rows, _ = repository.users_page(sort_by, age, None, game_type, platform, region, after, 50)
+    return rows, repository.count_users(age, None, game_type, platform, region)
+
+
+def _snapshot(directory):
+    def call(sort_by, age, game_type, platform, region, after):
+        rows, _ = directory.page(sort_by, age, game_type, platform, region, after, 50)
+        return rows, directory.count(age, game_type, platform, region)
+    return call
+
+
+def _measure(call, make_args, iterations, warmup):
+    for _ in range(warmup):
+        call(*make_args())
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        args = make_args()
+        begun = time.perf_counter()
+        call(*args)
+        latencies.append(time.perf_counter() - begun)
+    elapsed = time.perf_counter() - started
+    result = summarize(latencies)
+    result['qps'] = iterations / elapsed
+    return result
+
+
+def _traced(build):
+    # Прирост памяти Python-объектов за время build(), результат build() остаётся жив
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    value = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, after - before
+
+
+def memory(database):
+    # Снимок против того, что делает get_users(): полный список строк sqlite3.Row
+    directory, snapshot_bytes = _traced(lambda: _loaded(snapshot.Directory()))
+    users = directory.size
+    rows, rows_bytes = _traced(lambda: funcs.get_users('name'))
+    del rows
+    return {
+        'users': users,
+        'snapshot_bytes': snapshot_bytes,
+        'snapshot_bytes_per_user': snapshot_bytes / users,
+        'snapshot_self_reported_bytes': directory.nbytes(),
+        'rows_bytes': rows_bytes,
+        'rows_bytes_per_user': rows_bytes / users,
+    }
+
+
+def _loaded(directory):
+    directory.refresh(get_repository())
+    return directory
+
+
+def refresh_cost(database, directory, changes, seed):
+    # Время дочитывания изменений: changes случайных пользователей меняют возраст и тип игр
+    conn = sqlite3.connect(database)
+    rng = random.Random(seed)
+    ids = [row[0] for row in conn.execute("SELECT id FROM users")]
+    for user_id in rng.sample(ids, min(changes, len(ids))):
+        conn.execute("UPDATE users SET age = ?, game_type = ? WHERE id = ?",
+                     (rng.randint(14, 60), rng.choice(GAME_TYPES), user_id))
+    conn.commit()
+    conn.close()
+    rebuilds = directory.rebuilds
+    started = time.perf_counter()
+    directory.refresh(get_repository())
+    return {'changes': changes, 'ms': (time.perf_counter() - started) * 1000,
+            'rebuild': directory.rebuilds > rebuilds}
+
+
+def run(database, iterations, warmup, seed=1):
+    app = create_app({'DATABASE': database, 'SECRET_KEY': 'bench', 'LOG_LEVEL': 'WARNING',
+                      'CACHE_BACKEND': 'null', 'STEAM_JOBS_WORKER': False})
+    results = {}
+    with app.app_context():
+        results['memory'] = memory(database)
+        print(f"Снимок: {results['memory']['snapshot_bytes_per_user']:.0f} байт на пользователя, "
+              f"строки get_users(): {results['memory']['rows_bytes_per_user']:.0f}")
+
+        directory = _loaded(snapshot.Directory())
+        # Курсор из середины списка, как в micro.py
+        users = funcs.get_users('name')
+        deep_cursor = encode_cursor('name', users[len(users) // 2])
+        del users
+
+        results['queries'] = {}
+        for name, make_args in queries(random.Random(seed), deep_cursor).items():
+            sql = _measure(_sql, make_args, iterations, warmup)
+            memory_path = _measure(_snapshot(directory), make_args, iterations, warmup)
+            results['queries'][name] = {'sql': sql, 'snapshot': memory_path,
+                                        'speedup': memory_path['qps'] / sql['qps']}
+            print(f"{name:>16}: SQL {sql['qps']:8.0f} зап/с  снимок {memory_path['qps']:8.0f} зап/с  "
+                  f"x{results['queries'][name]['speedup']:.1f}")
+
+        results['refresh'] = [refresh_cost(database, directory, changes, seed + changes)
+                              for changes in (1, 10, 100, directory.size // 10)]
+        for item in results['refresh']:
+            print(f"Обновление после {item['changes']} изменений: {item['ms']:.1f} мс"
+                  f"{' (перестроен)' if item['rebuild'] else ''}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Снимок списка пользователей в памяти против SQL: память и зап/с")
+    parser.add_argument('database', help="БД, созданная benchmarks/datagen.py (будет изменена)")
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="файл для JSON, по умолчанию benchmarks/results/")
+    args = parser.parse_args()
+
+    results = run(os.path.abspath(args.database), args.iterations, args.warmup, args.seed)
+    path = save_results('directory', {'database': args.database, 'iterations': args.iterations, **results},
+                        args.output)
+    print(f"Результаты сохранены в {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+import argparse
+import os
+import random
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+from common import FakeSteam, save_results, summarize
+
+from datagen import BENCH_PASSWORD
+from teamfinder import create_app
+
+# Доли маршрутов примерно как в реальном трафике: список и профили составляют почти всё
+ROUTES = [
+    ('index', 40),
+    ('index_filtered', 15),
+    ('profile', 30),
+    ('reviews_more', 4),
+    ('login', 6),
+    ('add_review', 5),
+]
+# Запись удалась, только если ответ - переадресация сюда; редирект на /login или форма с ошибкой - отказ
+WRITE_REDIRECTS = {
+    'login': lambda path: path == '/',
+    'add_review': lambda path: path.startswith('/profile/'),
+}
+LOGIN_ATTEMPTS = 5
+
+
+def succeeded(route, status, location):
+    if route in WRITE_REDIRECTS:
+        return 300 <= status < 400 and WRITE_REDIRECTS[route](urlsplit(location or '').path)
+    return status < 400
+
+
+class Scenario:
+    def __init__(self, database, seed):
+        conn = sqlite3.connect(database)
+        self.usernames = [row[0] for row in conn.execute("SELECT username FROM users ORDER BY random() LIMIT 2000")]
+        self.user_ids = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY random() LIMIT 2000")]
+        conn.close()
+        self.rng = random.Random(seed)
+        names, weights = zip(*ROUTES)
+        self.names = names
+        self.weights = weights
+
+    def next(self):
+        rng = self.rng
+        route = rng.choices(self.names, self.weights)[0]
+        if route == 'index':
+            return route, 'GET', f"/?sort={rng.choice(['name', 'age', 'game_type'])}", None
+        if route == 'index_filtered':
+            return route, 'GET', f"/?game_type={rng.choice(['Шутеры', 'RPG', 'MMORPG'])}&age={rng.randint(14, 35)}", None
+        if route == 'profile':
+            return route, 'GET', f"/profile/{rng.choice(self.usernames)}", None
+        if route == 'reviews_more':
+            return route, 'GET', f"/reviews/{rng.choice(self.user_ids)}", None
+        if route == 'login':
+            return route, 'POST', '/login', {'username': rng.choice(self.usernames), 'password': BENCH_PASSWORD}
+        return route, 'POST', f"/add_review/{rng.choice(self.user_ids)}", {'review': 'нагрузочный отзыв'}
+
+
+class ClientDriver:
+    # Flask test client: без сети, меряет только приложение
+    def __init__(self, app):
+        self.app = app
+
+    def session(self):
+        client = self.app.test_client()
+
+        def send(method, path, data):
+            # Переадресации не выполняются: по Location видно, удалась ли запись
+            response = client.open(path, method=method, data=data)
+            return response.status_code, response.headers.get('Location')
+
+        return send
+
+
+class WsgiDriver:
+    # Настоящий HTTP через локальный многопоточный WSGI-сервер и keep-alive сессии requests
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def session(self):
+        import requests
+        http = requests.Session()
+
+        def send(method, path, data):
+            response = http.request(method, self.base_url + path, data=data, allow_redirects=False)
+            return response.status_code, response.headers.get('Location')
+
+        return send
+
+    def close(self):
+        self.server.shutdown()
+
+
+def login(send, username):
+    # Без входа add_review отвечает редиректом на /login; 503 (очередь хэширования паролей занята)
+    # и 429 повторяются с паузой, остальное - ошибка прогона
+    status = location = None
+    for attempt in range(LOGIN_ATTEMPTS):
+        status, location = send('POST', '/login', {'username': username, 'password': BENCH_PASSWORD})
+        if succeeded('login', status, location):
+            return
+        if status not in (429, 503):
+            break
+        time.sleep(0.1 * 2 ** attempt)
+    raise RuntimeError(f"Вход {username} не удался: {status} {location or ''}".rstrip())
+
+
+def run(database, mode, total_requests, concurrency, seed=1, warmup=50):
+    with FakeSteam() as steam:
+        # Все виртуальные пользователи приходят с одного адреса, лимиты попыток входа здесь не нужны
+        app = create_app({'DATABASE': database, 'SECRET_KEY': 'bench', 'LOG_LEVEL': 'WARNING',
+                          'STEAM_API_URL': steam.url, 'LOGIN_MAX_ATTEMPTS_IP': 10 ** 9,
+                          'LOGIN_MAX_ATTEMPTS_USER': 10 ** 9})
+        driver = WsgiDriver(app) if mode == 'wsgi' else ClientDriver(app)
+        latencies = {}
+        errors = {}
+        lock = threading.Lock()
+        per_worker = total_requests // concurrency
+
+        def worker(number):
+            scenario = Scenario(database, seed + number)
+            send = driver.session()
+            try:
+                # Каждый виртуальный пользователь входит под своим именем, чтобы оставлять отзывы
+                login(send, scenario.usernames[number % len(scenario.usernames)])
+                for _ in range(warmup):
+                    _, method, path, data = scenario.next()
+                    send(method, path, data)
+            except Exception as e:
+                failures.append(e)
+                barrier.abort()
+                return
+            local = {}
+            local_errors = {}
+            try:
+                barrier.wait()
+            except threading.BrokenBarrierError:
+                return
+            for _ in range(per_worker):
+                route, method, path, data = scenario.next()
+                started = time.perf_counter()
+                status, location = send(method, path, data)
+                local.setdefault(route, []).append(time.perf_counter() - started)
+                if not succeeded(route, status, location):
+                    local_errors[route] = local_errors.get(route, 0) + 1
+            with lock:
+                for route, values in local.items():
+                    latencies.setdefault(route, []).extend(values)
+                for route, count in local_errors.items():
+                    errors[route] = errors.get(route, 0) + count
+
+        failures = []
+        barrier = threading.Barrier(concurrency + 1)
+        threads = [threading.Thread(target=worker, args=(number,)) for number in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        try:
+            barrier.wait()
+        except threading.BrokenBarrierError:
+            for thread in threads:
+                thread.join()
+            if mode == 'wsgi':
+                driver.close()
+            raise RuntimeError(f"Прогон прерван: {failures[0] if failures else 'подготовка не удалась'}")
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if mode == 'wsgi':
+            driver.close()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        'mode': mode,
+        'concurrency': concurrency,
+        'requests': len(all_latencies),
+        'elapsed_s': elapsed,
+        'rps': len(all_latencies) / elapsed if elapsed else 0.0,
+        'overall': summarize(all_latencies),
+        'routes': {route: dict(summarize(values), errors=errors.get(route, 0))
+                   for route, values in sorted(latencies.items())},
+        'steam_upstream_calls': steam.calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон маршрутов приложения без внешней сети")
+    parser.add_argument('database', help="БД, созданная benchmarks/datagen.py (будет изменена отзывами)")
+    parser.add_argument('--mode', choices=['client', 'wsgi'], default='client')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="файл для JSON, по умолчанию benchmarks/results/")
+    args = parser.parse_args()
+
+    results = run(os.path.abspath(args.database), args.mode, args.requests, args.concurrency, args.seed)
+    print(f"{results['requests']} запросов за {results['elapsed_s']:.2f} с: {results['rps']:.1f} req/s, "
+          f"p50 {results['overall']['p50_ms']:.2f} мс, p95 {results['overall']['p95_ms']:.2f} мс, "
+          f"p99 {results['overall']['p99_ms']:.2f} мс")
+    for route, summary in results['routes'].items():
+        print(f"{route:>16}: p50 {summary['p50_ms']:7.2f}  p95 {summary['p95_ms']:7.2f}  p99 {summary['p99_ms']:7.2f}  "
+              f"ошибок {summary['errors']}")
+    results['database'] = args.database
+    path = save_results('load', results, args.output)
+    print(f"Результаты сохранены в {path}")
+
+
+if __name__ == '__main__':
+    main()
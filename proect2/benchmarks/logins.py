@@ -0,0 +1,95 @@
+import argparse
+import os
+import threading
+import time
+
+from common import save_results, summarize
+
+from passwords import Hasher
+
+PASSWORD = 'correct horse battery staple'
+
+
+def _probe(stop, latencies):
+    # Имитация дешёвой страницы: короткая работа на Python в соседнем потоке, пока идут проверки паролей
+    while not stop.is_set():
+        started = time.perf_counter()
+        sum(i * i for i in range(2000))
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.005)
+
+
+def measure(method, workers, concurrency, duration):
+    hasher = Hasher(method, workers=workers, queue_per_worker=max(1, concurrency), timeout=60)
+    pwhash = hasher.hash(PASSWORD)
+    # Первый вызов поднимает процессы пула, в замер не входит
+    hasher.verify(pwhash, PASSWORD)
+
+    latencies = []
+    probe_latencies = []
+    lock = threading.Lock()
+    stop = threading.Event()
+    deadline = time.perf_counter() + duration
+
+    def login():
+        local = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            valid, _ = hasher.verify(pwhash, PASSWORD)
+            assert valid
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    probe = threading.Thread(target=_probe, args=(stop, probe_latencies))
+    threads = [threading.Thread(target=login) for _ in range(concurrency)]
+    started = time.perf_counter()
+    probe.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    probe.join()
+    hasher.shutdown()
+
+    cores = min(workers or 1, os.cpu_count() or 1) if workers else min(concurrency, os.cpu_count() or 1)
+    rate = len(latencies) / elapsed
+    return {
+        'method': method,
+        'workers': workers,
+        'concurrency': concurrency,
+        'logins': len(latencies),
+        'logins_per_s': rate,
+        'logins_per_s_per_core': rate / cores,
+        'latency': summarize(latencies),
+        'probe': summarize(probe_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность проверки паролей при входе")
+    parser.add_argument('--method', action='append', help="параметры хэширования, можно несколько раз; "
+                                                          "по умолчанию scrypt:32768:8:1 и pbkdf2:sha256:600000")
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                        help="процессов в пуле; 0 - хэширование в потоке запроса")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--output', help="файл для JSON, по умолчанию benchmarks/results/")
+    args = parser.parse_args()
+
+    runs = []
+    for method in args.method or ['scrypt:32768:8:1', 'pbkdf2:sha256:600000']:
+        for workers in sorted({0, args.workers}):
+            result = measure(method, workers, args.concurrency, args.duration)
+            runs.append(result)
+            print(f"{method:>22} воркеров {workers}: {result['logins_per_s']:7.1f} входов/с "
+                  f"({result['logins_per_s_per_core']:.1f} на ядро), p50 {result['latency']['p50_ms']:.1f} мс, "
+                  f"соседняя страница p95 {result['probe']['p95_ms']:.2f} мс")
+    path = save_results('logins', {'runs': runs}, args.output)
+    print(f"Результаты сохранены в {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import os
+import random
+import sqlite3
+import time
+
+from common import save_results, summarize
+
+import funcs
+from teamfinder import create_app
+
+
+def _sample(database, seed):
+    conn = sqlite3.connect(database)
+    rng = random.Random(seed)
+    usernames = [row[0] for row in conn.execute("SELECT username FROM users ORDER BY random() LIMIT 1000")]
+    # Самые "тяжёлые" профили - с наибольшим числом отзывов
+    popular = conn.execute("SELECT id, username FROM users ORDER BY review_count DESC LIMIT 1").fetchone()
+    max_id = conn.execute("SELECT MAX(id) FROM users").fetchone()[0]
+    conn.close()
+    return rng, usernames, popular, max_id
+
+
+def scenarios(database, seed=1):
+    rng, usernames, popular, max_id = _sample(database, seed)
+    game_types = ['Шутеры', 'RPG', 'MMORPG', 'Wargames']
+    return {
+        'get_users_page:name': lambda: funcs.get_users_page('name'),
+        'get_users_page:age+game_type': lambda: funcs.get_users_page('age', age_filter=rng.randint(14, 40),
+                                                                     game_type_filter=rng.choice(game_types)),
+        'get_users_page:search': lambda: funcs.get_users_page('name', search_query=rng.choice(['ка', 'dark', 'ma'])),
+        'get_users_page:deep': lambda: funcs.get_users_page('name', after=_deep_cursor()),
+        'count_users:game_type': lambda: funcs.count_users(game_type_filter=rng.choice(game_types)),
+        'get_user_by_username': lambda: funcs.get_user_by_username(rng.choice(usernames)),
+        'get_profile': lambda: funcs.get_profile(rng.randint(1, max_id)),
+        'get_reviews': lambda: funcs.get_reviews(rng.randint(1, max_id)),
+        'get_reviews:popular': lambda: funcs.get_reviews(popular[0]),
+        'get_profile_with_reviews': lambda: funcs.get_profile_with_reviews(rng.choice(usernames)),
+        'get_profile_with_reviews:popular': lambda: funcs.get_profile_with_reviews(popular[1]),
+        'get_user_games': lambda: funcs.get_user_games(rng.randint(1, max_id)),
+        'get_game_owners': lambda: funcs.get_game_owners(730),
+        # Осмысленно после python recommend.py build на той же БД
+        'get_recommendations': lambda: funcs.get_recommendations(rng.randint(1, max_id)),
+    }
+
+
+_deep = {}
+
+
+def _deep_cursor():
+    # Курсор из середины списка: keyset-страница должна стоить столько же, сколько первая
+    if 'cursor' not in _deep:
+        users = funcs.get_users('name')
+        from search import encode_cursor
+        _deep['cursor'] = encode_cursor('name', users[len(users) // 2])
+    return _deep['cursor']
+
+
+def run(database, iterations, warmup, use_cache, only=None):
+    app = create_app({'DATABASE': database, 'SECRET_KEY': 'bench', 'LOG_LEVEL': 'WARNING',
+                      'CACHE_BACKEND': 'memory' if use_cache else 'null'})
+    results = {}
+    with app.app_context():
+        for name, call in scenarios(database).items():
+            if only and not any(part in name for part in only):
+                continue
+            for _ in range(warmup):
+                call()
+            latencies = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                call()
+                latencies.append(time.perf_counter() - started)
+            results[name] = summarize(latencies)
+            print(f"{name:>36}: p50 {results[name]['p50_ms']:7.3f} мс  p95 {results[name]['p95_ms']:7.3f}  "
+                  f"p99 {results[name]['p99_ms']:7.3f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки функций доступа к данным из funcs.py")
+    parser.add_argument('database', help="БД, созданная benchmarks/datagen.py")
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--cache', action='store_true', help="мерить с включённым кэшем (по умолчанию - чистый SQL)")
+    parser.add_argument('--only', nargs='*', help="запустить только сценарии, содержащие эти подстроки")
+    parser.add_argument('--output', help="файл для JSON, по умолчанию benchmarks/results/")
+    args = parser.parse_args()
+
+    results = run(os.path.abspath(args.database), args.iterations, args.warmup, args.cache, args.only)
+    path = save_results('micro', {'database': args.database, 'cache': args.cache, 'iterations': args.iterations,
+                                  'scenarios': results}, args.output)
+    print(f"Результаты сохранены в {path}")
+
+
+if __name__ == '__main__':
+    main()
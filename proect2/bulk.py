@@ -0,0 +1,334 @@
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+import steamid
+
+logger = logging.getLogger(__name__)
+
+# Пользователи переносятся по username, отзывы ссылаются на пользователя тоже по username:
+# id в разных базах не совпадают. password - готовый хэш werkzeug
+USER_COLUMNS = ('username', 'password', 'name', 'age', 'description', 'game_type', 'avatar', 'avatar_hash',
+                'steam_profile_url', 'steam_id', 'platform', 'region')
+REVIEW_COLUMNS = ('username', 'reviewer_username', 'review_text', 'created_at')
+
+KINDS = ('users', 'reviews')
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+def _open(path, mode):
+    if path == '-':
+        return sys.stdout if 'w' in mode else sys.stdin
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def _iter_export(conn, kind, chunk):
+    # Keyset-обход по id: память не зависит от размера таблицы
+    if kind == 'users':
+        query = f"SELECT id, {', '.join(USER_COLUMNS)} FROM users WHERE id > ? ORDER BY id LIMIT ?"
+    else:
+        query = """
+            SELECT r.id, u.username, r.reviewer_username, r.review_text, r.created_at
+            FROM reviews r JOIN users u ON u.id = r.user_id
+            WHERE r.id > ? ORDER BY r.id LIMIT ?
+        """
+    last_id = 0
+    while True:
+        rows = conn.execute(query, (last_id, chunk)).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield {key: row[key] for key in row.keys() if key != 'id'}
+        last_id = rows[-1]['id']
+
+
+def export(conn, kind, path, fmt=None, chunk=5000):
+    # Вся выгрузка - одна читающая транзакция: в WAL она не мешает записи и видит согласованный срез
+    fmt = detect_format(path, fmt)
+    columns = USER_COLUMNS if kind == 'users' else REVIEW_COLUMNS
+    count = 0
+    conn.execute("BEGIN")
+    try:
+        out = _open(path, 'w')
+        try:
+            if fmt == 'csv':
+                writer = csv.DictWriter(out, columns)
+                writer.writeheader()
+                for count, record in enumerate(_iter_export(conn, kind, chunk), start=1):
+                    writer.writerow(record)
+            else:
+                for count, record in enumerate(_iter_export(conn, kind, chunk), start=1):
+                    out.write(json.dumps(record, ensure_ascii=False) + '\n')
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    finally:
+        conn.rollback()
+    return count
+
+
+def read_records(path, fmt=None):
+    # Построчное чтение NDJSON или CSV; пустые значения CSV становятся None
+    fmt = detect_format(path, fmt)
+    stream = _open(path, 'r')
+    try:
+        if fmt == 'csv':
+            for record in csv.DictReader(stream):
+                yield {key: (value if value != '' else None) for key, value in record.items()}
+        else:
+            for line in stream:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def _user_row(record, default_hash):
+    # Кортеж для INSERT или None, если запись неполная
+    username = record.get('username')
+    password = record.get('password') or default_hash
+    if not username or not password:
+        return None
+    age = record.get('age')
+    try:
+        age = int(age) if age not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+    steam_id = record.get('steam_id')
+    if not steam_id and record.get('steam_profile_url'):
+        # Ссылки /profiles/<id> разбираются без сети; короткие имена потом заполнит steamid.py resolve
+        try:
+            steam_id = steamid.parse_profile_url(record['steam_profile_url'])[1]
+        except steamid.InvalidSteamUrl:
+            steam_id = None
+    values = dict(record, username=str(username), password=password, age=age,
+                  steam_id=str(steam_id) if steam_id else None)
+    return tuple(values.get(column) for column in USER_COLUMNS)
+
+
+def _review_row(record):
+    if not record.get('username') or not record.get('reviewer_username') or not record.get('review_text'):
+        return None
+    return record['review_text'], record['reviewer_username'], record.get('created_at'), record['username']
+
+
+INSERT_USERS = f"""
+    INSERT INTO users ({', '.join(USER_COLUMNS)}) VALUES ({', '.join('?' * len(USER_COLUMNS))})
+    ON CONFLICT (username) DO NOTHING
+"""
+# Владелец отзыва ищется по username прямо в INSERT; отзывы неизвестным пользователям не вставляются
+INSERT_REVIEWS = """
+    INSERT INTO reviews (user_id, review_text, reviewer_username, created_at)
+    SELECT id, ?, ?, COALESCE(?, CURRENT_TIMESTAMP) FROM users WHERE username = ?
+"""
+
+
+def _drop_deferred(conn, table):
+    # Вторичные индексы и триггеры (FTS, версии строк) снимаются на время загрузки и создаются
+    # заново одним проходом в конце; UNIQUE (username) остаётся - по нему отсекаются повторы
+    objects = conn.execute("""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL
+        ORDER BY type = 'trigger', name
+    """, (table,)).fetchall()
+    for kind, name, _ in objects:
+        conn.execute(f"DROP {kind.upper()} {name}")
+    return [sql for _, _, sql in objects]
+
+
+def _has_fts(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'").fetchone() is not None
+
+
+def _finish(conn, kind, state):
+    # Возврат отложенных индексов и триггеров, затем пересчёт производных данных для загруженных строк
+    deferred = json.loads(state['deferred'])
+    for sql in deferred:
+        conn.execute(sql)
+    watermark = state['watermark']
+    if kind == 'users':
+        if deferred:
+            # Вместо триггера users_version_insert на каждую строку - одна новая версия на всю загрузку
+            conn.execute("UPDATE data_versions SET version = version + 1 WHERE name = 'users'")
+            conn.execute("""
+                UPDATE users SET version = (SELECT version FROM data_versions WHERE name = 'users') WHERE id > ?
+            """, (watermark,))
+            if _has_fts(conn):
+                conn.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+    else:
+        # Счётчик отзывов владельцев; это UPDATE заодно меняет версии их строк через триггер users_version_update
+        conn.execute("""
+            UPDATE users SET review_count = (SELECT COUNT(*) FROM reviews WHERE reviews.user_id = users.id)
+            WHERE id IN (SELECT DISTINCT user_id FROM reviews WHERE id > ?)
+        """, (watermark,))
+
+
+def _load_checkpoint(conn, name):
+    return conn.execute("SELECT * FROM bulk_checkpoints WHERE name = ?", (name,)).fetchone()
+
+
+def import_records(conn, kind, records, name, chunk=5000, commit_every=100000, defer=False, default_hash=None,
+                   restart=False):
+    # Загрузка потока записей пачками executemany. Прогресс хранится в bulk_checkpoints и коммитится
+    # вместе со строками: повторный запуск с тем же name пропускает уже записанные записи
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        state = _load_checkpoint(conn, name)
+        if state is not None and (restart or state['kind'] != kind):
+            # Начать заново: вернуть то, что отложила прошлая попытка
+            for sql in json.loads(state['deferred']):
+                conn.execute(sql)
+            conn.execute("DELETE FROM bulk_checkpoints WHERE name = ?", (name,))
+            state = None
+        if state is None:
+            watermark = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {kind}").fetchone()[0]
+            deferred = _drop_deferred(conn, kind) if defer else []
+            conn.execute("""
+                INSERT INTO bulk_checkpoints (name, kind, watermark, deferred, updated_at) VALUES (?, ?, ?, ?, ?)
+            """, (name, kind, watermark, json.dumps(deferred), time.time()))
+            state = _load_checkpoint(conn, name)
+        else:
+            logger.info("Продолжение загрузки %s с записи %d", name, state['records'])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    done, imported, skipped = state['records'], state['imported'], state['skipped']
+    records = itertools.islice(records, done, None)
+    insert = INSERT_USERS if kind == 'users' else INSERT_REVIEWS
+    uncommitted = 0
+    started = time.perf_counter()
+    try:
+        while True:
+            batch = list(itertools.islice(records, chunk))
+            if not batch:
+                break
+            if kind == 'users':
+                rows = [_user_row(record, default_hash) for record in batch]
+            else:
+                rows = [_review_row(record) for record in batch]
+            rows = [row for row in rows if row is not None]
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            # rowcount executemany - сумма вставленных строк без учёта триггеров
+            inserted = conn.executemany(insert, rows).rowcount if rows else 0
+            done += len(batch)
+            imported += inserted
+            skipped += len(batch) - inserted
+            conn.execute("""
+                UPDATE bulk_checkpoints SET records = ?, imported = ?, skipped = ?, updated_at = ? WHERE name = ?
+            """, (done, imported, skipped, time.time(), name))
+            uncommitted += len(batch)
+            if uncommitted >= commit_every:
+                conn.commit()
+                uncommitted = 0
+                logger.info("%s: записей %d, загружено %d, %.0f записей/с", name, done, imported,
+                            done / (time.perf_counter() - started))
+
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        _finish(conn, kind, state)
+        conn.execute("DELETE FROM bulk_checkpoints WHERE name = ?", (name,))
+        conn.commit()
+    except BaseException:
+        # Незакоммиченная пачка откатывается вместе со своей отметкой прогресса
+        conn.rollback()
+        raise
+    return {'records': done, 'imported': imported, 'skipped': skipped}
+
+
+def backup(database, destination, pages=1024, sleep=0.005):
+    # Онлайн-копия через backup API SQLite: копирует по pages страниц и между шагами отпускает БД,
+    # так что приложение продолжает читать и писать. Файл появляется под итоговым именем только целиком
+    tmp_path = f"{destination}.{os.getpid()}.tmp"
+    source = sqlite3.connect(database)
+    target = sqlite3.connect(tmp_path)
+    try:
+        def progress(status, remaining, total):
+            logger.debug("Резервная копия: осталось %d из %d страниц", remaining, total)
+
+        source.backup(target, pages=pages, progress=progress, sleep=sleep)
+    except BaseException:
+        target.close()
+        os.unlink(tmp_path)
+        raise
+    finally:
+        source.close()
+    target.close()
+    os.replace(tmp_path, destination)
+    return os.path.getsize(destination)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Массовая выгрузка и загрузка пользователей и отзывов, "
+                                                 "резервные копии БД")
+    parser.add_argument('--database', help="путь к БД, по умолчанию DATABASE из конфигурации")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="выгрузить таблицу в NDJSON или CSV")
+    export_parser.add_argument('kind', choices=KINDS)
+    export_parser.add_argument('output', help="файл .ndjson/.jsonl/.csv или - для stdout")
+    export_parser.add_argument('--format', choices=['ndjson', 'csv'])
+
+    import_parser = subparsers.add_parser('import', help="загрузить NDJSON или CSV")
+    import_parser.add_argument('kind', choices=KINDS)
+    import_parser.add_argument('input', help="файл .ndjson/.jsonl/.csv или - для stdin")
+    import_parser.add_argument('--format', choices=['ndjson', 'csv'])
+    import_parser.add_argument('--chunk', type=int, default=5000, help="строк на один executemany")
+    import_parser.add_argument('--commit-every', type=int, default=100000, help="строк на транзакцию")
+    import_parser.add_argument('--checkpoint', help="имя контрольной точки, по умолчанию <kind>:<путь к файлу>")
+    import_parser.add_argument('--restart', action='store_true', help="начать файл заново, забыв контрольную точку")
+    import_parser.add_argument('--defer', action='store_true',
+                               help="снять индексы и триггеры на время загрузки; только при остановленном приложении")
+    import_parser.add_argument('--default-password',
+                               help="пароль для записей без хэша; хэшируется один раз на всю загрузку")
+
+    backup_parser = subparsers.add_parser('backup', help="онлайн-копия БД без остановки приложения")
+    backup_parser.add_argument('output')
+    backup_parser.add_argument('--pages', type=int, default=1024, help="страниц за шаг")
+    args = parser.parse_args()
+
+    from teamfinder import create_app
+    overrides = {'STEAM_JOBS_WORKER': False}
+    if args.database:
+        overrides['DATABASE'] = os.path.abspath(args.database)
+    app = create_app(overrides)
+    if app.config['REPOSITORY_BACKEND'] != 'sqlite':
+        # Отложенные индексы, sqlite_master и backup API есть только у SQLite; для PostgreSQL - pg_dump и COPY
+        parser.error(f"bulk.py работает только с REPOSITORY_BACKEND=sqlite, сейчас "
+                     f"{app.config['REPOSITORY_BACKEND']}: используйте pg_dump/pg_restore или COPY")
+    database = app.config['DATABASE']
+
+    if args.command == 'backup':
+        size = backup(database, args.output, args.pages)
+        print(f"Копия {database} сохранена в {args.output}, {size / 1024 / 1024:.1f} МБ")
+    else:
+        with app.app_context(), app.extensions['db_pool'].connection() as conn:
+            if args.command == 'export':
+                count = export(conn, args.kind, args.output, args.format)
+                print(f"Выгружено записей: {count}", file=sys.stderr)
+            else:
+                import passwords
+                default_hash = passwords.hash_password(args.default_password) if args.default_password else None
+                name = args.checkpoint or f"{args.kind}:{os.path.abspath(args.input) if args.input != '-' else '-'}"
+                result = import_records(conn, args.kind, read_records(args.input, args.format), name,
+                                        chunk=args.chunk, commit_every=args.commit_every,
+                                        defer=args.defer, default_hash=default_hash, restart=args.restart)
+                print(f"Записей: {result['records']}, загружено: {result['imported']}, "
+                      f"пропущено: {result['skipped']}")
+                if args.kind == 'users':
+                    print("Библиотеки Steam и рекомендации: python jobs.py resync, python recommend.py build")
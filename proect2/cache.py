@@ -0,0 +1,182 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+
+from config import ProcessDefault, set_defaults, settings_from
+
+DEFAULT_CONFIG = {
+    'CACHE_BACKEND': 'memory',
+    'CACHE_MAX_ENTRIES': 10000,
+    'CACHE_TTL': 300,
+    # Готовые страницы живут меньше: в нескольких процессах сброс виден только локально
+    'CACHE_PAGE_TTL': 60,
+}
+
+_MISSING = object()
+
+
+class CacheBackend(ABC):
+    # Интерфейс хранилища; общий кэш (например, Redis) реализует те же методы
+
+    @abstractmethod
+    def get(self, key, default=None):
+        ...
+
+    @abstractmethod
+    def set(self, key, value, ttl=None):
+        ...
+
+    @abstractmethod
+    def delete(self, *keys):
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+    def stats(self):
+        return {}
+
+
+class NullCache(CacheBackend):
+    def __init__(self, **options):
+        self.misses = 0
+
+    def get(self, key, default=None):
+        self.misses += 1
+        return default
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {'entries': 0, 'hits': 0, 'misses': self.misses, 'evictions': 0, 'expirations': 0}
+
+
+class MemoryCache(CacheBackend):
+    def __init__(self, max_entries=10000, ttl=300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= self.clock():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = self.clock() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+BACKENDS = {
+    'memory': MemoryCache,
+    'null': NullCache,
+}
+
+def cache_from_config(config):
+    settings = settings_from(DEFAULT_CONFIG, config)
+    backend = BACKENDS[settings['CACHE_BACKEND']]
+    return backend(max_entries=settings['CACHE_MAX_ENTRIES'], ttl=settings['CACHE_TTL'])
+
+
+_default_cache = ProcessDefault('cache', lambda: cache_from_config(DEFAULT_CONFIG))
+
+
+def get_cache():
+    return _default_cache.get()
+
+
+def page_ttl():
+    if has_app_context():
+        return current_app.config['CACHE_PAGE_TTL']
+    return DEFAULT_CONFIG['CACHE_PAGE_TTL']
+
+
+def cached(key, loader, ttl=None):
+    # Read-through: None не кэшируется, чтобы только что созданные записи были видны сразу
+    cache = get_cache()
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        value = loader()
+        if value is not None:
+            cache.set(key, value, ttl)
+    return value
+
+
+# Ключи в одном месте, чтобы чтение и сброс не расходились
+def games_key(user_id):
+    return f"games:{user_id}"
+
+
+def profile_key(username):
+    return f"profile:{username}"
+
+
+def profile_page_key(username):
+    return f"page:profile:{username}"
+
+
+def invalidate_user(user_id, username=None):
+    keys = [games_key(user_id)]
+    if username:
+        keys += [profile_key(username), profile_page_key(username)]
+    get_cache().delete(*keys)
+
+
+def init_app(app):
+    set_defaults(app, DEFAULT_CONFIG)
+    cache = cache_from_config(app.config)
+    app.extensions['cache'] = cache
+    _default_cache.offer(cache)
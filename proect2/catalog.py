@@ -0,0 +1,38 @@
+# Общие справочники для форм регистрации, редактирования профиля и фильтров списка.
+# Значения хранятся в БД как есть, поэтому новые варианты добавляются только в конец.
+
+GAME_TYPES = (
+    'Шутеры',
+    'RTS',
+    'Хоррор',
+    'Action',
+    'Симулятор',
+    'Файтинг',
+    'Платформер',
+    'Глобальные стратегии',
+    'Wargames',
+    'RPG',
+    'MMORPG',
+)
+
+PLATFORMS = (
+    'PC',
+    'PlayStation',
+    'Xbox',
+    'Nintendo Switch',
+    'Mobile',
+)
+
+REGIONS = (
+    'Европа',
+    'СНГ',
+    'Северная Америка',
+    'Южная Америка',
+    'Азия',
+    'Океания',
+)
+
+
+def template_globals():
+    # Доступны во всех шаблонах, см. templates/_options.html
+    return {'GAME_TYPES': GAME_TYPES, 'PLATFORMS': PLATFORMS, 'REGIONS': REGIONS}
@@ -0,0 +1,110 @@
+import logging
+import os
+import secrets
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Каталог проекта: относительные пути из конфигурации отсчитываются от него, а не от текущего каталога,
+# так что приложение одинаково запускается из gunicorn, CLI и бенчмарков
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class Config:
+    # Любой ключ можно переопределить переменной окружения TEAMFINDER_<КЛЮЧ>,
+    # значения разбираются как JSON: TEAMFINDER_DB_POOL_SIZE=16, TEAMFINDER_DEBUG=true
+    DEBUG = False
+    LOG_LEVEL = 'INFO'
+    SECRET_KEY = None
+    # Файл с общим ключом, если SECRET_KEY не задан; все процессы на хосте читают один и тот же файл
+    SECRET_KEY_FILE = 'instance/secret_key'
+
+    # Относительные пути - от каталога проекта (см. resolve_path)
+    DATABASE = 'baze.db'
+    UPLOAD_FOLDER = 'static/avatars'
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
+
+    # Параметры production-сервера (gunicorn.conf.py)
+    BIND = '0.0.0.0:8000'
+    WORKERS = 2 * (os.cpu_count() or 1) + 1
+    THREADS = 4
+    GRACEFUL_TIMEOUT = 30
+    # Сколько доверенных прокси (nginx, балансировщик) стоит перед приложением. Если больше 0, адрес клиента
+    # и схема берутся из X-Forwarded-For/-Proto (werkzeug ProxyFix) - на них держатся лимиты попыток входа
+    # по IP и доступ к /metrics. Без прокси оставлять 0, иначе клиент подделает адрес заголовком
+    PROXY_FIX_X_FOR = 0
+    PROXY_FIX_X_PROTO = 0
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+    LOG_LEVEL = 'DEBUG'
+
+
+def resolve_path(path):
+    # ':memory:' и URI вида file:... передаются в sqlite3 как есть
+    if not path or path == ':memory:' or path.startswith('file:') or os.path.isabs(path):
+        return path
+    return os.path.join(PROJECT_ROOT, path)
+
+
+def load_secret_key(path):
+    # Ключ создаётся один раз: пишем во временный файл и публикуем через os.link,
+    # который не перезаписывает существующий файл, поэтому все воркеры получают один ключ
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(secrets.token_hex(32))
+    try:
+        os.link(tmp_path, path)
+        logger.warning("SECRET_KEY не задан, создан новый ключ в %s. "
+                       "Для нескольких хостов задайте TEAMFINDER_SECRET_KEY", path)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp_path)
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+
+def settings_from(defaults, config):
+    # DEFAULT_CONFIG модуля, переопределённый ключами из config (app.config или словарь CLI)
+    settings = dict(defaults)
+    settings.update({key: config[key] for key in defaults if key in config})
+    return settings
+
+
+def set_defaults(app, defaults):
+    for key, value in defaults.items():
+        app.config.setdefault(key, value)
+
+
+class ProcessDefault:
+    # Объект модуля (пул, кэш, поток записи) для кода вне контекста приложения - фоновых потоков и CLI.
+    # Его задаёт первый init_app процесса; без приложения создаётся factory при первом обращении
+    def __init__(self, extension, factory=None):
+        self.extension = extension
+        self.factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        from flask import current_app, has_app_context
+
+        if has_app_context():
+            return current_app.extensions.get(self.extension)
+        with self._lock:
+            if self._value is None and self.factory is not None:
+                self._value = self.factory()
+            return self._value
+
+    def offer(self, value):
+        with self._lock:
+            if self._value is None:
+                self._value = value
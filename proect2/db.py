@@ -0,0 +1,225 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context, current_app
+
+from config import ProcessDefault, resolve_path, set_defaults, settings_from
+from metrics import TimedConnection
+
+logger = logging.getLogger(__name__)
+
+DATABASE = 'baze.db'
+
+# Значения по умолчанию, любое можно переопределить через app.config
+DEFAULT_CONFIG = {
+    'DB_POOL_SIZE': 8,
+    'DB_POOL_TIMEOUT': 5.0,
+    'DB_BUSY_TIMEOUT': 5000,
+    'DB_SYNCHRONOUS': 'NORMAL',
+    'DB_CACHE_SIZE': -16000,  # отрицательное значение - размер в КиБ
+    'DB_MMAP_SIZE': 64 * 1024 * 1024,
+    'DB_STATEMENT_CACHE': 128,
+}
+
+SYNCHRONOUS_MODES = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, database, size=8, timeout=5.0, busy_timeout=5000, synchronous='NORMAL',
+                 cache_size=-16000, mmap_size=64 * 1024 * 1024, statement_cache=128):
+        if synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Недопустимый режим synchronous: {synchronous}")
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.busy_timeout = int(busy_timeout)
+        self.synchronous = synchronous.upper()
+        self.cache_size = int(cache_size)
+        self.mmap_size = int(mmap_size)
+        self.statement_cache = statement_cache
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+        self.created = 0
+        self.checkouts = 0
+        self.in_use = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+
+    def _connect(self, synchronous=None):
+        # cached_statements - размер кэша подготовленных выражений на соединение,
+        # TimedConnection замеряет каждое выражение для /metrics
+        conn = sqlite3.connect(self.database, timeout=self.busy_timeout / 1000, factory=TimedConnection,
+                               check_same_thread=False, cached_statements=self.statement_cache)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout}")
+        conn.execute(f"PRAGMA synchronous={synchronous or self.synchronous}")
+        conn.execute(f"PRAGMA cache_size={self.cache_size}")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        with self._lock:
+            self.created += 1
+        return conn
+
+    def open_dedicated(self, synchronous=None):
+        # Отдельное соединение с теми же настройками вне пула и его лимита (поток записи):
+        # владелец закрывает его сам
+        if synchronous is not None and synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Недопустимый режим synchronous: {synchronous}")
+        return self._connect(synchronous and synchronous.upper())
+
+    def acquire(self):
+        if self._closed:
+            raise PoolTimeout("Пул соединений закрыт")
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeout(f"Нет свободных соединений с {self.database} за {self.timeout} с")
+        waited = time.perf_counter() - started
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+        return conn
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._closed:
+                conn.close()
+            else:
+                self._idle.put(conn)
+        except sqlite3.Error as e:
+            logger.error("Соединение с БД повреждено и будет закрыто: %s", e)
+            conn.close()
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def drain(self, timeout=30.0):
+        # Плавная остановка: новые соединения не выдаются, ждём возврата выданных и закрываем все
+        self._closed = True
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                in_use = self.in_use
+            if in_use == 0 or time.monotonic() >= deadline:
+                break
+            time.sleep(0.05)
+        self.close()
+        if in_use:
+            logger.warning("Пул %s закрыт, не дождавшись %d соединений", self.database, in_use)
+        return in_use == 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'created': self.created,
+                'idle': self._idle.qsize(),
+                'in_use': self.in_use,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_time_total': self.wait_time,
+                'wait_time_max': self.max_wait,
+                'wait_time_avg': self.wait_time / self.checkouts if self.checkouts else 0.0,
+            }
+
+
+def pool_from_config(config):
+    settings = settings_from(DEFAULT_CONFIG, config)
+    return ConnectionPool(
+        resolve_path(config.get('DATABASE', DATABASE)),
+        size=settings['DB_POOL_SIZE'],
+        timeout=settings['DB_POOL_TIMEOUT'],
+        busy_timeout=settings['DB_BUSY_TIMEOUT'],
+        synchronous=settings['DB_SYNCHRONOUS'],
+        cache_size=settings['DB_CACHE_SIZE'],
+        mmap_size=settings['DB_MMAP_SIZE'],
+        statement_cache=settings['DB_STATEMENT_CACHE'],
+    )
+
+
+_default_pool = ProcessDefault('db_pool', lambda: pool_from_config(DEFAULT_CONFIG))
+
+
+def get_pool():
+    return _default_pool.get()
+
+
+def get_db():
+    # Одно соединение на контекст приложения, возвращается в пул в teardown
+    if 'db_conn' not in g:
+        g.db_conn = get_pool().acquire()
+    return g.db_conn
+
+
+@contextmanager
+def connection():
+    # Внутри запроса отдаёт соединение запроса, вне его (CLI, фоновые потоки) - берёт из пула
+    if has_app_context():
+        yield get_db()
+    else:
+        with get_pool().connection() as conn:
+            yield conn
+
+
+def close_db(exception=None):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        current_app.extensions['db_pool'].release(conn)
+
+
+def init_app(app):
+    set_defaults(app, DEFAULT_CONFIG)
+    app.config.setdefault('DATABASE', DATABASE)
+    pool = pool_from_config(app.config)
+    app.extensions['db_pool'] = pool
+    app.teardown_appcontext(close_db)
+    # Фоновые потоки и CLI без контекста приложения работают через тот же пул
+    _default_pool.offer(pool)
+
+
+def pool_stats():
+    return get_pool().stats()
@@ -1,22 +1,18 @@
-import os
 import logging
-import sqlite3
-from werkzeug.utils import secure_filename
-import requests
-from flask import Flask
+from steam import get_library_cache
+from search import PAGE_SIZE
+from repository import get_repository
+from snapshot import get_directory
+import cache
+import writer
+from cache import cached
 
-# Настройка логирования
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # Константы
-DATABASE = 'baze.db'
 UPLOAD_FOLDER = 'static/avatars'
+REVIEWS_PAGE_SIZE = 20
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp3', 'wav'}
-STEAM_API_KEY = "8337B627A76CD0F2447464B6F59CFCE4"
-
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
 
 
 
@@ -24,117 +20,159 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def get_users(sort_by='name', age_filter=None, search_query=None, game_type_filter=None, platform_filter=None, region_filter=None):
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    query = "SELECT id, name, age, game_type, avatar, username, steam_profile_url, steam_games FROM users"  # Добавляем username
-    parameters = []
-    conditions = []
-
-    if age_filter:
-        conditions.append("age >= ?")
-        parameters.append(age_filter)
-
-    if search_query:
-        conditions.append("name LIKE ?")
-        parameters.append(f"%{search_query}%")
-
-    if game_type_filter:
-        conditions.append("game_type = ?")
-        parameters.append(game_type_filter)
-
-    if platform_filter:
-        conditions.append("platform = ?")
-        parameters.append(platform_filter)
-
-    if region_filter:
-        conditions.append("region = ?")
-        parameters.append(region_filter)
-
-    if conditions:
-        query += " WHERE " + " AND ".join(conditions)
-
-    query += f" ORDER BY {sort_by}"
-    cursor.execute(query, parameters)
-    users = cursor.fetchall()
-    conn.close()
-    return users
+    return get_repository().list_users(sort_by, age_filter, search_query, game_type_filter, platform_filter,
+                                       region_filter)
+
+def get_users_page(sort_by='name', age_filter=None, search_query=None, game_type_filter=None, platform_filter=None,
+                   region_filter=None, after=None, page_size=PAGE_SIZE):
+    # Возвращает (строки страницы, курсор следующей страницы или None).
+    # Без поиска отвечает снимок в памяти, если он включён (строки - только snapshot.DIRECTORY_COLUMNS)
+    directory = get_directory()
+    if directory is not None and not search_query:
+        return directory.page(sort_by, age_filter, game_type_filter, platform_filter, region_filter, after, page_size)
+    return get_repository().users_page(sort_by, age_filter, search_query, game_type_filter, platform_filter,
+                                       region_filter, after, page_size)
+
+def count_users(age_filter=None, search_query=None, game_type_filter=None, platform_filter=None, region_filter=None):
+    directory = get_directory()
+    if directory is not None and not search_query:
+        return directory.count(age_filter, game_type_filter, platform_filter, region_filter)
+    return get_repository().count_users(age_filter, search_query, game_type_filter, platform_filter, region_filter)
+
+def iter_users(sort_by='name', age_filter=None, search_query=None, game_type_filter=None, platform_filter=None,
+               region_filter=None, chunk_size=500):
+    # Генератор для выгрузок: строки читаются порциями, в памяти не больше chunk_size строк
+    return get_repository().iter_users(sort_by, age_filter, search_query, game_type_filter, platform_filter,
+                                       region_filter, chunk_size)
 
 def get_user_by_username(username):
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, age, game_type, avatar, username, description, steam_profile_url, steam_games FROM users WHERE username = ?",
-                   (username,))
-    user = cursor.fetchone()
-    conn.close()
-    return user
+    # Строку правит сам пользователь, а сброс кэша виден только своему процессу: без кэша форма правки
+    # и рекомендации не показывают данные, устаревшие после записи в другом воркере
+    return get_repository().user_by_username(username)
+
+def get_credentials(username):
+    # id и хэш пароля для входа; не кэшируется
+    return get_repository().credentials(username)
 
 def get_profile(user_id):
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, age, game_type, avatar, username, description, steam_profile_url, steam_games FROM users WHERE id = ?",
-                   (user_id,))
-    profile = cursor.fetchone()
-    conn.close()
-    return profile
+    # Не кэшируется, как get_user_by_username
+    return get_repository().user_by_id(user_id)
 
 def get_reviews(user_id):
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT review_text, created_at, user_id, reviewer_username FROM reviews WHERE user_id = ?", (user_id,))
-    reviews = cursor.fetchall()
-    conn.close()
-    return reviews
+    # Отзывы добавляются в любом воркере; страница профиля читает их через get_profile_with_reviews с проверкой версии
+    return get_repository().reviews(user_id)
+
+def get_profile_with_reviews(username, limit=REVIEWS_PAGE_SIZE):
+    # Возвращает (пользователь, отзывы, курсор следующей порции отзывов) или None
+    return cached(cache.profile_key(username), lambda: get_repository().profile_with_reviews(username, limit))
+
+def get_reviews_page(user_id, before=None, limit=REVIEWS_PAGE_SIZE):
+    return get_repository().reviews_page(user_id, before, limit)
+
+def get_users_version():
+    # Растёт при любом изменении пользователей; без кэша, запрос по ключу
+    return get_repository().users_version()
+
+def get_user_version(username):
+    # Версия строки пользователя, меняется и при новых отзывах, и при записи библиотеки; None - нет такого
+    return get_repository().user_version(username)
+
+def _invalidate_user(user_id, username=None):
+    # Сбрасывает закэшированные строку пользователя, отзывы, библиотеку и готовую страницу профиля
+    if username is None:
+        profile = get_profile(user_id)
+        username = profile['username'] if profile else None
+    cache.invalidate_user(user_id, username)
 
 def add_review(user_id, review_text, reviewer_username):
-    conn = sqlite3.connect('baze.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    # Возвращает username автора профиля или None, если профиля нет или запись не удалась.
+    # В SQLite запись идёт через общий поток записи (writer.py); при переполненной очереди - WriterBusy
     try:
-        cursor.execute("INSERT INTO reviews (user_id, review_text, reviewer_username) VALUES (?, ?, ?)",
-                       (user_id, review_text, reviewer_username))
-        conn.commit()
+        username = get_repository().add_review(user_id, review_text, reviewer_username)
+    except writer.WriterBusy:
+        raise
     except Exception as e:
-        logger.error(f"Ошибка при добавлении отзыва: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
-
-def edit_profile_data(user_id, new_age, new_description, new_game_type, steam_profile_url, steam_games_str):
-    conn = sqlite3.connect('baze.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+        logger.error("Ошибка при добавлении отзыва: %s", e)
+        return None
+    if username is not None:
+        _invalidate_user(user_id, username)
+    return username
+
+def edit_profile_data(user_id, new_age, new_description, new_game_type, steam_profile_url, steam_games=None,
+                      platform=None, region=None, steam_id=None):
     try:
-        cursor.execute("UPDATE users SET age=?, description=?, game_type=?, steam_profile_url=?, steam_games=? WHERE id=?",
-                       (new_age, new_description, new_game_type, steam_profile_url, steam_games_str, user_id))
-        conn.commit()
-        return True  # Успех
+        username = get_repository().update_profile(user_id, new_age, new_description, new_game_type,
+                                                   steam_profile_url, steam_games, platform, region, steam_id)
+    except writer.WriterBusy:
+        raise
     except Exception as e:
-        logger.error(f"Ошибка при обновлении профиля: {e}")
-        conn.rollback()
+        logger.error("Ошибка при обновлении профиля: %s", e)
         return False  # Ошибка
-    finally:
-        conn.close()
+    _invalidate_user(user_id, username)
+    return True  # Успех
+
+def create_user(name, username, password_hash, age, description, game_type, avatar_path, avatar_hash,
+                steam_profile_url=None, steam_id=None, platform=None, region=None):
+    # id нового пользователя или None, если имя занято. Ошибки БД и WriterBusy пробрасываются
+    return get_repository().create_user(name, username, password_hash, age, description, game_type, avatar_path,
+                                        avatar_hash, steam_profile_url, steam_id, platform, region)
+
+def update_password(user_id, password_hash):
+    get_repository().update_password(user_id, password_hash)
+    _invalidate_user(user_id)
 
-def get_steam_games(steam_id):
-    if not steam_id or not STEAM_API_KEY:
-        return []
 
-    url = f"http://api.steampowered.com/IPlayerService/GetOwnedGames/v0001/?key={STEAM_API_KEY}&steamid={steam_id}&include_appinfo=1&format=json"
+def save_user_games(user_id, games):
+    # Полностью заменяет библиотеку пользователя одной операцией записи
+    return save_user_libraries([(user_id, games)])
+
+
+def save_user_libraries(libraries):
+    # Пакетная запись библиотек без очереди задач: libraries - список (user_id, games),
+    # все библиотеки - одна операция записи. Фоновая загрузка пишет через finish_steam_jobs
+    if not libraries:
+        return True
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        if 'response' in data and 'games' in data['response']:
-            games = data['response']['games']
-            return games
-        else:
-            return []
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка при запросе к Steam API: {e}")
-        return []
+        get_repository().save_user_libraries(libraries)
+    except Exception as e:
+        logger.error("Ошибка при сохранении библиотек Steam: %s", e)
+        return False
+    for user_id, _ in libraries:
+        _invalidate_user(user_id)
+    return True
+
+
+def finish_steam_jobs(libraries, retries, failures):
+    # Итог пачки фоновой загрузки одной операцией записи: user_id записанных библиотек или None при ошибке
+    # записи (задачи остаются running и вернутся в очередь по истечении STEAM_JOBS_LEASE)
+    try:
+        saved = get_repository().finish_steam_jobs(libraries, retries, failures)
+    except Exception as e:
+        logger.error("Ошибка при сохранении библиотек Steam: %s", e)
+        return None
+    for user_id in saved:
+        _invalidate_user(user_id)
+    return saved
+
+
+def get_user_games(user_id):
+    # Кэш без проверки версии: вызывается страницей профиля после сверки версии строки, которая сбрасывает
+    # записи пользователя в этом процессе при расхождении
+    return cached(cache.games_key(user_id), lambda: get_repository().user_games(user_id))
 
+
+def get_game_owners(appid):
+    return get_repository().game_owners(appid)
+
+
+def get_recommendations(user_id, limit=20):
+    # Готовые соседи из user_neighbors (заполняется recommend.py), без расчётов на запрос
+    return get_repository().recommendations(user_id, limit)
+
+
+def get_steam_games(steam_id):
+    # Синхронное получение библиотеки через общий кэш: одновременные запросы склеиваются,
+    # ошибки Steam кэшируются и возвращаются как пустой список
+    if not steam_id:
+        return []
+    return get_library_cache().get_or_fetch(steam_id)
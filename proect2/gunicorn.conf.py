@@ -0,0 +1,36 @@
+import json
+import os
+
+from config import Config
+
+
+def _setting(name):
+    # Те же переменные окружения TEAMFINDER_*, что читает create_app
+    value = os.environ.get(f"TEAMFINDER_{name}")
+    if value is None:
+        return getattr(Config, name)
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+bind = _setting('BIND')
+workers = int(_setting('WORKERS'))
+threads = int(_setting('THREADS'))
+worker_class = 'gthread'
+graceful_timeout = int(_setting('GRACEFUL_TIMEOUT'))
+timeout = 60
+keepalive = 5
+# Приложение создаётся в каждом воркере отдельно: соединения SQLite нельзя наследовать через fork
+preload_app = False
+max_requests = 10000
+max_requests_jitter = 1000
+accesslog = '-'
+
+
+def worker_exit(server, worker):
+    from teamfinder import shutdown
+    app = getattr(worker, 'wsgi', None)
+    if app is not None:
+        shutdown(app, graceful_timeout)
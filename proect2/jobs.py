@@ -0,0 +1,307 @@
+import argparse
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from flask import current_app, has_app_context
+
+import recommend
+from config import resolve_path, set_defaults, settings_from
+from funcs import finish_steam_jobs
+from repository import get_repository
+from steam import SteamError, SteamRateLimited
+from steamid import resolve_users
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'STEAM_JOBS_WORKER': True,  # обрабатывать очередь в фоновом потоке процесса приложения
+    'STEAM_JOBS_CONCURRENCY': 4,  # одновременных запросов к Steam
+    'STEAM_JOBS_RATE': 10.0,  # не больше стольких запросов к Steam в секунду
+    # Очередь на хосте обрабатывает один процесс, державший блокировку этого файла, поэтому
+    # STEAM_JOBS_RATE - лимит на хост, а не на каждый воркер gunicorn; остальные ждут в резерве
+    'STEAM_JOBS_LOCK_FILE': 'instance/steam_jobs.lock',
+    'STEAM_JOBS_BATCH_SIZE': 50,
+    'STEAM_JOBS_MAX_ATTEMPTS': 5,
+    'STEAM_JOBS_BACKOFF': 30,  # задержка перед повтором в секундах, удваивается с каждой попыткой
+    'STEAM_JOBS_POLL_INTERVAL': 5,
+    'STEAM_JOBS_LEASE': 300,  # задача в статусе running дольше этого считается брошенной
+}
+
+
+def enqueue(user_id, steam_id, delay=0):
+    # Повторная постановка сбрасывает попытки: пользователь мог поменять ссылку на профиль
+    get_repository().enqueue_steam_jobs([(user_id, steam_id)], delay)
+    wake()
+
+
+def cancel(user_id):
+    get_repository().cancel_steam_job(user_id)
+
+
+def wake():
+    # Профиль и регистрация ставят задачу в своей транзакции записи, после неё будим фоновый поток
+    worker = get_worker()
+    if worker is not None:
+        worker.wake()
+
+
+def resync(batch_size=500):
+    # Ставит в очередь всех пользователей со SteamID, по batch_size строк за транзакцию.
+    # Ссылки, для которых ID ещё не определён, сначала разрешаются пакетно
+    resolved = resolve_users(batch_size)
+    if resolved:
+        logger.info("Определены SteamID для %d профилей", resolved)
+    queued = 0
+    last_id = 0
+    while True:
+        rows = get_repository().users_with_steam_id(last_id, batch_size)
+        if not rows:
+            return queued
+        get_repository().enqueue_steam_jobs([(row['id'], row['steam_id']) for row in rows])
+        queued += len(rows)
+        last_id = rows[-1]['id']
+        logger.info("В очередь поставлено %d профилей", queued)
+
+
+def queue_stats():
+    return get_repository().steam_job_stats()
+
+
+class WorkerLock:
+    # Неблокирующая блокировка файла; ОС снимает её, когда процесс-владелец завершается
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        if self._file is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        file = open(self.path, 'a+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            file.close()
+            return False
+        self._file = file
+        return True
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class SteamJobWorker:
+    def __init__(self, client, app=None, concurrency=4, rate=10.0, batch_size=50, max_attempts=5, backoff=30,
+                 poll_interval=5, lease=300, lock=None):
+        self.client = client
+        self.app = app
+        self.lock = lock
+        self.concurrency = concurrency
+        self.rate = rate
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.lease = lease
+
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='steam-jobs')
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+
+        self.fetched = 0
+        self.discarded = 0
+        self.retried = 0
+        self.failed = 0
+        self.rate_limited = 0
+
+    def _throttle(self):
+        # Равномерно распределяет запросы: не чаще rate в секунду (один обрабатывающий процесс, см. WorkerLock)
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._paused_until)
+            self._next_slot = slot + 1.0 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _fetch(self, steam_id):
+        self._throttle()
+        return self.client.get_owned_games(steam_id)
+
+    def _retry_delay(self, attempts):
+        # Экспоненциальная задержка со случайным разбросом, чтобы повторы не шли пачкой
+        return self.backoff * 2 ** (attempts - 1) * random.uniform(0.5, 1.5)
+
+    def run_once(self):
+        # Обрабатывает одну пачку задач, возвращает число взятых задач
+        jobs = get_repository().claim_steam_jobs(self.batch_size, self.lease)
+        if not jobs:
+            return 0
+
+        libraries = []
+        retries = []
+        failures = []
+        futures = {self._executor.submit(self._fetch, job['steam_id']): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                libraries.append((job['user_id'], job['steam_id'], future.result()))
+            except SteamRateLimited as e:
+                # 429 не считается попыткой: приостанавливаем все запросы и возвращаем задачу в очередь
+                delay = e.retry_after or self.backoff
+                with self._lock:
+                    self.rate_limited += 1
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                retries.append((time.time() + delay, str(e), job['attempts'] - 1, job['user_id']))
+            except SteamError as e:
+                if job['attempts'] >= self.max_attempts:
+                    failures.append((str(e), job['user_id']))
+                else:
+                    retries.append((time.time() + self._retry_delay(job['attempts']), str(e), job['attempts'],
+                                    job['user_id']))
+
+        # Библиотеки и статусы задач записываются одной транзакцией; библиотека отменённой или заново
+        # поставленной задачи (пользователь сменил или убрал ссылку) не записывается
+        saved = finish_steam_jobs(libraries, retries, failures)
+        if saved is None:
+            return len(jobs)
+        if saved:
+            recommend.schedule_update(saved)
+        with self._lock:
+            self.fetched += len(saved)
+            self.discarded += len(libraries) - len(saved)
+            self.retried += len(retries)
+            self.failed += len(failures)
+        if failures:
+            logger.warning("Не удалось загрузить библиотеки Steam для %d пользователей", len(failures))
+        return len(jobs)
+
+    def _run_batch(self):
+        if self.app is None:
+            return self.run_once()
+        with self.app.app_context():
+            return self.run_once()
+
+    def run(self, until_empty=False):
+        while not self._stopped.is_set():
+            if self.lock is not None and not self.lock.acquire():
+                # Очередь обрабатывает другой процесс; подхватываем её, когда он завершится
+                if until_empty:
+                    logger.warning("Очередь Steam уже обрабатывает другой процесс (%s)", self.lock.path)
+                    return
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            try:
+                processed = self._run_batch()
+            except Exception:
+                logger.exception("Ошибка обработки очереди Steam")
+                processed = 0
+            if processed:
+                continue
+            if until_empty:
+                return
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def wake(self):
+        self._wake.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='steam-jobs', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+        if self.lock is not None:
+            self.lock.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'fetched': self.fetched,
+                'discarded': self.discarded,
+                'retried': self.retried,
+                'failed': self.failed,
+                'rate_limited': self.rate_limited,
+            }
+
+
+def worker_from_config(config, client, app=None):
+    settings = settings_from(DEFAULT_CONFIG, config)
+    return SteamJobWorker(client, app,
+                          concurrency=settings['STEAM_JOBS_CONCURRENCY'],
+                          rate=settings['STEAM_JOBS_RATE'],
+                          batch_size=settings['STEAM_JOBS_BATCH_SIZE'],
+                          max_attempts=settings['STEAM_JOBS_MAX_ATTEMPTS'],
+                          backoff=settings['STEAM_JOBS_BACKOFF'],
+                          poll_interval=settings['STEAM_JOBS_POLL_INTERVAL'],
+                          lease=settings['STEAM_JOBS_LEASE'],
+                          lock=WorkerLock(resolve_path(settings['STEAM_JOBS_LOCK_FILE'])))
+
+
+def get_worker():
+    if has_app_context():
+        return current_app.extensions.get('steam_jobs')
+    return None
+
+
+def init_app(app):
+    set_defaults(app, DEFAULT_CONFIG)
+    worker = worker_from_config(app.config, app.extensions['steam_cache'].client, app)
+    app.extensions['steam_jobs'] = worker
+    if app.config['STEAM_JOBS_WORKER']:
+        worker.start()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Фоновая загрузка библиотек Steam")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    resync_parser = subparsers.add_parser('resync', help="поставить в очередь все профили со SteamID")
+    resync_parser.add_argument('--batch-size', type=int, default=500)
+    resync_parser.add_argument('--wait', action='store_true', help="сразу обработать очередь до конца")
+    work_parser = subparsers.add_parser('work', help="обрабатывать очередь")
+    work_parser.add_argument('--once', action='store_true', help="выйти, когда очередь опустеет")
+    subparsers.add_parser('stats', help="число задач по статусам")
+    args = parser.parse_args()
+
+    from teamfinder import create_app
+    # Отдельный процесс: фоновый поток не нужен, очередь обрабатывается в основном потоке
+    app = create_app({'STEAM_JOBS_WORKER': False})
+    worker = app.extensions['steam_jobs']
+    with app.app_context():
+        if args.command == 'resync':
+            print(f"Поставлено в очередь: {resync(args.batch_size)}")
+        elif args.command == 'stats':
+            print(queue_stats())
+    if args.command == 'work' or getattr(args, 'wait', False):
+        try:
+            worker.run(until_empty=args.command == 'resync' or args.once)
+        except KeyboardInterrupt:
+            pass
+        print(worker.stats())
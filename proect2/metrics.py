@@ -0,0 +1,347 @@
+import bisect
+import cProfile
+import hashlib
+import ipaddress
+import itertools
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from config import resolve_path, set_defaults
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'METRICS_ENABLED': True,
+    'METRICS_PATH': '/metrics',
+    # Адреса и сети, которым доступна выгрузка метрик; пустой список - доступ для всех
+    'METRICS_ALLOW': ('127.0.0.1/32', '::1/128'),
+    # Профилировать каждый N-й запрос (0 - выключено), результаты в PROFILE_DIR
+    'PROFILE_EVERY_N': 0,
+    'PROFILE_DIR': 'instance/profiles',
+}
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                # Счётчики по корзинам + сумма + количество
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labelvalues, (counts, total, count) in sorted(self._series.items()):
+                for bound, cumulative in zip(self.buckets + (float('inf'),), itertools.accumulate(counts)):
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labelvalues)} {count}")
+        return lines
+
+
+class Gauges:
+    # Значения, которые считаются в момент выгрузки (состояние пула, кэшей)
+    def __init__(self, name, documentation, collect):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        # collect() возвращает пары (((метка, значение), ...), число)
+        for labels, value in self.collect():
+            names = [label for label, _ in labels]
+            values = [label_value for _, label_value in labels]
+            lines.append(f"{self.name}{_labels(names, values)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauges(self, name, documentation, collect):
+        return self.register(Gauges(name, documentation, collect))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.histogram('teamfinder_request_duration_seconds', "Время обработки запроса",
+                                     ('endpoint', 'method', 'status'))
+QUERY_LATENCY = REGISTRY.histogram('teamfinder_sql_query_duration_seconds', "Время выполнения SQL-выражения",
+                                   ('statement',))
+QUERY_ERRORS = REGISTRY.counter('teamfinder_sql_query_errors_total', "Ошибки SQL", ('statement', 'error'))
+STEAM_LATENCY = REGISTRY.histogram('teamfinder_steam_request_duration_seconds', "Время запроса к Steam API",
+                                   ('method', 'outcome'))
+STEAM_ERRORS = REGISTRY.counter('teamfinder_steam_errors_total', "Ошибки запросов к Steam API", ('method', 'kind'))
+TEMPLATE_LATENCY = REGISTRY.histogram('teamfinder_template_render_duration_seconds', "Время рендеринга шаблона",
+                                      ('template',))
+
+_enabled = True
+_WHITESPACE = re.compile(r'\s+')
+# Литералы, которые psycopg2 подставляет в текст (execute_values, mogrify), считаются плейсхолдерами
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+# Списки плейсхолдеров разной длины (IN (?, ?, ...), VALUES) - одно и то же выражение
+_PLACEHOLDERS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_ROWS = re.compile(r'\(\?\)(?:\s*,\s*\(\?\))+')
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE|INDEX \w+ ON)\s+(\w+)', re.IGNORECASE)
+_statement_labels = {}
+
+
+def statement_label(sql):
+    # Метка - глагол, таблица и хэш нормализованного текста: варианты запроса не сливаются в одну серию
+    # из-за обрезки, а текст SQL не попадает в выгрузку. Соответствие хэша тексту пишется в лог
+    label = _statement_labels.get(sql)
+    if label is None:
+        text = sql.decode('utf-8', 'replace') if isinstance(sql, bytes) else str(sql)
+        normalized = _LITERALS.sub('?', _WHITESPACE.sub(' ', text).strip())
+        normalized = _ROWS.sub('(?)', _PLACEHOLDERS.sub('(?)', normalized))
+        verb = normalized.split(' ', 1)[0].upper() if normalized else 'EMPTY'
+        table = _TABLE.search(normalized)
+        digest = hashlib.sha1(normalized.encode()).hexdigest()[:12]
+        label = f"{verb} {table.group(1) if table else '-'} {digest}"
+        # Тексты с подставленными значениями (bytes от psycopg2) не кэшируются - каждый уникален
+        if isinstance(sql, str) and len(_statement_labels) < 10000:
+            _statement_labels[sql] = label
+            logger.debug("SQL-метка %s: %s", label, normalized)
+    return label
+
+
+def _timed(call, error, sql, parameters):
+    if not _enabled:
+        return call(sql, parameters)
+    started = time.perf_counter()
+    try:
+        return call(sql, parameters)
+    except error as e:
+        QUERY_ERRORS.inc(statement_label(sql), type(e).__name__)
+        raise
+    finally:
+        QUERY_LATENCY.observe(time.perf_counter() - started, statement_label(sql))
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        return _timed(super().execute, sqlite3.Error, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return _timed(super().executemany, sqlite3.Error, sql, seq_of_parameters)
+
+
+class TimedConnection(sqlite3.Connection):
+    # Connection.execute() создаёт обычный курсор в обход cursor(), поэтому переопределены все три метода
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def timed_cursor_factory(base, error):
+    # Те же замеры для psycopg2: подкласс курсора пула (RealDictCursor), error - psycopg2.Error
+    class TimedPostgresCursor(base):
+        def execute(self, query, vars=None):
+            return _timed(super().execute, error, query, vars)
+
+        def executemany(self, query, vars_list):
+            return _timed(super().executemany, error, query, vars_list)
+
+    return TimedPostgresCursor
+
+
+def observe_steam(method, started, outcome):
+    STEAM_LATENCY.observe(time.perf_counter() - started, method, outcome)
+    if outcome != 'ok':
+        STEAM_ERRORS.inc(method, outcome)
+
+
+def _collect_pool():
+    from flask import current_app
+    stats = current_app.extensions['db_pool'].stats()
+    return [((('stat', key),), value) for key, value in stats.items()]
+
+
+def _collect_caches():
+    from flask import current_app
+    values = []
+    for name in ('cache', 'steam_cache', 'passwords'):
+        if name in current_app.extensions:
+            for key, value in current_app.extensions[name].stats().items():
+                values.append(((('cache', name), ('stat', key)), value))
+    return values
+
+
+def _collect_jobs():
+    from flask import current_app
+    worker = current_app.extensions.get('steam_jobs')
+    return [((('stat', key),), value) for key, value in worker.stats().items()] if worker else []
+
+
+def _collect_writer():
+    from flask import current_app
+    writer = current_app.extensions.get('writer')
+    return [((('stat', key),), value) for key, value in writer.stats().items()] if writer else []
+
+
+def _collect_directory():
+    from flask import current_app
+    directory = current_app.extensions.get('directory')
+    return [((('stat', key),), value) for key, value in directory.stats().items()] if directory else []
+
+
+REGISTRY.gauges('teamfinder_db_pool', "Состояние пула соединений SQLite", _collect_pool)
+REGISTRY.gauges('teamfinder_cache', "Счётчики кэшей", _collect_caches)
+REGISTRY.gauges('teamfinder_steam_jobs', "Счётчики фоновой загрузки библиотек Steam", _collect_jobs)
+REGISTRY.gauges('teamfinder_writer', "Очередь и пачки потока записи", _collect_writer)
+REGISTRY.gauges('teamfinder_directory', "Снимок списка пользователей в памяти", _collect_directory)
+
+
+def _address_allowed(address, networks):
+    try:
+        address = ipaddress.ip_address(address or '')
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+
+def init_app(app):
+    global _enabled
+    from flask import Response, abort, g, request, before_render_template, template_rendered
+
+    set_defaults(app, DEFAULT_CONFIG)
+    _enabled = app.config['METRICS_ENABLED']
+    if not _enabled:
+        return
+
+    profile_every = int(app.config['PROFILE_EVERY_N'])
+    profile_dir = resolve_path(app.config['PROFILE_DIR'])
+    request_numbers = itertools.count(1)
+    render_started = threading.local()
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        if profile_every and next(request_numbers) % profile_every == 0:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # В другом потоке уже идёт профилирование, этот запрос пропускаем
+                return
+            g.profiler = profiler
+
+    @app.after_request
+    def remember_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request(exc):
+        # teardown вызывается и после необработанного исключения, когда after_request мог не выполниться:
+        # такой запрос записывается со статусом 500
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(profile_dir, exist_ok=True)
+            endpoint = (request.endpoint or 'unknown').replace('.', '_')
+            path = os.path.join(profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{endpoint}.prof")
+            profiler.dump_stats(path)
+            logger.info("Профиль запроса %s сохранён в %s", request.path, path)
+        started = g.pop('metrics_started', None)
+        status = g.pop('metrics_status', 500)
+        if started is not None:
+            REQUEST_LATENCY.observe(time.perf_counter() - started, request.endpoint or 'unknown', request.method,
+                                    str(status))
+
+    def template_started(sender, template, context, **extra):
+        render_started.__dict__.setdefault('stack', []).append(time.perf_counter())
+
+    def template_finished(sender, template, context, **extra):
+        stack = getattr(render_started, 'stack', None)
+        if stack:
+            TEMPLATE_LATENCY.observe(time.perf_counter() - stack.pop(), template.name or 'unknown')
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+
+    allowed = [ipaddress.ip_network(network, strict=False) for network in app.config['METRICS_ALLOW']]
+
+    def metrics_view():
+        if allowed and not _address_allowed(request.remote_addr, allowed):
+            abort(404)
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule(app.config['METRICS_PATH'], 'metrics', metrics_view)
@@ -0,0 +1,229 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from config import set_defaults, settings_from
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    # Формат werkzeug: 'scrypt:N:r:p' или 'pbkdf2:sha256:итерации'; при смене хэши обновляются при входе
+    'PASSWORD_METHOD': 'scrypt:32768:8:1',
+    'PASSWORD_SALT_LENGTH': 16,
+    # Хэширование в отдельных процессах, чтобы не держать GIL воркера; 0 - в потоке запроса
+    'PASSWORD_WORKERS': min(4, os.cpu_count() or 1),
+    # Сколько хэшей может ждать очереди на процесс пула, остальные запросы получают 503 (форма входа
+    # с просьбой повторить и Retry-After). Не меньше PASSWORD_QUEUE_MIN: на хосте с одним CPU один процесс
+    # пула с четырьмя местами отвечал бы 503 уже на пятый одновременный вход
+    'PASSWORD_QUEUE_PER_WORKER': 4,
+    'PASSWORD_QUEUE_MIN': 16,
+    # Retry-After ответа 503, секунды
+    'PASSWORD_RETRY_AFTER': 1,
+    'PASSWORD_TIMEOUT': 10,
+    # Ограничение попыток входа и регистрации в окне LOGIN_WINDOW секунд (на процесс)
+    'LOGIN_WINDOW': 300,
+    'LOGIN_MAX_ATTEMPTS_USER': 10,
+    'LOGIN_MAX_ATTEMPTS_IP': 30,
+}
+
+
+class PasswordBusy(Exception):
+    pass
+
+
+class TooManyAttempts(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Слишком много попыток, повторите через {retry_after} с")
+        self.retry_after = retry_after
+
+
+def _hash(password, method, salt_length):
+    return generate_password_hash(password, method, salt_length)
+
+
+def _check(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+def hash_method(pwhash):
+    # 'scrypt:32768:8:1$соль$хэш' -> 'scrypt:32768:8:1'
+    return pwhash.split('$', 1)[0]
+
+
+class Hasher:
+    def __init__(self, method='scrypt:32768:8:1', salt_length=16, workers=4, queue_per_worker=4, timeout=10,
+                 queue_min=16):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.queue_size = max(queue_min, max(1, workers) * queue_per_worker)
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        # Хэш для несуществующих пользователей, создаётся при первой такой попытке
+        self._dummy = None
+
+        self._stats_lock = threading.Lock()
+        self.hashes = 0
+        self.checks = 0
+        self.rehashes = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _get_executor(self):
+        # Пул создаётся при первом входе уже в процессе воркера; forkserver не копирует потоки воркера
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    methods = multiprocessing.get_all_start_methods()
+                    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    def _run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        # Ограниченная очередь: при всплеске входов лишние запросы сразу получают отказ,
+        # а не копятся и не отнимают процессор у обычных страниц
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            raise PasswordBusy("Сервер перегружен проверкой паролей")
+        try:
+            future = self._get_executor().submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # Место в очереди занято, пока хэш реально считается, а не пока его ждёт запрос:
+        # после таймаута задача продолжает занимать процесс пула
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            self._count('timeouts')
+            raise PasswordBusy("Проверка пароля не уложилась в отведённое время") from None
+
+    def hash(self, password):
+        self._count('hashes')
+        return self._run(_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        # Возвращает (пароль верен, новый хэш или None). Новый хэш появляется, если параметры в конфиге
+        # изменились с момента создания старого
+        self._count('checks')
+        if pwhash is None:
+            # Проверка занимает столько же, сколько настоящая: по времени ответа не видно, есть ли имя
+            if self._dummy is None:
+                self._dummy = self._run(_hash, os.urandom(16).hex(), self.method, self.salt_length)
+            self._run(_check, self._dummy, password)
+            return False, None
+        if not self._run(_check, pwhash, password):
+            return False, None
+        if hash_method(pwhash) != self.method:
+            self._count('rehashes')
+            return True, self.hash(password)
+        return True, None
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'hashes': self.hashes,
+                'checks': self.checks,
+                'rehashes': self.rehashes,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'queue_size': self.queue_size,
+            }
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+
+class Throttle:
+    # Фиксированное окно на ключ (имя пользователя или IP); состояние в памяти процесса,
+    # поэтому при нескольких воркерах фактический лимит умножается на их число
+    def __init__(self, limit, window=300, max_keys=100000, clock=time.monotonic):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.clock = clock
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        # Учитывает попытку; возвращает, сколько секунд ждать, или 0, если попытка разрешена
+        now = self.clock()
+        with self._lock:
+            started, count = self._windows.get(key, (now, 0))
+            if now - started >= self.window:
+                started, count = now, 0
+            if count >= self.limit:
+                return int(started + self.window - now) + 1
+            if len(self._windows) >= self.max_keys and key not in self._windows:
+                self._prune(now)
+            self._windows[key] = (started, count + 1)
+            return 0
+
+    def reset(self, key):
+        with self._lock:
+            self._windows.pop(key, None)
+
+    def _prune(self, now):
+        expired = [key for key, (started, _) in self._windows.items() if now - started >= self.window]
+        for key in expired:
+            del self._windows[key]
+        if len(self._windows) >= self.max_keys:
+            self._windows.clear()
+
+
+def hasher_from_config(config):
+    settings = settings_from(DEFAULT_CONFIG, config)
+    return Hasher(settings['PASSWORD_METHOD'], settings['PASSWORD_SALT_LENGTH'], settings['PASSWORD_WORKERS'],
+                  settings['PASSWORD_QUEUE_PER_WORKER'], settings['PASSWORD_TIMEOUT'],
+                  settings['PASSWORD_QUEUE_MIN'])
+
+
+def get_hasher():
+    return current_app.extensions['passwords']
+
+
+def check_attempt(username, ip):
+    # Вызывается до любой работы с хэшами: TooManyAttempts, если исчерпан лимит по имени или по IP
+    throttles = current_app.extensions['login_throttles']
+    for throttle, key in ((throttles['ip'], ip), (throttles['user'], username)):
+        if key:
+            retry_after = throttle.hit(key)
+            if retry_after:
+                raise TooManyAttempts(retry_after)
+
+
+def login_succeeded(username):
+    current_app.extensions['login_throttles']['user'].reset(username)
+
+
+def hash_password(password):
+    return get_hasher().hash(password)
+
+
+def verify_password(pwhash, password):
+    return get_hasher().verify(pwhash, password)
+
+
+def init_app(app):
+    set_defaults(app, DEFAULT_CONFIG)
+    app.extensions['passwords'] = hasher_from_config(app.config)
+    app.extensions['login_throttles'] = {
+        'user': Throttle(app.config['LOGIN_MAX_ATTEMPTS_USER'], app.config['LOGIN_WINDOW']),
+        'ip': Throttle(app.config['LOGIN_MAX_ATTEMPTS_IP'], app.config['LOGIN_WINDOW']),
+    }
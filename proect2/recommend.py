@@ -0,0 +1,322 @@
+import argparse
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_app_context
+
+from config import set_defaults, settings_from
+from repository import get_repository
+
+logger = logging.getLogger(__name__)
+
+# numpy и scipy нужны только для пересчёта; страница рекомендаций читает готовую таблицу user_neighbors
+DEFAULT_CONFIG = {
+    'REC_TOP_K': 20,
+    'REC_BLOCK_SIZE': 256,  # строк матрицы за один шаг полного пересчёта
+    'REC_WEIGHT_GAMES': 0.6,  # коэффициент Жаккара по библиотекам Steam
+    'REC_WEIGHT_GENRE': 0.25,  # совпадение любимого жанра
+    'REC_WEIGHT_AGE': 0.15,  # близость возраста
+    'REC_AGE_SCALE': 10,  # разница в возрасте, при которой её вклад обнуляется
+    'REC_MODEL_TTL': 3600,  # как долго процесс держит данные в памяти до перечитывания
+    'REC_UPDATES': True,  # пересчитывать соседей при изменении профиля или библиотеки
+}
+
+
+def _age(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+class SimilarityModel:
+    # Данные для расчёта похожести: разреженная матрица пользователь×appid (CSR) и массивы возраста
+    # и кода жанра, выровненные по строкам матрицы
+    def __init__(self, user_ids, matrix, ages, genres, genre_codes, appid_columns, weights, age_scale):
+        import numpy as np
+        self.user_ids = user_ids
+        self.matrix = matrix
+        self.sizes = np.asarray(matrix.sum(axis=1), dtype=np.float32).ravel()
+        self.ages = ages
+        self.genres = genres
+        self.genre_codes = genre_codes
+        self.appid_columns = appid_columns
+        self.rows = {int(user_id): row for row, user_id in enumerate(user_ids)}
+        self.weights = weights
+        self.age_scale = age_scale
+
+    @classmethod
+    def load(cls, repository, weights, age_scale):
+        import numpy as np
+        from scipy import sparse
+
+        users, owned = repository.similarity_data()
+        user_ids = np.array([row['id'] for row in users], dtype=np.int64)
+        ages = np.array([_age(row['age']) for row in users], dtype=np.float32)
+        genre_codes = {}
+        genres = np.array([genre_codes.setdefault(row['game_type'], len(genre_codes)) if row['game_type'] else -1
+                           for row in users], dtype=np.int32)
+
+        owners = np.array([row['user_id'] for row in owned], dtype=np.int64)
+        appids = np.array([row['appid'] for row in owned], dtype=np.int64)
+        columns, column_index = np.unique(appids, return_inverse=True)
+        rows = np.searchsorted(user_ids, owners)
+        matrix = sparse.csr_matrix((np.ones(len(owned), dtype=np.float32), (rows, column_index)),
+                                   shape=(len(user_ids), len(columns)))
+        appid_columns = {int(appid): column for column, appid in enumerate(columns)}
+        return cls(user_ids, matrix, ages, genres, genre_codes, appid_columns, weights, age_scale)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def set_user(self, user_id, age, game_type, appids):
+        # Заменяет (или добавляет) строку пользователя, остальные строки не трогает
+        import numpy as np
+        from scipy import sparse
+
+        for appid in appids:
+            self.appid_columns.setdefault(int(appid), len(self.appid_columns))
+        if len(self.appid_columns) > self.matrix.shape[1]:
+            self.matrix.resize((self.matrix.shape[0], len(self.appid_columns)))
+        columns = sorted({self.appid_columns[int(appid)] for appid in appids})
+        new_row = sparse.csr_matrix((np.ones(len(columns), dtype=np.float32), ([0] * len(columns), columns)),
+                                    shape=(1, self.matrix.shape[1]))
+        genre = self.genre_codes.setdefault(game_type, len(self.genre_codes)) if game_type else -1
+
+        row = self.rows.get(user_id)
+        if row is None:
+            self.rows[user_id] = len(self.user_ids)
+            self.user_ids = np.append(self.user_ids, user_id)
+            self.matrix = sparse.vstack([self.matrix, new_row], format='csr')
+            self.sizes = np.append(self.sizes, np.float32(len(columns)))
+            self.ages = np.append(self.ages, np.float32(_age(age)))
+            self.genres = np.append(self.genres, np.int32(genre))
+        else:
+            self.matrix = sparse.vstack([self.matrix[:row], new_row, self.matrix[row + 1:]], format='csr')
+            self.sizes[row] = len(columns)
+            self.ages[row] = _age(age)
+            self.genres[row] = genre
+
+    def scores(self, rows):
+        # Плотный блок оценок len(rows) × все пользователи; сам пользователь получает -inf
+        import numpy as np
+
+        rows = np.asarray(rows)
+        games_weight, genre_weight, age_weight = self.weights
+        # Все операции на месте во float32: блок 256 × 100k - это уже 100 МБ на массив
+        score = (self.matrix[rows] @ self.matrix.T).toarray()
+        union = self.sizes[rows][:, None] + self.sizes[None, :] - score
+        # Где объединение пустое, пересечение тоже 0 и остаётся 0
+        np.divide(score, union, out=score, where=union > 0)
+        score *= games_weight
+
+        same_genre = self.genres[rows][:, None] == self.genres[None, :]
+        same_genre &= (self.genres[rows] >= 0)[:, None]
+        np.add(score, np.float32(genre_weight), out=score, where=same_genre)
+
+        age = np.abs(self.ages[rows][:, None] - self.ages[None, :], out=union)
+        age *= np.float32(-1 / self.age_scale)
+        age += 1
+        np.clip(age, 0, 1, out=age)
+        # Неизвестный возраст (NaN) не добавляет ничего
+        np.nan_to_num(age, copy=False, nan=0.0)
+        age *= np.float32(age_weight)
+        score += age
+
+        score[np.arange(len(rows)), rows] = -np.inf
+        return score
+
+    def top_k(self, scores, k):
+        # Индексы и оценки k лучших соседей для каждой строки блока, по убыванию оценки
+        import numpy as np
+
+        k = min(k, scores.shape[1] - 1)
+        if k <= 0:
+            return np.empty((scores.shape[0], 0), dtype=np.int64), np.empty((scores.shape[0], 0))
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+class Recommender:
+    def __init__(self, top_k=20, block_size=256, weights=(0.6, 0.25, 0.15), age_scale=10, model_ttl=3600):
+        self.top_k = top_k
+        self.block_size = block_size
+        self.weights = weights
+        self.age_scale = age_scale
+        self.model_ttl = model_ttl
+
+        self._model = None
+        self._loaded_at = 0.0
+        # Для каждой строки модели: сколько соседей сохранено и оценка худшего из них
+        self._counts = None
+        self._thresholds = None
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._executor = None
+
+    def _load(self, repository):
+        import numpy as np
+
+        started = time.perf_counter()
+        model = SimilarityModel.load(repository, self.weights, self.age_scale)
+        counts = np.zeros(len(model), dtype=np.int32)
+        thresholds = np.full(len(model), -np.inf, dtype=np.float32)
+        self._model, self._counts, self._thresholds = model, counts, thresholds
+        self._set_stats(repository.neighbor_stats())
+        self._loaded_at = time.monotonic()
+        logger.info("Модель рекомендаций загружена: %d пользователей, %d игр за %.2f с",
+                    len(model), model.matrix.shape[1], time.perf_counter() - started)
+        return model
+
+    def _ensure_model(self, repository):
+        if self._model is None or time.monotonic() - self._loaded_at > self.model_ttl:
+            return self._load(repository)
+        return self._model
+
+    def _set_stats(self, stats):
+        for row in stats:
+            index = self._model.rows.get(row['user_id'])
+            if index is not None:
+                self._counts[index] = row['neighbors']
+                self._thresholds[index] = row['threshold']
+
+    def _own_rows(self, user_ids, neighbors, scores):
+        return [(int(user_id), int(self._model.user_ids[neighbor]), float(score))
+                for user_id, row_neighbors, row_scores in zip(user_ids, neighbors, scores)
+                for neighbor, score in zip(row_neighbors, row_scores)]
+
+    def rebuild(self):
+        # Полный пересчёт блоками по block_size строк, каждый блок - своя короткая транзакция
+        import numpy as np
+
+        repository = get_repository()
+        with self._lock:
+            model = self._load(repository)
+            started = time.perf_counter()
+            for offset in range(0, len(model), self.block_size):
+                rows = np.arange(offset, min(offset + self.block_size, len(model)))
+                neighbors, scores = model.top_k(model.scores(rows), self.top_k)
+                user_ids = [int(user_id) for user_id in model.user_ids[rows]]
+                repository.replace_neighbors(user_ids, self._own_rows(user_ids, neighbors, scores))
+                self._counts[rows] = neighbors.shape[1]
+                self._thresholds[rows] = scores[:, -1] if neighbors.shape[1] else -np.inf
+            logger.info("Рекомендации пересчитаны для %d пользователей за %.1f с",
+                        len(model), time.perf_counter() - started)
+            return len(model)
+
+    def update_users(self, user_ids):
+        # Инкрементальное обновление после изменения профиля или библиотеки: свои соседи пересчитываются
+        # полностью, в чужие списки пользователь попадает, если обходит их худшего соседа
+        import numpy as np
+
+        user_ids = sorted(set(user_ids))
+        if not user_ids:
+            return
+        repository = get_repository()
+        with self._lock:
+            model = self._ensure_model(repository)
+            profiles = repository.similarity_profiles(user_ids)
+            # В каких чужих списках уже стоят пользователи: их оценка там обновится
+            listed = repository.neighbor_owners(user_ids)
+            for user_id, (age, game_type, appids) in profiles.items():
+                model.set_user(user_id, age, game_type, appids)
+            grown = len(model) - len(self._counts)
+            if grown > 0:
+                self._counts = np.append(self._counts, np.zeros(grown, dtype=np.int32))
+                self._thresholds = np.append(self._thresholds, np.full(grown, -np.inf, dtype=np.float32))
+
+            rows = np.array([model.rows[user_id] for user_id in profiles], dtype=np.int64)
+            for offset in range(0, len(rows), self.block_size):
+                block = rows[offset:offset + self.block_size]
+                scores = model.scores(block)
+                neighbors, best = model.top_k(scores, self.top_k)
+                block_ids = [int(user_id) for user_id in model.user_ids[block]]
+                offers = []
+                for row, user_id, row_scores in zip(block, block_ids, scores):
+                    offers.extend(self._offers(user_id, row, row_scores, listed.get(user_id, ())))
+                owners = sorted({owner for owner, _, _ in offers})
+                stats = repository.update_neighbors(block_ids, self._own_rows(block_ids, neighbors, best), offers,
+                                                    owners, self.top_k)
+                self._counts[block] = neighbors.shape[1]
+                self._thresholds[block] = best[:, -1] if neighbors.shape[1] else -np.inf
+                self._set_stats(stats)
+
+    def _offers(self, user_id, row, scores, listed):
+        # Чужие списки, где user_id уже есть или обходит худшего соседа: (владелец, user_id, оценка)
+        import numpy as np
+
+        model = self._model
+        # Пользователи без сохранённого списка получат его при собственном пересчёте
+        better = np.nonzero((self._counts > 0) & ((self._counts < self.top_k) | (scores > self._thresholds)))[0]
+        rows = {model.rows[owner] for owner in listed if owner in model.rows} | set(better.tolist())
+        rows.discard(row)
+        return [(int(model.user_ids[other]), user_id, float(scores[other])) for other in rows]
+
+    def schedule(self, user_ids, app):
+        # Обновления копятся и применяются одним фоновым потоком пачками
+        with self._pending_lock:
+            idle = not self._pending
+            self._pending.update(user_ids)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='recommend')
+        if idle:
+            self._executor.submit(self._drain, app)
+
+    def _drain(self, app):
+        with self._pending_lock:
+            user_ids, self._pending = self._pending, set()
+        if not user_ids:
+            return
+        try:
+            with app.app_context():
+                self.update_users(user_ids)
+        except ImportError as e:
+            logger.warning("Рекомендации не обновлены, не установлены numpy/scipy: %s", e)
+        except Exception:
+            logger.exception("Ошибка обновления рекомендаций")
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+
+def recommender_from_config(config):
+    settings = settings_from(DEFAULT_CONFIG, config)
+    return Recommender(top_k=settings['REC_TOP_K'],
+                       block_size=settings['REC_BLOCK_SIZE'],
+                       weights=(settings['REC_WEIGHT_GAMES'], settings['REC_WEIGHT_GENRE'],
+                                settings['REC_WEIGHT_AGE']),
+                       age_scale=settings['REC_AGE_SCALE'],
+                       model_ttl=settings['REC_MODEL_TTL'])
+
+
+def schedule_update(user_ids):
+    # Вызывается после записи профиля или библиотеки; без контекста приложения ничего не делает
+    if not has_app_context() or not current_app.config.get('REC_UPDATES'):
+        return
+    current_app.extensions['recommender'].schedule(user_ids, current_app._get_current_object())
+
+
+def init_app(app):
+    set_defaults(app, DEFAULT_CONFIG)
+    app.extensions['recommender'] = recommender_from_config(app.config)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Предвычисление рекомендаций напарников")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="полностью пересчитать таблицу user_neighbors")
+    build_parser.add_argument('--top-k', type=int, default=DEFAULT_CONFIG['REC_TOP_K'])
+    build_parser.add_argument('--block-size', type=int, default=DEFAULT_CONFIG['REC_BLOCK_SIZE'])
+    args = parser.parse_args()
+
+    from teamfinder import create_app
+    # Через приложение: то же хранилище (SQLite или PostgreSQL) и поток записи, что у сайта
+    app = create_app({'STEAM_JOBS_WORKER': False, 'REC_TOP_K': args.top_k, 'REC_BLOCK_SIZE': args.block_size})
+    with app.app_context():
+        print(f"Пересчитано пользователей: {app.extensions['recommender'].rebuild()}")
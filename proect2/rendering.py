@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import os
+
+from flask import current_app, make_response, request
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.security import safe_join
+
+import catalog
+from config import resolve_path, set_defaults
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    # Скомпилированные шаблоны на диске: новые воркеры не разбирают их заново; None - без кэша
+    'TEMPLATE_BYTECODE_DIR': 'instance/jinja_cache',
+    # Компиляция всех шаблонов при старте, а не на первом запросе к каждой странице
+    'TEMPLATE_PRELOAD': True,
+    # Статика со ссылкой вида ?v=<отпечаток> кэшируется браузером надолго: при изменении файла меняется ссылка
+    'STATIC_IMMUTABLE_MAX_AGE': 365 * 24 * 3600,
+}
+
+
+def preload(app):
+    # Компилирует все шаблоны и возвращает отпечаток их исходников: он входит в каждый ETag,
+    # чтобы после выкладки новых шаблонов браузеры не получили 304 на старую разметку
+    env = app.jinja_env
+    digest = hashlib.blake2b(digest_size=8)
+    names = sorted(env.list_templates())
+    for name in names:
+        source, _, _ = env.loader.get_source(env, name)
+        digest.update(name.encode('utf-8') + b'\0' + source.encode('utf-8') + b'\0')
+        if app.config['TEMPLATE_PRELOAD']:
+            env.get_template(name)
+    logger.info("Шаблоны загружены: %d", len(names))
+    return digest.hexdigest()
+
+
+def static_fingerprint(filename):
+    # Короткий хэш содержимого файла из static/; None, если файла нет. В режиме отладки не запоминается
+    fingerprints = current_app.extensions['static_fingerprints']
+    if filename in fingerprints:
+        return fingerprints[filename]
+    path = safe_join(current_app.static_folder, filename)
+    digest = None
+    if path is not None:
+        try:
+            with open(path, 'rb') as f:
+                digest = hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=6)).hexdigest()
+        except OSError:
+            pass
+    if not current_app.debug:
+        fingerprints[filename] = digest
+    return digest
+
+
+def _static_url_defaults(endpoint, values):
+    # url_for('static', filename=...) получает ?v=<отпечаток> без изменений в шаблонах
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        digest = static_fingerprint(values['filename'])
+        if digest:
+            values['v'] = digest
+
+
+def _static_cache_headers(response):
+    if request.endpoint == 'static' and request.args.get('v') and response.status_code in (200, 304):
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['STATIC_IMMUTABLE_MAX_AGE']
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+def etag(*parts):
+    # ETag страницы из версий строк, от которых она зависит, и всего, что меняет разметку (вошедший
+    # пользователь, параметры запроса); вычисляется до тяжёлых запросов
+    key = repr((current_app.extensions['render_version'],) + parts)
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=10).hexdigest()
+
+
+def _revalidate(response, tag):
+    response.set_etag(tag)
+    # Браузер хранит страницу, но перед показом каждый раз спрашивает сервер
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+def not_modified(tag):
+    # Ответ 304, если у клиента уже есть страница с этим ETag, иначе None
+    if request.if_none_match.contains_weak(tag):
+        return _revalidate(make_response('', 304), tag)
+    return None
+
+
+def with_etag(body, tag):
+    return _revalidate(make_response(body), tag)
+
+
+def init_app(app):
+    set_defaults(app, DEFAULT_CONFIG)
+    app.jinja_env.globals.update(catalog.template_globals())
+
+    directory = resolve_path(app.config['TEMPLATE_BYTECODE_DIR'])
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+    app.extensions['render_version'] = preload(app)
+
+    app.extensions['static_fingerprints'] = {}
+    app.url_defaults(_static_url_defaults)
+    app.after_request(_static_cache_headers)
@@ -0,0 +1,1319 @@
+import logging
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+import writer
+from config import ProcessDefault, set_defaults, settings_from
+from db import PoolTimeout, connection
+from metrics import timed_cursor_factory
+from search import UserQuery, build_user_query, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    # 'sqlite' - файл DATABASE рядом с приложением, 'postgresql' - общая БД для нескольких хостов
+    'REPOSITORY_BACKEND': 'sqlite',
+    'POSTGRES_DSN': 'dbname=teamfinder',
+    'POSTGRES_POOL_MIN': 1,
+    'POSTGRES_POOL_MAX': 10,
+    'POSTGRES_POOL_TIMEOUT': 5.0,
+    # Строк за одно обращение серверного курсора при выгрузках
+    'POSTGRES_ITERSIZE': 500,
+}
+
+BACKENDS = ('sqlite', 'postgresql')
+
+SNAPSHOT_COLUMNS = ('id', 'name', 'age', 'game_type', 'avatar', 'username', 'platform', 'region', 'version')
+
+USER_COLUMNS = ('id', 'name', 'age', 'game_type', 'avatar', 'avatar_hash', 'username', 'description',
+                'steam_profile_url', 'platform', 'region')
+
+
+def encode_review_cursor(review):
+    return f"{review['created_at']}|{review['review_id']}"
+
+
+def decode_review_cursor(cursor):
+    created_at, _, review_id = (cursor or '').rpartition('|')
+    if not created_at or not review_id.isdigit():
+        return None
+    return created_at, int(review_id)
+
+
+def _split_profile(rows):
+    # Строки "пользователь + отзыв" -> (пользователь, отзывы, курсор следующей порции отзывов)
+    if not rows:
+        return None
+    reviews = [row for row in rows if row['review_id'] is not None]
+    next_cursor = None
+    if len(reviews) < rows[0]['review_count'] and reviews:
+        next_cursor = encode_review_cursor(reviews[-1])
+    return rows[0], reviews, next_cursor
+
+
+def _trim_page(rows, limit):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_review_cursor(rows[-1])
+    return rows, next_cursor
+
+
+def _owned(user_id, games):
+    return [(user_id, game['appid'], game.get('playtime_forever', game.get('playtime', 0)) or 0) for game in games]
+
+
+def _catalogue(games):
+    return [(game['appid'], game.get('name')) for game in games]
+
+
+class Repository(ABC):
+    # Доступ к пользователям, отзывам и данным Steam; funcs.py добавляет поверх кэш и сброс кэша.
+    # Строки поддерживают row['колонка'] и row.keys()
+
+    @abstractmethod
+    def list_users(self, sort_by, age_filter, search_query, game_type_filter, platform_filter, region_filter):
+        ...
+
+    @abstractmethod
+    def users_page(self, sort_by, age_filter, search_query, game_type_filter, platform_filter, region_filter,
+                   after, page_size):
+        ...
+
+    @abstractmethod
+    def count_users(self, age_filter, search_query, game_type_filter, platform_filter, region_filter):
+        ...
+
+    @abstractmethod
+    def iter_users(self, sort_by, age_filter, search_query, game_type_filter, platform_filter, region_filter,
+                   chunk_size):
+        ...
+
+    @abstractmethod
+    def user_by_username(self, username):
+        ...
+
+    @abstractmethod
+    def user_by_id(self, user_id):
+        ...
+
+    @abstractmethod
+    def credentials(self, username):
+        ...
+
+    @abstractmethod
+    def profile_with_reviews(self, username, limit):
+        ...
+
+    @abstractmethod
+    def users_version(self):
+        ...
+
+    @abstractmethod
+    def user_version(self, username):
+        ...
+
+    @abstractmethod
+    def users_since(self, version):
+        # Колонки списка и version для строк, изменённых после version; None - все пользователи
+        ...
+
+    @abstractmethod
+    def create_user(self, name, username, password_hash, age, description, game_type, avatar_path, avatar_hash,
+                    steam_profile_url, steam_id, platform, region):
+        ...
+
+    @abstractmethod
+    def update_profile(self, user_id, age, description, game_type, steam_profile_url, steam_games, platform,
+                       region, steam_id):
+        ...
+
+    @abstractmethod
+    def update_password(self, user_id, password_hash):
+        ...
+
+    @abstractmethod
+    def touch_avatar(self, avatar_hash):
+        # Новая версия строк с этой аватаркой: её уменьшенные копии готовы, разметка страниц меняется
+        ...
+
+    @abstractmethod
+    def reviews(self, user_id):
+        ...
+
+    @abstractmethod
+    def reviews_page(self, user_id, before, limit):
+        ...
+
+    @abstractmethod
+    def add_review(self, user_id, review_text, reviewer_username):
+        ...
+
+    @abstractmethod
+    def user_games(self, user_id):
+        ...
+
+    @abstractmethod
+    def save_user_libraries(self, libraries):
+        ...
+
+    @abstractmethod
+    def enqueue_steam_jobs(self, jobs, delay=0):
+        # jobs - пары (user_id, steam_id); повторная постановка сбрасывает попытки и ошибку
+        ...
+
+    @abstractmethod
+    def cancel_steam_job(self, user_id):
+        ...
+
+    @abstractmethod
+    def claim_steam_jobs(self, limit, lease):
+        # Переводит до limit готовых задач (и брошенных дольше lease секунд) в running, возвращает
+        # строки user_id, steam_id, attempts
+        ...
+
+    @abstractmethod
+    def finish_steam_jobs(self, libraries, retries, failures):
+        # libraries - (user_id, steam_id, игры) загруженных, retries - (run_after, ошибка, attempts, user_id),
+        # failures - (ошибка, user_id). Меняются только задачи, всё ещё running: пока шёл запрос, пользователь
+        # мог снять задачу или поставить её заново с другой ссылкой. Библиотека записывается в той же
+        # транзакции, только если её задача снята этим вызовом; возвращает user_id записанных библиотек
+        ...
+
+    @abstractmethod
+    def steam_job_stats(self):
+        # {статус: число задач}
+        ...
+
+    @abstractmethod
+    def users_with_steam_id(self, after_id, limit):
+        # id, steam_id следующих limit пользователей с известным SteamID (порции для resync)
+        ...
+
+    @abstractmethod
+    def users_missing_steam_id(self, after_id, limit):
+        # id, steam_profile_url профилей, у которых ссылка есть, а SteamID ещё не определён
+        ...
+
+    @abstractmethod
+    def steam_ids(self, urls):
+        # {ссылка: SteamID64} для уже разрешённых коротких имён
+        ...
+
+    @abstractmethod
+    def store_steam_ids(self, resolved):
+        ...
+
+    @abstractmethod
+    def set_user_steam_ids(self, pairs):
+        # pairs - (steam_id, user_id) для профилей, у которых ID определён по ссылке
+        ...
+
+    @abstractmethod
+    def game_owners(self, appid):
+        ...
+
+    @abstractmethod
+    def recommendations(self, user_id, limit):
+        ...
+
+    @abstractmethod
+    def similarity_data(self):
+        # Данные модели рекомендаций: строки id, age, game_type всех пользователей по возрастанию id
+        # и строки user_id, appid всех библиотек
+        ...
+
+    @abstractmethod
+    def similarity_profiles(self, user_ids):
+        # {user_id: (age, game_type, [appid])} для пересчёта отдельных пользователей
+        ...
+
+    @abstractmethod
+    def neighbor_stats(self, user_ids=None):
+        # Строки user_id, neighbors, threshold: размер сохранённого списка соседей и худшая оценка в нём;
+        # user_ids=None - по всем спискам
+        ...
+
+    @abstractmethod
+    def neighbor_owners(self, user_ids):
+        # {neighbor_id: [user_id]} - в чьих списках уже стоят пользователи user_ids
+        ...
+
+    @abstractmethod
+    def replace_neighbors(self, user_ids, rows):
+        # Полностью заменяет списки соседей user_ids; rows - (user_id, neighbor_id, score)
+        ...
+
+    @abstractmethod
+    def update_neighbors(self, user_ids, rows, offers, owners, top_k):
+        # В одной транзакции: свои списки user_ids (как replace_neighbors), оценки в чужих списках
+        # (offers - (owner, neighbor_id, score)) и обрезка списков owners до top_k. Возвращает neighbor_stats(owners)
+        ...
+
+    @abstractmethod
+    def users_missing_avatar_hash(self):
+        # id, avatar пользователей с аватаркой, ещё не перенесённой в хранилище по хэшу
+        ...
+
+    @abstractmethod
+    def set_avatar_hashes(self, pairs):
+        # pairs - (avatar_hash, user_id)
+        ...
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+# Операции записи SQLite: выполняются потоком записи (writer.py) внутри общей транзакции
+
+def _insert_user(conn, name, username, password_hash, age, description, game_type, avatar_path, avatar_hash,
+                 steam_profile_url, steam_id, platform, region):
+    # Проверка имени повторяется внутри транзакции записи: две регистрации одного имени не пройдут обе
+    if conn.execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone():
+        return None
+    cursor = conn.execute("""
+        INSERT INTO users (name, username, password, age, description, game_type, avatar, avatar_hash, steam_profile_url, steam_id, platform, region)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (name, username, password_hash, age, description, game_type, avatar_path, avatar_hash, steam_profile_url, steam_id, platform, region))
+    # Задача загрузки библиотеки ставится в той же транзакции, что и профиль
+    if steam_id:
+        _enqueue_jobs(conn, [(cursor.lastrowid, steam_id)], 0)
+    return cursor.lastrowid
+
+
+def _update_profile(conn, user_id, age, description, game_type, steam_profile_url, steam_games, platform, region,
+                    steam_id):
+    row = conn.execute("UPDATE users SET age=?, description=?, game_type=?, steam_profile_url=?, steam_id=?, platform=?, region=? WHERE id=? RETURNING username",
+                       (age, description, game_type, steam_profile_url, steam_id, platform or None, region or None, user_id)).fetchone()
+    if row is None:
+        return None
+    if steam_games is not None:
+        _write_user_games(conn, user_id, steam_games)
+    if steam_id:
+        _enqueue_jobs(conn, [(user_id, steam_id)], 0)
+    else:
+        _cancel_job(conn, user_id)
+    return row['username']
+
+
+def _update_password(conn, user_id, password_hash):
+    conn.execute("UPDATE users SET password = ? WHERE id = ?", (password_hash, user_id))
+
+
+def _touch_avatar(conn, avatar_hash):
+    conn.execute("UPDATE users SET version = version WHERE avatar_hash = ?", (avatar_hash,))
+
+
+def _insert_review(conn, user_id, review_text, reviewer_username):
+    # Счётчик обновляется в той же транзакции, что и вставка отзыва
+    row = conn.execute("UPDATE users SET review_count = review_count + 1 WHERE id = ? RETURNING username",
+                       (user_id,)).fetchone()
+    if row is None:
+        return None
+    conn.execute("INSERT INTO reviews (user_id, review_text, reviewer_username) VALUES (?, ?, ?)",
+                 (user_id, review_text, reviewer_username))
+    return row['username']
+
+
+def _write_user_games(conn, user_id, games):
+    conn.executemany("""
+        INSERT INTO games (appid, name) VALUES (?, ?)
+        ON CONFLICT (appid) DO UPDATE SET name = excluded.name WHERE excluded.name IS NOT NULL
+    """, _catalogue(games))
+    conn.execute("DELETE FROM user_games WHERE user_id = ?", (user_id,))
+    conn.executemany("INSERT INTO user_games (user_id, appid, playtime) VALUES (?, ?, ?)", _owned(user_id, games))
+    # Библиотека видна на странице профиля: триггер users_version_update сменит версию строки
+    conn.execute("UPDATE users SET version = version WHERE id = ?", (user_id,))
+
+
+def _write_user_libraries(conn, libraries):
+    for user_id, games in libraries:
+        _write_user_games(conn, user_id, games)
+
+
+def _enqueue_jobs(conn, jobs, delay):
+    now = time.time()
+    conn.executemany("""
+        INSERT INTO steam_jobs (user_id, steam_id, status, attempts, run_after, updated_at)
+        VALUES (?, ?, 'pending', 0, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET steam_id = excluded.steam_id, status = 'pending', attempts = 0,
+            run_after = excluded.run_after, updated_at = excluded.updated_at, last_error = NULL
+    """, [(user_id, steam_id, now + delay, now) for user_id, steam_id in jobs])
+
+
+def _cancel_job(conn, user_id):
+    conn.execute("DELETE FROM steam_jobs WHERE user_id = ?", (user_id,))
+
+
+def _claim_jobs(conn, limit, lease):
+    now = time.time()
+    return conn.execute("""
+        UPDATE steam_jobs SET status = 'running', attempts = attempts + 1, updated_at = :now
+        WHERE user_id IN (
+            SELECT user_id FROM steam_jobs
+            WHERE (status = 'pending' AND run_after <= :now) OR (status = 'running' AND updated_at < :expired)
+            ORDER BY run_after LIMIT :limit
+        )
+        RETURNING user_id, steam_id, attempts
+    """, {'now': now, 'expired': now - lease, 'limit': limit}).fetchall()
+
+
+def _finish_jobs(conn, libraries, retries, failures):
+    now = time.time()
+    saved = []
+    for user_id, steam_id, games in libraries:
+        if conn.execute("DELETE FROM steam_jobs WHERE user_id = ? AND steam_id = ? AND status = 'running' RETURNING user_id",
+                        (user_id, steam_id)).fetchone():
+            _write_user_games(conn, user_id, games)
+            saved.append(user_id)
+    conn.executemany("""
+        UPDATE steam_jobs SET status = 'pending', run_after = ?, last_error = ?, attempts = ?, updated_at = ?
+        WHERE user_id = ? AND status = 'running'
+    """, [(run_after, error, attempts, now, user_id) for run_after, error, attempts, user_id in retries])
+    conn.executemany("""
+        UPDATE steam_jobs SET status = 'failed', last_error = ?, updated_at = ?
+        WHERE user_id = ? AND status = 'running'
+    """, [(error, now, user_id) for error, user_id in failures])
+    return saved
+
+
+def _store_steam_ids(conn, resolved):
+    now = time.time()
+    conn.executemany("""
+        INSERT INTO steam_ids (url, steam_id, resolved_at) VALUES (?, ?, ?)
+        ON CONFLICT (url) DO UPDATE SET steam_id = excluded.steam_id, resolved_at = excluded.resolved_at
+    """, [(url, steam_id, now) for url, steam_id in resolved.items()])
+
+
+def _set_user_steam_ids(conn, pairs):
+    conn.executemany("UPDATE users SET steam_id = ? WHERE id = ?", pairs)
+
+
+def _chunks(values, size=500):
+    # Порции для IN (...), чтобы не упереться в лимит числа параметров SQLite
+    values = list(values)
+    for offset in range(0, len(values), size):
+        yield values[offset:offset + size]
+
+
+def _neighbor_stats(conn, user_ids):
+    if user_ids is None:
+        return conn.execute("""
+            SELECT user_id, COUNT(*) AS neighbors, MIN(score) AS threshold FROM user_neighbors GROUP BY user_id
+        """).fetchall()
+    stats = []
+    for chunk in _chunks(user_ids):
+        placeholders = ', '.join('?' * len(chunk))
+        stats.extend(conn.execute(f"""
+            SELECT user_id, COUNT(*) AS neighbors, MIN(score) AS threshold FROM user_neighbors
+            WHERE user_id IN ({placeholders}) GROUP BY user_id
+        """, chunk))
+    return stats
+
+
+def _replace_neighbors(conn, user_ids, rows):
+    conn.executemany("DELETE FROM user_neighbors WHERE user_id = ?", [(user_id,) for user_id in user_ids])
+    conn.executemany("INSERT INTO user_neighbors (user_id, neighbor_id, score) VALUES (?, ?, ?)", rows)
+
+
+def _update_neighbors(conn, user_ids, rows, offers, owners, top_k):
+    _replace_neighbors(conn, user_ids, rows)
+    conn.executemany("""
+        INSERT INTO user_neighbors (user_id, neighbor_id, score) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, neighbor_id) DO UPDATE SET score = excluded.score
+    """, offers)
+    conn.executemany("""
+        DELETE FROM user_neighbors WHERE user_id = ? AND neighbor_id NOT IN (
+            SELECT neighbor_id FROM user_neighbors WHERE user_id = ? ORDER BY score DESC LIMIT ?
+        )
+    """, [(owner, owner, top_k) for owner in owners])
+    return _neighbor_stats(conn, owners)
+
+
+def _set_avatar_hashes(conn, pairs):
+    conn.executemany("UPDATE users SET avatar_hash = ? WHERE id = ?", pairs)
+
+
+class SQLiteRepository(Repository):
+    # Чтение через соединение запроса из пула db.py, запись - через единый поток записи
+    def list_users(self, sort_by, age_filter, search_query, game_type_filter, platform_filter, region_filter):
+        with connection() as conn:
+            query = build_user_query(conn, sort_by, age_filter, search_query, game_type_filter, platform_filter,
+                                     region_filter)
+            return query.execute(conn).fetchall()
+
+    def users_page(self, sort_by, age_filter, search_query, game_type_filter, platform_filter, region_filter,
+                   after, page_size):
+        with connection() as conn:
+            query = build_user_query(conn, sort_by, age_filter, search_query, game_type_filter, platform_filter,
+                                     region_filter)
+            return query.after(after).limit(page_size).page(conn)
+
+    def count_users(self, age_filter, search_query, game_type_filter, platform_filter, region_filter):
+        with connection() as conn:
+            query = build_user_query(conn, 'name', age_filter, search_query, game_type_filter, platform_filter,
+                                     region_filter)
+            return query.count(conn)
+
+    def iter_users(self, sort_by, age_filter, search_query, game_type_filter, platform_filter, region_filter,
+                   chunk_size):
+        with connection() as conn:
+            query = build_user_query(conn, sort_by, age_filter, search_query, game_type_filter, platform_filter,
+                                     region_filter)
+            cursor = query.execute(conn)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
+
+    def user_by_username(self, username):
+        with connection() as conn:
+            return conn.execute(f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE username = ?",
+                                (username,)).fetchone()
+
+    def user_by_id(self, user_id):
+        with connection() as conn:
+            return conn.execute(f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE id = ?", (user_id,)).fetchone()
+
+    def credentials(self, username):
+        with connection() as conn:
+            return conn.execute("SELECT id, password FROM users WHERE username = ?", (username,)).fetchone()
+
+    def profile_with_reviews(self, username, limit):
+        # Пользователь и последние limit отзывов одним запросом; число отзывов хранится в users.review_count
+        with connection() as conn:
+            rows = conn.execute("""
+                SELECT u.id, u.name, u.age, u.game_type, u.avatar, u.avatar_hash, u.username, u.description,
+                       u.steam_profile_url, u.steam_id, u.platform, u.region, u.review_count, u.version,
+                       r.id AS review_id, r.review_text, r.created_at, r.reviewer_username
+                FROM users u
+                LEFT JOIN reviews r ON r.id IN (
+                    SELECT id FROM reviews WHERE user_id = u.id ORDER BY created_at DESC, id DESC LIMIT ?
+                )
+                WHERE u.username = ?
+                ORDER BY r.created_at DESC, r.id DESC
+            """, (limit, username)).fetchall()
+        return _split_profile(rows)
+
+    def users_version(self):
+        # Растёт при любом изменении пользователей (см. schema._row_versions)
+        with connection() as conn:
+            return conn.execute("SELECT version FROM data_versions WHERE name = 'users'").fetchone()['version']
+
+    def user_version(self, username):
+        with connection() as conn:
+            row = conn.execute("SELECT version FROM users WHERE username = ?", (username,)).fetchone()
+        return row['version'] if row else None
+
+    def users_since(self, version):
+        query = f"SELECT {', '.join(SNAPSHOT_COLUMNS)} FROM users"
+        parameters = ()
+        if version is not None:
+            # По индексу idx_users_version
+            query += " WHERE version > ?"
+            parameters = (version,)
+        with connection() as conn:
+            return conn.execute(query + " ORDER BY id", parameters).fetchall()
+
+    def create_user(self, name, username, password_hash, age, description, game_type, avatar_path, avatar_hash,
+                    steam_profile_url, steam_id, platform, region):
+        return writer.execute(_insert_user, name, username, password_hash, age, description, game_type, avatar_path,
+                              avatar_hash, steam_profile_url, steam_id, platform, region)
+
+    def update_profile(self, user_id, age, description, game_type, steam_profile_url, steam_games, platform,
+                       region, steam_id):
+        return writer.execute(_update_profile, user_id, age, description, game_type, steam_profile_url, steam_games,
+                              platform, region, steam_id)
+
+    def update_password(self, user_id, password_hash):
+        writer.execute(_update_password, user_id, password_hash)
+
+    def touch_avatar(self, avatar_hash):
+        writer.execute(_touch_avatar, avatar_hash)
+
+    def reviews(self, user_id):
+        with connection() as conn:
+            return conn.execute(
+                "SELECT review_text, created_at, user_id, reviewer_username FROM reviews WHERE user_id = ?",
+                (user_id,)).fetchall()
+
+    def reviews_page(self, user_id, before, limit):
+        # Keyset-пагинация отзывов от новых к старым по индексу (user_id, created_at)
+        position = decode_review_cursor(before)
+        query = """
+            SELECT id AS review_id, review_text, created_at, user_id, reviewer_username
+            FROM reviews WHERE user_id = ?
+        """
+        parameters = [user_id]
+        if position is not None:
+            query += " AND (created_at, id) < (?, ?)"
+            parameters.extend(position)
+        query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        parameters.append(limit + 1)
+        with connection() as conn:
+            return _trim_page(conn.execute(query, parameters).fetchall(), limit)
+
+    def add_review(self, user_id, review_text, reviewer_username):
+        return writer.execute(_insert_review, user_id, review_text, reviewer_username)
+
+    def user_games(self, user_id):
+        with connection() as conn:
+            return conn.execute("""
+                SELECT ug.appid, g.name, ug.playtime
+                FROM user_games ug JOIN games g ON g.appid = ug.appid
+                WHERE ug.user_id = ?
+                ORDER BY ug.playtime DESC, g.name
+            """, (user_id,)).fetchall()
+
+    def save_user_libraries(self, libraries):
+        writer.execute(_write_user_libraries, libraries)
+
+    def enqueue_steam_jobs(self, jobs, delay=0):
+        writer.execute(_enqueue_jobs, jobs, delay)
+
+    def cancel_steam_job(self, user_id):
+        writer.execute(_cancel_job, user_id)
+
+    def claim_steam_jobs(self, limit, lease):
+        return writer.execute(_claim_jobs, limit, lease)
+
+    def finish_steam_jobs(self, libraries, retries, failures):
+        return writer.execute(_finish_jobs, libraries, retries, failures)
+
+    def steam_job_stats(self):
+        with connection() as conn:
+            return {row['status']: row['jobs'] for row in
+                    conn.execute("SELECT status, COUNT(*) AS jobs FROM steam_jobs GROUP BY status")}
+
+    def users_with_steam_id(self, after_id, limit):
+        with connection() as conn:
+            return conn.execute("""
+                SELECT id, steam_id FROM users WHERE id > ? AND steam_id IS NOT NULL ORDER BY id LIMIT ?
+            """, (after_id, limit)).fetchall()
+
+    def users_missing_steam_id(self, after_id, limit):
+        with connection() as conn:
+            return conn.execute("""
+                SELECT id, steam_profile_url FROM users
+                WHERE id > ? AND steam_id IS NULL AND steam_profile_url IS NOT NULL AND steam_profile_url != ''
+                ORDER BY id LIMIT ?
+            """, (after_id, limit)).fetchall()
+
+    def steam_ids(self, urls):
+        found = {}
+        with connection() as conn:
+            for chunk in _chunks(urls):
+                placeholders = ', '.join('?' * len(chunk))
+                for row in conn.execute(f"SELECT url, steam_id FROM steam_ids WHERE url IN ({placeholders})", chunk):
+                    found[row['url']] = row['steam_id']
+        return found
+
+    def store_steam_ids(self, resolved):
+        if resolved:
+            writer.execute(_store_steam_ids, resolved)
+
+    def set_user_steam_ids(self, pairs):
+        if pairs:
+            writer.execute(_set_user_steam_ids, pairs)
+
+    def game_owners(self, appid):
+        with connection() as conn:
+            return conn.execute("""
+                SELECT u.id, u.name, u.username, u.avatar, ug.playtime
+                FROM user_games ug JOIN users u ON u.id = ug.user_id
+                WHERE ug.appid = ?
+                ORDER BY ug.playtime DESC
+            """, (appid,)).fetchall()
+
+    def recommendations(self, user_id, limit):
+        # Готовые соседи из user_neighbors (заполняется recommend.py), без расчётов на запрос
+        with connection() as conn:
+            return conn.execute("""
+                SELECT u.id, u.name, u.age, u.game_type, u.avatar, u.avatar_hash, u.username, u.platform, u.region,
+                       n.score,
+                       (SELECT COUNT(*) FROM user_games mine JOIN user_games theirs ON theirs.appid = mine.appid
+                        WHERE mine.user_id = n.user_id AND theirs.user_id = n.neighbor_id) AS common_games
+                FROM user_neighbors n JOIN users u ON u.id = n.neighbor_id
+                WHERE n.user_id = ?
+                ORDER BY n.score DESC
+                LIMIT ?
+            """, (user_id, limit)).fetchall()
+
+    def similarity_data(self):
+        with connection() as conn:
+            return (conn.execute("SELECT id, age, game_type FROM users ORDER BY id").fetchall(),
+                    conn.execute("SELECT user_id, appid FROM user_games").fetchall())
+
+    def similarity_profiles(self, user_ids):
+        profiles = {}
+        with connection() as conn:
+            for chunk in _chunks(user_ids):
+                placeholders = ', '.join('?' * len(chunk))
+                for row in conn.execute(f"SELECT id, age, game_type FROM users WHERE id IN ({placeholders})", chunk):
+                    profiles[row['id']] = (row['age'], row['game_type'], [])
+                for row in conn.execute(f"SELECT user_id, appid FROM user_games WHERE user_id IN ({placeholders})",
+                                        chunk):
+                    profiles[row['user_id']][2].append(row['appid'])
+        return profiles
+
+    def neighbor_stats(self, user_ids=None):
+        with connection() as conn:
+            return _neighbor_stats(conn, user_ids)
+
+    def neighbor_owners(self, user_ids):
+        owners = {}
+        with connection() as conn:
+            for chunk in _chunks(user_ids):
+                placeholders = ', '.join('?' * len(chunk))
+                for row in conn.execute(f"""
+                    SELECT neighbor_id, user_id FROM user_neighbors WHERE neighbor_id IN ({placeholders})
+                """, chunk):
+                    owners.setdefault(row['neighbor_id'], []).append(row['user_id'])
+        return owners
+
+    def replace_neighbors(self, user_ids, rows):
+        writer.execute(_replace_neighbors, user_ids, rows)
+
+    def update_neighbors(self, user_ids, rows, offers, owners, top_k):
+        return writer.execute(_update_neighbors, user_ids, rows, offers, owners, top_k)
+
+    def users_missing_avatar_hash(self):
+        with connection() as conn:
+            return conn.execute("""
+                SELECT id, avatar FROM users WHERE avatar_hash IS NULL AND avatar IS NOT NULL
+            """).fetchall()
+
+    def set_avatar_hashes(self, pairs):
+        if pairs:
+            writer.execute(_set_avatar_hashes, pairs)
+
+
+# Схема PostgreSQL создаётся идемпотентно при старте. Версии строк - как в schema._row_versions:
+# data_versions.users меняется в транзакции записи, поэтому ETag не опережает видимые данные.
+# Колонки сортировки и фильтров в COLLATE "C": побайтное сравнение, как BINARY в SQLite
+POSTGRES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id BIGSERIAL PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    name TEXT COLLATE "C",
+    age INTEGER,
+    description TEXT,
+    game_type TEXT COLLATE "C",
+    avatar TEXT,
+    avatar_hash TEXT,
+    steam_profile_url TEXT,
+    steam_id TEXT,
+    platform TEXT COLLATE "C",
+    region TEXT COLLATE "C",
+    review_count INTEGER NOT NULL DEFAULT 0,
+    version BIGINT NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS reviews (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    review_text TEXT NOT NULL,
+    reviewer_username TEXT NOT NULL,
+    created_at TIMESTAMP(0) NOT NULL DEFAULT LOCALTIMESTAMP(0)
+);
+CREATE TABLE IF NOT EXISTS games (
+    appid BIGINT PRIMARY KEY,
+    name TEXT
+);
+CREATE TABLE IF NOT EXISTS user_games (
+    user_id BIGINT NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    appid BIGINT NOT NULL REFERENCES games (appid),
+    playtime INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, appid)
+);
+CREATE TABLE IF NOT EXISTS user_neighbors (
+    user_id BIGINT NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    neighbor_id BIGINT NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    score REAL NOT NULL,
+    PRIMARY KEY (user_id, neighbor_id)
+);
+-- Очередь фоновой загрузки библиотек и разрешённые короткие имена Steam - в той же БД, что и профили:
+-- задача ставится в транзакции профиля, время - секунды эпохи, как в SQLite
+CREATE TABLE IF NOT EXISTS steam_jobs (
+    user_id BIGINT PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE,
+    steam_id TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after DOUBLE PRECISION NOT NULL,
+    updated_at DOUBLE PRECISION NOT NULL,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS steam_ids (
+    url TEXT PRIMARY KEY,
+    steam_id TEXT NOT NULL,
+    resolved_at DOUBLE PRECISION NOT NULL
+);
+CREATE TABLE IF NOT EXISTS data_versions (
+    name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL
+);
+INSERT INTO data_versions (name, version) VALUES ('users', 1) ON CONFLICT (name) DO NOTHING;
+
+-- Индексы списка: те же наборы (фильтры..., ключ), что в schema.py, с NULL первыми, как в SQLite,
+-- и явным id в конце - в PostgreSQL он не добавляется к индексу сам
+CREATE INDEX IF NOT EXISTS idx_users_name ON users (name NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_game_type_name ON users (game_type, name NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_platform_name ON users (platform, name NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_region_name ON users (region, name NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_game_type_platform_name ON users (game_type, platform, name NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_game_type_region_name ON users (game_type, region, name NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_platform_region_name ON users (platform, region, name NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_game_type_platform_region_name ON users (game_type, platform, region, name NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_age ON users (age NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_game_type_age ON users (game_type, age NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_platform_age ON users (platform, age NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_region_age ON users (region, age NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_game_type_platform_age ON users (game_type, platform, age NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_game_type_region_age ON users (game_type, region, age NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_platform_region_age ON users (platform, region, age NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_game_type_platform_region_age ON users (game_type, platform, region, age NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_game_type ON users (game_type NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_platform_game_type ON users (platform, game_type NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_region_game_type ON users (region, game_type NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_platform_region_game_type ON users (platform, region, game_type NULLS FIRST, id);
+CREATE INDEX IF NOT EXISTS idx_users_version ON users (version);
+CREATE INDEX IF NOT EXISTS idx_users_avatar_hash ON users (avatar_hash);
+CREATE INDEX IF NOT EXISTS idx_users_search ON users
+    USING GIN (to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, '')));
+CREATE INDEX IF NOT EXISTS idx_reviews_user_created ON reviews (user_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_user_games_appid ON user_games (appid, playtime);
+CREATE INDEX IF NOT EXISTS idx_user_neighbors_neighbor ON user_neighbors (neighbor_id);
+CREATE INDEX IF NOT EXISTS idx_steam_jobs_status_run_after ON steam_jobs (status, run_after);
+
+CREATE OR REPLACE FUNCTION users_next_version() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'users' RETURNING version INTO NEW.version;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION users_deleted_version() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'users';
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION reviews_touch_owner() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE users SET version = version WHERE id = COALESCE(NEW.user_id, OLD.user_id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_version ON users;
+CREATE TRIGGER users_version BEFORE INSERT OR UPDATE ON users
+    FOR EACH ROW EXECUTE FUNCTION users_next_version();
+DROP TRIGGER IF EXISTS users_version_delete ON users;
+CREATE TRIGGER users_version_delete AFTER DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION users_deleted_version();
+DROP TRIGGER IF EXISTS reviews_version ON reviews;
+CREATE TRIGGER reviews_version AFTER INSERT OR DELETE ON reviews
+    FOR EACH ROW EXECUTE FUNCTION reviews_touch_owner();
+"""
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _pg(query):
+    # Запросы пишутся с '?' как для SQLite; psycopg2 ожидает %s, а литеральный % удваивается
+    return query.replace('%', '%%').replace('?', '%s')
+
+
+class PostgresUserQuery(UserQuery):
+    # Тот же построитель запросов списка; поиск по префиксам слов через GIN-индекс idx_users_search
+    def search(self, text):
+        words = _WORD.findall(text or '')
+        if not words:
+            return self
+        self.conditions.append("to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, '')) "
+                               "@@ to_tsquery('simple', ?)")
+        self.parameters.append(' & '.join(f"{word.lower()}:*" for word in words))
+        return self
+
+
+def _build_pg_query(sort_by, age_filter, search_query, game_type_filter, platform_filter, region_filter):
+    return (PostgresUserQuery(use_fts=False)
+            .min_age(age_filter)
+            .search(search_query)
+            .where_equal('game_type', game_type_filter)
+            .where_equal('platform', platform_filter)
+            .where_equal('region', region_filter)
+            .order_by(sort_by))
+
+
+class PostgresRepository(Repository):
+    # Общая PostgreSQL для нескольких хостов: пул соединений psycopg2, транзакция на каждый вызов,
+    # большие выгрузки читаются серверным курсором
+    def __init__(self, dsn, min_connections=1, max_connections=10, timeout=5.0, itersize=500):
+        import psycopg2.extras
+        import psycopg2.pool
+
+        self._extras = psycopg2.extras
+        # Курсор замеряет каждое выражение для /metrics, как TimedConnection у SQLite
+        cursor_factory = timed_cursor_factory(psycopg2.extras.RealDictCursor, psycopg2.Error)
+        self._pool = psycopg2.pool.ThreadedConnectionPool(min_connections, max_connections, dsn,
+                                                          cursor_factory=cursor_factory)
+        # ThreadedConnectionPool не ждёт свободного соединения, а сразу падает - ждём на семафоре
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.itersize = itersize
+        self.checkouts = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _transaction(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeout(f"Нет свободных соединений с PostgreSQL за {self.timeout} с")
+        try:
+            conn = self._pool.getconn()
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+        with self._lock:
+            self.checkouts += 1
+
+    def _all(self, query, parameters=()):
+        with self._transaction() as conn, conn.cursor() as cursor:
+            cursor.execute(_pg(query), parameters)
+            return cursor.fetchall()
+
+    def _one(self, query, parameters=()):
+        with self._transaction() as conn, conn.cursor() as cursor:
+            cursor.execute(_pg(query), parameters)
+            return cursor.fetchone()
+
+    def migrate(self):
+        with self._transaction() as conn, conn.cursor() as cursor:
+            # Одновременный старт нескольких хостов: схема создаётся под advisory-блокировкой
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext('teamfinder_schema'))")
+            cursor.execute(POSTGRES_SCHEMA)
+
+    def list_users(self, sort_by, age_filter, search_query, game_type_filter, platform_filter, region_filter):
+        query, parameters = _build_pg_query(sort_by, age_filter, search_query, game_type_filter, platform_filter,
+                                            region_filter).sql()
+        return self._all(query, parameters)
+
+    def users_page(self, sort_by, age_filter, search_query, game_type_filter, platform_filter, region_filter,
+                   after, page_size):
+        builder = _build_pg_query(sort_by, age_filter, search_query, game_type_filter, platform_filter,
+                                  region_filter).after(after).limit(page_size)
+        query, parameters = builder.sql()
+        rows = self._all(query, parameters)
+        next_cursor = None
+        if len(rows) > builder.page_size:
+            rows = rows[:builder.page_size]
+            next_cursor = encode_cursor(builder.sort_key, rows[-1])
+        return rows, next_cursor
+
+    def count_users(self, age_filter, search_query, game_type_filter, platform_filter, region_filter):
+        query, parameters = _build_pg_query('name', age_filter, search_query, game_type_filter, platform_filter,
+                                            region_filter).count_sql()
+        return self._one(query, parameters)['count']
+
+    def iter_users(self, sort_by, age_filter, search_query, game_type_filter, platform_filter, region_filter,
+                   chunk_size):
+        # Серверный курсор: PostgreSQL отдаёт строки порциями по itersize, весь список в память не читается
+        query, parameters = _build_pg_query(sort_by, age_filter, search_query, game_type_filter, platform_filter,
+                                            region_filter).sql()
+        with self._transaction() as conn, conn.cursor(name='iter_users') as cursor:
+            cursor.itersize = chunk_size or self.itersize
+            cursor.execute(_pg(query), parameters)
+            yield from cursor
+
+    def user_by_username(self, username):
+        return self._one(f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE username = ?", (username,))
+
+    def user_by_id(self, user_id):
+        return self._one(f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE id = ?", (user_id,))
+
+    def credentials(self, username):
+        return self._one("SELECT id, password FROM users WHERE username = ?", (username,))
+
+    def profile_with_reviews(self, username, limit):
+        rows = self._all("""
+            SELECT u.id, u.name, u.age, u.game_type, u.avatar, u.avatar_hash, u.username, u.description,
+                   u.steam_profile_url, u.steam_id, u.platform, u.region, u.review_count, u.version,
+                   r.id AS review_id, r.review_text, to_char(r.created_at, 'YYYY-MM-DD HH24:MI:SS') AS created_at,
+                   r.reviewer_username
+            FROM users u
+            LEFT JOIN LATERAL (
+                SELECT id, review_text, created_at, reviewer_username FROM reviews
+                WHERE user_id = u.id ORDER BY created_at DESC, id DESC LIMIT ?
+            ) r ON TRUE
+            WHERE u.username = ?
+            ORDER BY r.created_at DESC, r.id DESC
+        """, (limit, username))
+        return _split_profile(rows)
+
+    def users_version(self):
+        return self._one("SELECT version FROM data_versions WHERE name = 'users'")['version']
+
+    def user_version(self, username):
+        row = self._one("SELECT version FROM users WHERE username = ?", (username,))
+        return row['version'] if row else None
+
+    def users_since(self, version):
+        query = f"SELECT {', '.join(SNAPSHOT_COLUMNS)} FROM users"
+        parameters = ()
+        if version is not None:
+            query += " WHERE version > ?"
+            parameters = (version,)
+        return self._all(query + " ORDER BY id", parameters)
+
+    def create_user(self, name, username, password_hash, age, description, game_type, avatar_path, avatar_hash,
+                    steam_profile_url, steam_id, platform, region):
+        with self._transaction() as conn, conn.cursor() as cursor:
+            cursor.execute(_pg("""
+                INSERT INTO users (name, username, password, age, description, game_type, avatar, avatar_hash,
+                                   steam_profile_url, steam_id, platform, region)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (username) DO NOTHING
+                RETURNING id
+            """), (name, username, password_hash, age, description, game_type, avatar_path, avatar_hash,
+                   steam_profile_url, steam_id, platform, region))
+            row = cursor.fetchone()
+            # Задача загрузки библиотеки ставится в той же транзакции, что и профиль
+            if row and steam_id:
+                self._enqueue_jobs(cursor, [(row['id'], steam_id)], 0)
+        return row['id'] if row else None
+
+    def update_profile(self, user_id, age, description, game_type, steam_profile_url, steam_games, platform,
+                       region, steam_id):
+        with self._transaction() as conn, conn.cursor() as cursor:
+            cursor.execute(_pg("""
+                UPDATE users SET age = ?, description = ?, game_type = ?, steam_profile_url = ?, steam_id = ?,
+                                 platform = ?, region = ?
+                WHERE id = ? RETURNING username
+            """), (age, description, game_type, steam_profile_url, steam_id, platform or None, region or None,
+                   user_id))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            if steam_games is not None:
+                self._write_user_games(cursor, user_id, steam_games)
+            if steam_id:
+                self._enqueue_jobs(cursor, [(user_id, steam_id)], 0)
+            else:
+                cursor.execute("DELETE FROM steam_jobs WHERE user_id = %s", (user_id,))
+        return row['username']
+
+    def update_password(self, user_id, password_hash):
+        with self._transaction() as conn, conn.cursor() as cursor:
+            cursor.execute("UPDATE users SET password = %s WHERE id = %s", (password_hash, user_id))
+
+    def touch_avatar(self, avatar_hash):
+        with self._transaction() as conn, conn.cursor() as cursor:
+            cursor.execute("UPDATE users SET version = version WHERE avatar_hash = %s", (avatar_hash,))
+
+    def reviews(self, user_id):
+        return self._all("""
+            SELECT review_text, to_char(created_at, 'YYYY-MM-DD HH24:MI:SS') AS created_at, user_id, reviewer_username
+            FROM reviews WHERE user_id = ?
+        """, (user_id,))
+
+    def reviews_page(self, user_id, before, limit):
+        position = decode_review_cursor(before)
+        query = """
+            SELECT id AS review_id, review_text, to_char(created_at, 'YYYY-MM-DD HH24:MI:SS') AS created_at,
+                   user_id, reviewer_username
+            FROM reviews WHERE user_id = ?
+        """
+        parameters = [user_id]
+        if position is not None:
+            query += " AND (reviews.created_at, id) < (CAST(? AS TIMESTAMP), ?)"
+            parameters.extend(position)
+        query += " ORDER BY reviews.created_at DESC, id DESC LIMIT ?"
+        parameters.append(limit + 1)
+        return _trim_page(self._all(query, parameters), limit)
+
+    def add_review(self, user_id, review_text, reviewer_username):
+        with self._transaction() as conn, conn.cursor() as cursor:
+            cursor.execute("UPDATE users SET review_count = review_count + 1 WHERE id = %s RETURNING username",
+                           (user_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute("INSERT INTO reviews (user_id, review_text, reviewer_username) VALUES (%s, %s, %s)",
+                           (user_id, review_text, reviewer_username))
+        return row['username']
+
+    def _write_user_games(self, cursor, user_id, games):
+        # execute_values - одна многострочная вставка вместо запроса на каждую игру
+        if games:
+            self._extras.execute_values(cursor, """
+                INSERT INTO games (appid, name) VALUES %s
+                ON CONFLICT (appid) DO UPDATE SET name = EXCLUDED.name WHERE EXCLUDED.name IS NOT NULL
+            """, list(dict(_catalogue(games)).items()))
+        cursor.execute("DELETE FROM user_games WHERE user_id = %s", (user_id,))
+        if games:
+            self._extras.execute_values(cursor, "INSERT INTO user_games (user_id, appid, playtime) VALUES %s",
+                                        _owned(user_id, games))
+        cursor.execute("UPDATE users SET version = version WHERE id = %s", (user_id,))
+
+    def save_user_libraries(self, libraries):
+        with self._transaction() as conn, conn.cursor() as cursor:
+            for user_id, games in libraries:
+                self._write_user_games(cursor, user_id, games)
+
+    def _enqueue_jobs(self, cursor, jobs, delay):
+        now = time.time()
+        cursor.executemany("""
+            INSERT INTO steam_jobs (user_id, steam_id, status, attempts, run_after, updated_at)
+            VALUES (%s, %s, 'pending', 0, %s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET steam_id = EXCLUDED.steam_id, status = 'pending', attempts = 0,
+                run_after = EXCLUDED.run_after, updated_at = EXCLUDED.updated_at, last_error = NULL
+        """, [(user_id, steam_id, now + delay, now) for user_id, steam_id in jobs])
+
+    def enqueue_steam_jobs(self, jobs, delay=0):
+        with self._transaction() as conn, conn.cursor() as cursor:
+            self._enqueue_jobs(cursor, jobs, delay)
+
+    def cancel_steam_job(self, user_id):
+        with self._transaction() as conn, conn.cursor() as cursor:
+            cursor.execute("DELETE FROM steam_jobs WHERE user_id = %s", (user_id,))
+
+    def claim_steam_jobs(self, limit, lease):
+        # SKIP LOCKED: очередь могут разбирать процессы на разных хостах, задача достаётся одному
+        now = time.time()
+        with self._transaction() as conn, conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE steam_jobs SET status = 'running', attempts = attempts + 1, updated_at = %(now)s
+                WHERE user_id IN (
+                    SELECT user_id FROM steam_jobs
+                    WHERE (status = 'pending' AND run_after <= %(now)s)
+                       OR (status = 'running' AND updated_at < %(expired)s)
+                    ORDER BY run_after LIMIT %(limit)s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING user_id, steam_id, attempts
+            """, {'now': now, 'expired': now - lease, 'limit': limit})
+            return cursor.fetchall()
+
+    def finish_steam_jobs(self, libraries, retries, failures):
+        now = time.time()
+        saved = []
+        with self._transaction() as conn, conn.cursor() as cursor:
+            for user_id, steam_id, games in libraries:
+                cursor.execute("""
+                    DELETE FROM steam_jobs WHERE user_id = %s AND steam_id = %s AND status = 'running'
+                    RETURNING user_id
+                """, (user_id, steam_id))
+                if cursor.fetchone():
+                    self._write_user_games(cursor, user_id, games)
+                    saved.append(user_id)
+            cursor.executemany("""
+                UPDATE steam_jobs SET status = 'pending', run_after = %s, last_error = %s, attempts = %s,
+                                      updated_at = %s
+                WHERE user_id = %s AND status = 'running'
+            """, [(run_after, error, attempts, now, user_id) for run_after, error, attempts, user_id in retries])
+            cursor.executemany("""
+                UPDATE steam_jobs SET status = 'failed', last_error = %s, updated_at = %s
+                WHERE user_id = %s AND status = 'running'
+            """, [(error, now, user_id) for error, user_id in failures])
+        return saved
+
+    def steam_job_stats(self):
+        return {row['status']: row['jobs'] for row in
+                self._all("SELECT status, COUNT(*) AS jobs FROM steam_jobs GROUP BY status")}
+
+    def users_with_steam_id(self, after_id, limit):
+        return self._all("""
+            SELECT id, steam_id FROM users WHERE id > ? AND steam_id IS NOT NULL ORDER BY id LIMIT ?
+        """, (after_id, limit))
+
+    def users_missing_steam_id(self, after_id, limit):
+        return self._all("""
+            SELECT id, steam_profile_url FROM users
+            WHERE id > ? AND steam_id IS NULL AND steam_profile_url IS NOT NULL AND steam_profile_url != ''
+            ORDER BY id LIMIT ?
+        """, (after_id, limit))
+
+    def steam_ids(self, urls):
+        urls = list(urls)
+        if not urls:
+            return {}
+        return {row['url']: row['steam_id'] for row in
+                self._all("SELECT url, steam_id FROM steam_ids WHERE url = ANY(?)", (urls,))}
+
+    def store_steam_ids(self, resolved):
+        if not resolved:
+            return
+        now = time.time()
+        with self._transaction() as conn, conn.cursor() as cursor:
+            cursor.executemany("""
+                INSERT INTO steam_ids (url, steam_id, resolved_at) VALUES (%s, %s, %s)
+                ON CONFLICT (url) DO UPDATE SET steam_id = EXCLUDED.steam_id, resolved_at = EXCLUDED.resolved_at
+            """, [(url, steam_id, now) for url, steam_id in resolved.items()])
+
+    def set_user_steam_ids(self, pairs):
+        if not pairs:
+            return
+        with self._transaction() as conn, conn.cursor() as cursor:
+            cursor.executemany("UPDATE users SET steam_id = %s WHERE id = %s", pairs)
+
+    def user_games(self, user_id):
+        return self._all("""
+            SELECT ug.appid, g.name, ug.playtime
+            FROM user_games ug JOIN games g ON g.appid = ug.appid
+            WHERE ug.user_id = ?
+            ORDER BY ug.playtime DESC, g.name
+        """, (user_id,))
+
+    def game_owners(self, appid):
+        return self._all("""
+            SELECT u.id, u.name, u.username, u.avatar, ug.playtime
+            FROM user_games ug JOIN users u ON u.id = ug.user_id
+            WHERE ug.appid = ?
+            ORDER BY ug.playtime DESC
+        """, (appid,))
+
+    def recommendations(self, user_id, limit):
+        return self._all("""
+            SELECT u.id, u.name, u.age, u.game_type, u.avatar, u.avatar_hash, u.username, u.platform, u.region,
+                   n.score,
+                   (SELECT COUNT(*) FROM user_games mine JOIN user_games theirs ON theirs.appid = mine.appid
+                    WHERE mine.user_id = n.user_id AND theirs.user_id = n.neighbor_id) AS common_games
+            FROM user_neighbors n JOIN users u ON u.id = n.neighbor_id
+            WHERE n.user_id = ?
+            ORDER BY n.score DESC
+            LIMIT ?
+        """, (user_id, limit))
+
+    def similarity_data(self):
+        with self._transaction() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT id, age, game_type FROM users ORDER BY id")
+            users = cursor.fetchall()
+            cursor.execute("SELECT user_id, appid FROM user_games")
+            return users, cursor.fetchall()
+
+    def similarity_profiles(self, user_ids):
+        user_ids = list(user_ids)
+        profiles = {}
+        with self._transaction() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT id, age, game_type FROM users WHERE id = ANY(%s)", (user_ids,))
+            for row in cursor.fetchall():
+                profiles[row['id']] = (row['age'], row['game_type'], [])
+            cursor.execute("SELECT user_id, appid FROM user_games WHERE user_id = ANY(%s)", (user_ids,))
+            for row in cursor.fetchall():
+                profiles[row['user_id']][2].append(row['appid'])
+        return profiles
+
+    def _neighbor_stats(self, cursor, user_ids):
+        if user_ids is None:
+            cursor.execute("""
+                SELECT user_id, COUNT(*) AS neighbors, MIN(score) AS threshold FROM user_neighbors GROUP BY user_id
+            """)
+        else:
+            cursor.execute("""
+                SELECT user_id, COUNT(*) AS neighbors, MIN(score) AS threshold FROM user_neighbors
+                WHERE user_id = ANY(%s) GROUP BY user_id
+            """, (list(user_ids),))
+        return cursor.fetchall()
+
+    def neighbor_stats(self, user_ids=None):
+        with self._transaction() as conn, conn.cursor() as cursor:
+            return self._neighbor_stats(cursor, user_ids)
+
+    def neighbor_owners(self, user_ids):
+        owners = {}
+        for row in self._all("SELECT neighbor_id, user_id FROM user_neighbors WHERE neighbor_id = ANY(?)",
+                             (list(user_ids),)):
+            owners.setdefault(row['neighbor_id'], []).append(row['user_id'])
+        return owners
+
+    def _replace_neighbors(self, cursor, user_ids, rows):
+        cursor.execute("DELETE FROM user_neighbors WHERE user_id = ANY(%s)", (list(user_ids),))
+        if rows:
+            self._extras.execute_values(cursor, "INSERT INTO user_neighbors (user_id, neighbor_id, score) VALUES %s",
+                                        rows)
+
+    def replace_neighbors(self, user_ids, rows):
+        with self._transaction() as conn, conn.cursor() as cursor:
+            self._replace_neighbors(cursor, user_ids, rows)
+
+    def update_neighbors(self, user_ids, rows, offers, owners, top_k):
+        with self._transaction() as conn, conn.cursor() as cursor:
+            self._replace_neighbors(cursor, user_ids, rows)
+            if offers:
+                self._extras.execute_values(cursor, """
+                    INSERT INTO user_neighbors (user_id, neighbor_id, score) VALUES %s
+                    ON CONFLICT (user_id, neighbor_id) DO UPDATE SET score = EXCLUDED.score
+                """, offers)
+            cursor.executemany("""
+                DELETE FROM user_neighbors WHERE user_id = %s AND neighbor_id NOT IN (
+                    SELECT neighbor_id FROM user_neighbors WHERE user_id = %s ORDER BY score DESC LIMIT %s
+                )
+            """, [(owner, owner, top_k) for owner in owners])
+            return self._neighbor_stats(cursor, owners)
+
+    def users_missing_avatar_hash(self):
+        return self._all("SELECT id, avatar FROM users WHERE avatar_hash IS NULL AND avatar IS NOT NULL")
+
+    def set_avatar_hashes(self, pairs):
+        if not pairs:
+            return
+        with self._transaction() as conn, conn.cursor() as cursor:
+            cursor.executemany("UPDATE users SET avatar_hash = %s WHERE id = %s", pairs)
+
+    def stats(self):
+        with self._lock:
+            return {'size': self.max_connections, 'checkouts': self.checkouts, 'timeouts': self.timeouts}
+
+    def close(self):
+        # Повторный closeall() падает с PoolError
+        if not self._pool.closed:
+            self._pool.closeall()
+
+
+def repository_from_config(config):
+    settings = settings_from(DEFAULT_CONFIG, config)
+    backend = settings['REPOSITORY_BACKEND']
+    if backend == 'sqlite':
+        return SQLiteRepository()
+    if backend == 'postgresql':
+        repository = PostgresRepository(settings['POSTGRES_DSN'], settings['POSTGRES_POOL_MIN'],
+                                        settings['POSTGRES_POOL_MAX'], settings['POSTGRES_POOL_TIMEOUT'],
+                                        settings['POSTGRES_ITERSIZE'])
+        repository.migrate()
+        return repository
+    raise ValueError(f"Неизвестное хранилище {backend}, допустимо: {', '.join(BACKENDS)}")
+
+
+_default_repository = ProcessDefault('repository', SQLiteRepository)
+
+
+def get_repository():
+    return _default_repository.get()
+
+
+def init_app(app):
+    set_defaults(app, DEFAULT_CONFIG)
+    repository = repository_from_config(app.config)
+    app.extensions['repository'] = repository
+    logger.info("Хранилище: %s", app.config['REPOSITORY_BACKEND'])
+    # Фоновые потоки без контекста приложения работают с тем же хранилищем
+    _default_repository.offer(repository)
@@ -0,0 +1,308 @@
+import logging
+import sqlite3
+
+from db import connection
+
+logger = logging.getLogger(__name__)
+
+
+def _run(conn, script):
+    # executescript() сам делает COMMIT, поэтому внутри миграции выполняем выражения по одному
+    statement = ''
+    for part in script.split(';'):
+        statement += part + ';'
+        # Тела триггеров содержат ';', поэтому собираем части до законченного выражения
+        if sqlite3.complete_statement(statement):
+            if statement.strip(' \n;'):
+                conn.execute(statement)
+            statement = ''
+
+
+def _base_tables(conn):
+    _run(conn, """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL,
+            name TEXT,
+            age INTEGER,
+            description TEXT,
+            game_type TEXT,
+            avatar TEXT,
+            steam_profile_url TEXT,
+            steam_games TEXT
+        );
+        CREATE TABLE IF NOT EXISTS reviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            review_text TEXT NOT NULL,
+            reviewer_username TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        );
+    """)
+
+
+def _owned_games(conn):
+    _run(conn, """
+        CREATE TABLE games (
+            appid INTEGER PRIMARY KEY,
+            name TEXT
+        );
+        CREATE TABLE user_games (
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            appid INTEGER NOT NULL REFERENCES games (appid),
+            playtime INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, appid)
+        ) WITHOUT ROWID;
+        CREATE INDEX idx_user_games_appid ON user_games (appid, user_id);
+    """)
+    # Переносим старую колонку users.steam_games ("10,20,30") в нормализованные таблицы
+    rows = conn.execute("SELECT id, steam_games FROM users WHERE steam_games IS NOT NULL AND steam_games != ''")
+    pairs = []
+    for user_id, steam_games in rows.fetchall():
+        for appid in steam_games.split(','):
+            appid = appid.strip()
+            if appid.isdigit():
+                pairs.append((user_id, int(appid)))
+    conn.executemany("INSERT OR IGNORE INTO games (appid) VALUES (?)", {(appid,) for _, appid in pairs})
+    conn.executemany("INSERT OR IGNORE INTO user_games (user_id, appid) VALUES (?, ?)", pairs)
+    logger.info("Перенесено %d записей из users.steam_games", len(pairs))
+
+
+def _search_indexes(conn):
+    _run(conn, """
+        ALTER TABLE users ADD COLUMN platform TEXT;
+        ALTER TABLE users ADD COLUMN region TEXT;
+        CREATE INDEX idx_users_name ON users (name);
+        CREATE INDEX idx_users_age ON users (age);
+        CREATE INDEX idx_users_game_type_age ON users (game_type, age);
+        CREATE INDEX idx_users_game_type_platform_region_age ON users (game_type, platform, region, age);
+        CREATE INDEX idx_users_platform_region_age ON users (platform, region, age);
+        CREATE INDEX idx_users_region_age ON users (region, age)
+    """)
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE users_fts USING fts5(
+                name, description, content='users', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        # Без FTS5 поиск работает через LIKE (см. search.py)
+        logger.warning("FTS5 недоступен, полнотекстовый индекс не создан: %s", e)
+        return
+    _run(conn, """
+        CREATE TRIGGER users_fts_insert AFTER INSERT ON users BEGIN
+            INSERT INTO users_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        END;
+        CREATE TRIGGER users_fts_delete AFTER DELETE ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        END;
+        CREATE TRIGGER users_fts_update AFTER UPDATE OF name, description ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO users_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        END;
+        INSERT INTO users_fts (users_fts) VALUES ('rebuild')
+    """)
+
+
+def _avatar_hash(conn):
+    conn.execute("ALTER TABLE users ADD COLUMN avatar_hash TEXT")
+
+
+def _review_index_and_counter(conn):
+    _run(conn, """
+        CREATE INDEX idx_reviews_user_created ON reviews (user_id, created_at);
+        ALTER TABLE users ADD COLUMN review_count INTEGER NOT NULL DEFAULT 0;
+        UPDATE users SET review_count = (SELECT COUNT(*) FROM reviews WHERE reviews.user_id = users.id)
+    """)
+
+
+def _steam_jobs(conn):
+    # Очередь фоновой загрузки библиотек Steam: не больше одной задачи на пользователя
+    _run(conn, """
+        CREATE TABLE steam_jobs (
+            user_id INTEGER PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE,
+            steam_id TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_after REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            last_error TEXT
+        );
+        CREATE INDEX idx_steam_jobs_status_run_after ON steam_jobs (status, run_after)
+    """)
+
+
+def _steam_ids(conn):
+    from steamid import InvalidSteamUrl, parse_profile_url
+
+    _run(conn, """
+        CREATE TABLE steam_ids (
+            url TEXT PRIMARY KEY,
+            steam_id TEXT NOT NULL,
+            resolved_at REAL NOT NULL
+        ) WITHOUT ROWID;
+        ALTER TABLE users ADD COLUMN steam_id TEXT
+    """)
+    # Ссылки с числовым ID разбираются без сети, короткие имена разрешает steamid.py resolve
+    pairs = []
+    for user_id, url in conn.execute("SELECT id, steam_profile_url FROM users WHERE steam_profile_url != ''").fetchall():
+        try:
+            steam_id = parse_profile_url(url)[1]
+        except InvalidSteamUrl:
+            continue
+        if steam_id:
+            pairs.append((steam_id, user_id))
+    conn.executemany("UPDATE users SET steam_id = ? WHERE id = ?", pairs)
+    # Задачи в очереди создавались по ID из конца ссылки
+    _run(conn, """
+        DELETE FROM steam_jobs WHERE user_id IN (SELECT id FROM users WHERE steam_id IS NULL);
+        UPDATE steam_jobs SET steam_id = (SELECT steam_id FROM users WHERE users.id = steam_jobs.user_id)
+    """)
+
+
+def _user_neighbors(conn):
+    # Предвычисленные рекомендации: top-K похожих игроков для каждого пользователя (см. recommend.py)
+    _run(conn, """
+        CREATE TABLE user_neighbors (
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            neighbor_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            score REAL NOT NULL,
+            PRIMARY KEY (user_id, neighbor_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX idx_user_neighbors_neighbor ON user_neighbors (neighbor_id)
+    """)
+
+
+def _row_versions(conn):
+    # Версии строк для ETag: data_versions.users растёт при любом изменении пользователей,
+    # users.version - значение счётчика на момент последнего изменения строки. Отзывы и библиотека
+    # "касаются" строки владельца (UPDATE users SET version = version), чтобы сменить её версию
+    _run(conn, """
+        ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+        CREATE TABLE data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        INSERT INTO data_versions (name, version) VALUES ('users', 1);
+        UPDATE users SET version = 1;
+        CREATE TRIGGER users_version_insert AFTER INSERT ON users BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'users';
+            UPDATE users SET version = (SELECT version FROM data_versions WHERE name = 'users') WHERE id = new.id;
+        END;
+        CREATE TRIGGER users_version_update AFTER UPDATE ON users WHEN new.version = old.version BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'users';
+            UPDATE users SET version = (SELECT version FROM data_versions WHERE name = 'users') WHERE id = new.id;
+        END;
+        CREATE TRIGGER users_version_delete AFTER DELETE ON users BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'users';
+        END;
+        CREATE TRIGGER reviews_version_insert AFTER INSERT ON reviews BEGIN
+            UPDATE users SET version = version WHERE id = new.user_id;
+        END;
+        CREATE TRIGGER reviews_version_delete AFTER DELETE ON reviews BEGIN
+            UPDATE users SET version = version WHERE id = old.user_id;
+        END
+    """)
+
+
+def _bulk_checkpoints(conn):
+    # Прогресс массовой загрузки (bulk.py) фиксируется в той же транзакции, что и сами строки,
+    # поэтому после сбоя загрузка продолжается ровно с первой незаписанной записи
+    _run(conn, """
+        CREATE TABLE bulk_checkpoints (
+            name TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            records INTEGER NOT NULL DEFAULT 0,
+            imported INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            watermark INTEGER NOT NULL,
+            deferred TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+
+def _users_version_index(conn):
+    # Снимок списка пользователей (snapshot.py) дочитывает только строки с версией новее своей
+    conn.execute("CREATE INDEX idx_users_version ON users (version)")
+
+
+def _sort_indexes(conn):
+    # Для каждого набора фильтров-равенств и ключа сортировки есть индекс (фильтры..., ключ), а rowid в
+    # конце любого индекса SQLite замыкает порядок "ключ, id": страница читается диапазоном без сортировки.
+    # Наборы с game_type, отсортированные по game_type, идут по индексам (platform, region, game_type)
+    _run(conn, """
+        CREATE INDEX idx_users_game_type_name ON users (game_type, name);
+        CREATE INDEX idx_users_platform_name ON users (platform, name);
+        CREATE INDEX idx_users_region_name ON users (region, name);
+        CREATE INDEX idx_users_game_type_platform_name ON users (game_type, platform, name);
+        CREATE INDEX idx_users_game_type_region_name ON users (game_type, region, name);
+        CREATE INDEX idx_users_platform_region_name ON users (platform, region, name);
+        CREATE INDEX idx_users_game_type_platform_region_name ON users (game_type, platform, region, name);
+        CREATE INDEX idx_users_platform_age ON users (platform, age);
+        CREATE INDEX idx_users_game_type_platform_age ON users (game_type, platform, age);
+        CREATE INDEX idx_users_game_type_region_age ON users (game_type, region, age);
+        CREATE INDEX idx_users_game_type ON users (game_type);
+        CREATE INDEX idx_users_platform_game_type ON users (platform, game_type);
+        CREATE INDEX idx_users_region_game_type ON users (region, game_type);
+        CREATE INDEX idx_users_platform_region_game_type ON users (platform, region, game_type)
+    """)
+
+
+def _avatar_hash_index(conn):
+    # Готовые копии аватарки меняют версию строк всех её владельцев (avatars.py)
+    conn.execute("CREATE INDEX idx_users_avatar_hash ON users (avatar_hash)")
+
+
+# Миграции применяются по порядку, номер последней хранится в PRAGMA user_version.
+# Новые миграции добавляются только в конец списка.
+MIGRATIONS = [
+    _base_tables,
+    _owned_games,
+    _search_indexes,
+    _avatar_hash,
+    _review_index_and_counter,
+    _steam_jobs,
+    _steam_ids,
+    _user_neighbors,
+    _row_versions,
+    _bulk_checkpoints,
+    _users_version_index,
+    _sort_indexes,
+    _avatar_hash_index,
+]
+
+
+def migrate(conn=None):
+    if conn is None:
+        with connection() as conn:
+            return migrate(conn)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Другой процесс мог успеть применить миграцию, пока мы ждали блокировку
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                conn.rollback()
+                continue
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+            logger.info("Применена миграция %d: %s", number, migration.__name__)
+        except Exception:
+            conn.rollback()
+            logger.exception("Ошибка при применении миграции %d: %s", number, migration.__name__)
+            raise
+    return len(MIGRATIONS)
+
+
+def init_app(app):
+    with app.app_context():
+        migrate()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    print(f"Версия схемы: {migrate()}")
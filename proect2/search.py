@@ -0,0 +1,185 @@
+import base64
+import json
+import re
+
+LIST_COLUMNS = ('id', 'name', 'age', 'game_type', 'avatar', 'avatar_hash', 'username', 'steam_profile_url', 'platform',
+                'region')
+
+# Сортировка только по известным ключам - значение из строки запроса в SQL не попадает
+SORT_KEYS = {
+    'name': 'name',
+    'age': 'age',
+    'game_type': 'game_type',
+}
+DEFAULT_SORT = 'name'
+
+FILTER_COLUMNS = ('game_type', 'platform', 'region')
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_query(text):
+    # Каждое слово ищется по префиксу: "вас пет" -> "вас"* "пет"*
+    words = _WORD.findall(text or '')
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def encode_cursor(sort_key, row):
+    raw = json.dumps([sort_key, row[SORT_KEYS[sort_key]], row['id']], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    # Курсор - позиция последней показанной строки: (ключ сортировки, значение ключа, id)
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_key, value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        return None
+    if sort_key not in SORT_KEYS or not isinstance(row_id, int):
+        return None
+    return sort_key, value, row_id
+
+
+def has_fts(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'").fetchone()
+    return row is not None
+
+
+class UserQuery:
+    def __init__(self, columns=LIST_COLUMNS, use_fts=True):
+        self.columns = columns
+        self.use_fts = use_fts
+        self.conditions = []
+        self.parameters = []
+        self.equal = set()
+        self.age = None
+        self.sort_key = DEFAULT_SORT
+        self.position = None
+        self.page_size = None
+
+    def min_age(self, age):
+        # Условие добавляется в _filters(): его форма зависит от ключа сортировки
+        self.age = age or None
+        return self
+
+    def where_equal(self, column, value):
+        if column not in FILTER_COLUMNS:
+            raise ValueError(f"Фильтр по колонке {column} не поддерживается")
+        if value:
+            self.conditions.append(f"{column} = ?")
+            self.parameters.append(value)
+            self.equal.add(column)
+        return self
+
+    def search(self, text):
+        if not text:
+            return self
+        match = fts_query(text)
+        if self.use_fts and match:
+            self.conditions.append("id IN (SELECT rowid FROM users_fts WHERE users_fts MATCH ?)")
+            self.parameters.append(match)
+        else:
+            self.conditions.append("name LIKE ?")
+            self.parameters.append(f"%{text}%")
+        return self
+
+    def order_by(self, key):
+        self.sort_key = key if key in SORT_KEYS else DEFAULT_SORT
+        return self
+
+    def after(self, cursor):
+        # Keyset-пагинация: продолжаем строго после последней строки предыдущей страницы
+        decoded = decode_cursor(cursor) if cursor else None
+        if decoded is not None and decoded[0] == self.sort_key:
+            self.position = decoded[1:]
+        return self
+
+    def limit(self, page_size):
+        self.page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+        return self
+
+    @staticmethod
+    def _where(conditions):
+        if not conditions:
+            return ""
+        return " WHERE " + " AND ".join(conditions)
+
+    def _filters(self, ordered=False):
+        conditions = list(self.conditions)
+        parameters = list(self.parameters)
+        if self.age:
+            # Без сортировки по возрасту страница идёт по индексу (фильтры..., ключ) с проверкой возраста.
+            # Унарный плюс не даёт планировщику взять диапазон по age и потом сортировать весь результат
+            conditions.append("+age >= ?" if ordered and self.sort_key != 'age' else "age >= ?")
+            parameters.append(self.age)
+        return conditions, parameters
+
+    def sql(self):
+        column = SORT_KEYS[self.sort_key]
+        select = f"SELECT {', '.join(self.columns)} FROM users"
+        conditions, parameters = self._filters(ordered=True)
+        if column in self.equal:
+            # Фильтр по колонке сортировки: значение одно на все строки, порядок задаёт только id,
+            # и страница читается по индексу (фильтры..., rowid)
+            if self.position is not None:
+                conditions.append("id > ?")
+                parameters.append(self.position[1])
+            query = select + self._where(conditions) + " ORDER BY id"
+        elif self.position is None or self.position[0] is not None:
+            if self.position is not None:
+                # Строки с NULL стоят раньше курсора, а сравнение с NULL ложно - они отсекаются сами
+                conditions.append(f"({column}, id) > (?, ?)")
+                parameters.extend(self.position)
+            # NULL идут первыми и в SQLite, и в PostgreSQL; id в конце делает порядок однозначным
+            query = select + self._where(conditions) + f" ORDER BY {column} NULLS FIRST, id"
+        else:
+            # Курсор внутри группы NULL: её остаток и затем все строки со значением. Обе части идут
+            # диапазонами по одному индексу и сливаются без сортировки (MERGE в SQLite, Merge Append в PG)
+            query = (select + self._where(conditions + [f"{column} IS NULL", "id > ?"]) + " UNION ALL " +
+                     select + self._where(conditions + [f"{column} IS NOT NULL"]) +
+                     f" ORDER BY {column} NULLS FIRST, id")
+            parameters = parameters + [self.position[1]] + parameters
+        if self.page_size is not None:
+            # Берём на одну строку больше, чтобы узнать, есть ли следующая страница
+            query += " LIMIT ?"
+            parameters.append(self.page_size + 1)
+        return query, parameters
+
+    def count_sql(self):
+        conditions, parameters = self._filters()
+        return "SELECT COUNT(*) FROM users" + self._where(conditions), parameters
+
+    def execute(self, conn):
+        query, parameters = self.sql()
+        return conn.execute(query, parameters)
+
+    def page(self, conn):
+        rows = self.execute(conn).fetchall()
+        next_cursor = None
+        if self.page_size is not None and len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            next_cursor = encode_cursor(self.sort_key, rows[-1])
+        return rows, next_cursor
+
+    def count(self, conn):
+        query, parameters = self.count_sql()
+        return conn.execute(query, parameters).fetchone()[0]
+
+    def explain(self, conn):
+        query, parameters = self.sql()
+        return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, parameters)]
+
+
+def build_user_query(conn, sort_by='name', age_filter=None, search_query=None, game_type_filter=None,
+                     platform_filter=None, region_filter=None, columns=LIST_COLUMNS):
+    return (UserQuery(columns, use_fts=has_fts(conn))
+            .min_age(age_filter)
+            .search(search_query)
+            .where_equal('game_type', game_type_filter)
+            .where_equal('platform', platform_filter)
+            .where_equal('region', region_filter)
+            .order_by(sort_by))
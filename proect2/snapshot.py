@@ -0,0 +1,494 @@
+import bisect
+import heapq
+import itertools
+import logging
+import sys
+import threading
+import time
+from array import array
+
+from flask import current_app, g, has_app_context, has_request_context
+
+from config import set_defaults, settings_from
+from repository import get_repository
+from search import DEFAULT_SORT, MAX_PAGE_SIZE, SORT_KEYS, decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    # Снимок списка пользователей в памяти воркера: фильтры, сортировки и подсчёт на главной без SQL.
+    # Поиск по тексту по-прежнему идёт в БД
+    'DIRECTORY_SNAPSHOT': False,
+    # Если с прошлого обновления изменилось больше этой доли пользователей, снимок строится заново
+    'DIRECTORY_REBUILD_FRACTION': 0.05,
+}
+
+# Колонки строк, которые отдаёт снимок: только то, что нужно таблице на главной и keyset-курсору
+DIRECTORY_COLUMNS = ('id', 'name', 'age', 'game_type', 'avatar', 'username', 'platform', 'region')
+
+_NULL = 0xFFFFFFFF
+
+# Колонка снимка для каждого ключа сортировки из search.SORT_KEYS
+_SORT_COLUMNS = {'name': 'names', 'age': 'ages', 'game_type': 'game_types'}
+
+
+def _order_key(value):
+    # Порядок как в SQLite: NULL < числа < текст (BINARY - побайтово в UTF-8) < BLOB
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value.encode('utf-8'))
+    return (3, bytes(value))
+
+
+# Во сколько раз разбор строки битовой карты встроенными функциями дешевле шага по перестановке в Python
+_SCAN_RATIO = 20
+
+_FLAGS = bytes.maketrans(b'01', b'\x00\x01')
+
+
+def _bits(mask):
+    # Битовая карта -> строка '0'/'1', младший бит (строка 0) первым
+    return bin(mask)[:1:-1]
+
+
+def _members(mask):
+    # Номера установленных битов по возрастанию: поиск '1' идёт в C, цикл Python - только по найденным
+    bits = _bits(mask)
+    find = bits.find
+    result = []
+    index = find('1')
+    while index >= 0:
+        result.append(index)
+        index = find('1', index + 1)
+    return result
+
+
+class _TextColumn:
+    # Строки колонки подряд в одном буфере UTF-8, у каждой строки - смещение и длина.
+    # Изменённое значение дописывается в конец, старое остаётся до полной перестройки снимка
+    __slots__ = ('data', 'starts', 'lengths')
+
+    def __init__(self):
+        self.data = bytearray()
+        self.starts = array('I')
+        self.lengths = array('I')
+
+    def extend(self, values):
+        raws = [None if value is None else str(value).encode('utf-8') for value in values]
+        if not raws:
+            return
+        lengths = [_NULL if raw is None else len(raw) for raw in raws]
+        offset = len(self.data)
+        self.starts.extend(itertools.accumulate((0 if length == _NULL else length for length in lengths[:-1]),
+                                                initial=offset))
+        self.lengths.extend(lengths)
+        self.data += b''.join(raw for raw in raws if raw is not None)
+
+    def append(self, value):
+        self.starts.append(0)
+        self.lengths.append(_NULL)
+        self.set(len(self.lengths) - 1, value)
+
+    def set(self, index, value):
+        if value is None:
+            self.lengths[index] = _NULL
+            return
+        raw = str(value).encode('utf-8')
+        self.starts[index] = len(self.data)
+        self.lengths[index] = len(raw)
+        self.data += raw
+
+    def raw(self, index):
+        length = self.lengths[index]
+        if length == _NULL:
+            return None
+        start = self.starts[index]
+        return self.data[start:start + length]
+
+    def get(self, index):
+        length = self.lengths[index]
+        if length == _NULL:
+            return None
+        start = self.starts[index]
+        return self.data[start:start + length].decode('utf-8')
+
+    def order_key(self, index):
+        raw = self.raw(index)
+        return (0, 0) if raw is None else (2, raw)
+
+    def sorted_indexes(self):
+        # Устойчивая сортировка: при равных значениях строки остаются по возрастанию номера
+        return array('I', sorted(range(len(self.lengths)), key=self.order_key))
+
+    def nbytes(self):
+        return sys.getsizeof(self.data) + sys.getsizeof(self.starts) + sys.getsizeof(self.lengths)
+
+
+class _CodedColumn:
+    # Колонка с небольшим числом различных значений: у строки - код значения, у каждого значения -
+    # битовая карта строк (бит i - строка i). Фильтр по нескольким колонкам - AND битовых карт
+    __slots__ = ('values', 'keys', 'lookup', 'codes', 'bitmaps')
+
+    def __init__(self):
+        self.values = []
+        self.keys = []
+        self.lookup = {}
+        self.codes = array('H')
+        self.bitmaps = []
+
+    def _code(self, value):
+        code = self.lookup.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.keys.append(_order_key(value))
+            self.lookup[value] = code
+            self.bitmaps.append(0)
+        return code
+
+    def extend(self, values):
+        # Без битовых карт: при построении они собираются одним проходом в reindex()
+        self.codes.extend(map(self._code, values))
+
+    def sorted_indexes(self):
+        # Номера строк по возрастанию значения, при равных - по возрастанию номера (сортировка подсчётом)
+        buckets = [[] for _ in self.values]
+        for index, code in enumerate(self.codes):
+            buckets[code].append(index)
+        ranked = sorted(range(len(self.values)), key=self.keys.__getitem__)
+        return array('I', itertools.chain.from_iterable(buckets[code] for code in ranked))
+
+    def reindex(self):
+        width = (len(self.codes) + 7) // 8
+        sets = [bytearray(width) for _ in self.values]
+        for index, code in enumerate(self.codes):
+            sets[code][index >> 3] |= 1 << (index & 7)
+        self.bitmaps = [int.from_bytes(bits, 'little') for bits in sets]
+
+    def add(self, value):
+        code = self._code(value)
+        self.codes.append(code)
+        self.bitmaps[code] |= 1 << (len(self.codes) - 1)
+
+    def set(self, index, value):
+        old = self.codes[index]
+        code = self._code(value)
+        if code == old:
+            return False
+        self.bitmaps[old] &= ~(1 << index)
+        self.bitmaps[code] |= 1 << index
+        self.codes[index] = code
+        return True
+
+    def get(self, index):
+        return self.values[self.codes[index]]
+
+    def order_key(self, index):
+        return self.keys[self.codes[index]]
+
+    def bitmap(self, value):
+        code = self.lookup.get(value)
+        return 0 if code is None else self.bitmaps[code]
+
+    def nbytes(self):
+        return (sys.getsizeof(self.codes) + sys.getsizeof(self.values) + sys.getsizeof(self.lookup)
+                + sum(sys.getsizeof(bitmap) for bitmap in self.bitmaps))
+
+
+class Directory:
+    # Снимок пользователей по колонкам для главной страницы. Для каждого ключа сортировки хранится
+    # перестановка номеров строк, для game_type/platform/region/age - битовые карты значений.
+    # Обновляется по счётчику data_versions.users: дочитываются только строки с версией новее снимка
+    __slots__ = ('rebuild_fraction', 'version', 'size', 'ids', 'slots', 'names', 'usernames', 'avatars', 'ages',
+                 'game_types', 'platforms', 'regions', 'orders', 'ranks', 'age_masks', 'refreshes', 'rebuilds',
+                 'last_refresh', '_lock')
+
+    def __init__(self, rebuild_fraction=0.05):
+        self.rebuild_fraction = rebuild_fraction
+        self.version = None
+        self.refreshes = 0
+        self.rebuilds = 0
+        self.last_refresh = 0.0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.size = 0
+        self.ids = array('I')
+        # Номер строки по id пользователя, _NULL - нет такого
+        self.slots = array('I')
+        self.names = _TextColumn()
+        self.usernames = _TextColumn()
+        self.avatars = _TextColumn()
+        self.ages = _CodedColumn()
+        self.game_types = _CodedColumn()
+        self.platforms = _CodedColumn()
+        self.regions = _CodedColumn()
+        self.orders = {key: array('I') for key in SORT_KEYS}
+        # Обратные перестановки (позиция строки в порядке сортировки), строятся по требованию
+        self.ranks = {}
+        self.age_masks = {}
+
+    def _index(self, user_id):
+        if user_id < len(self.slots) and self.slots[user_id] != _NULL:
+            return self.slots[user_id]
+        return None
+
+    def _sort_key(self, key):
+        column = getattr(self, _SORT_COLUMNS[key])
+        ids = self.ids
+        return lambda index: (column.order_key(index), ids[index])
+
+    def _ranks(self, key):
+        ranks = self.ranks.get(key)
+        if ranks is None:
+            ranks = array('I', bytes(4 * self.size))
+            for position, index in enumerate(self.orders[key]):
+                ranks[index] = position
+            self.ranks[key] = ranks
+        return ranks
+
+    def _append(self, row):
+        index = self.size
+        user_id = row['id']
+        if user_id >= len(self.slots):
+            self.slots.extend(itertools.repeat(_NULL, user_id + 1 - len(self.slots)))
+        self.slots[user_id] = index
+        self.ids.append(user_id)
+        self.names.append(row['name'])
+        self.usernames.append(row['username'])
+        self.avatars.append(row['avatar'])
+        self.size += 1
+        return index
+
+    def _build(self, rows):
+        # Строки приходят по возрастанию id, поэтому номер строки растёт вместе с id, и устойчивая
+        # сортировка по одному значению колонки уже даёт порядок (значение, id)
+        self._reset()
+        self.ids.extend(row['id'] for row in rows)
+        self.size = len(self.ids)
+        if self.size:
+            self.slots.extend(itertools.repeat(_NULL, self.ids[-1] + 1))
+        for index, user_id in enumerate(self.ids):
+            self.slots[user_id] = index
+        for column, name in ((self.names, 'name'), (self.usernames, 'username'), (self.avatars, 'avatar'),
+                             (self.ages, 'age'), (self.game_types, 'game_type'), (self.platforms, 'platform'),
+                             (self.regions, 'region')):
+            column.extend(row[name] for row in rows)
+        for column in (self.ages, self.game_types, self.platforms, self.regions):
+            column.reindex()
+        for key, attribute in _SORT_COLUMNS.items():
+            self.orders[key] = getattr(self, attribute).sorted_indexes()
+        self.rebuilds += 1
+
+    def _apply(self, rows):
+        # Строки, у которых меняется значение ключа сортировки, сначала убираются из перестановки
+        # (позиция ищется по старому значению), а после обновления колонок вставляются заново
+        moved = {key: [] for key in SORT_KEYS}
+        for row in rows:
+            index = self._index(row['id'])
+            if index is None:
+                continue
+            for key, attribute in _SORT_COLUMNS.items():
+                column = getattr(self, attribute)
+                if column.order_key(index) != _order_key(row[SORT_KEYS[key]]):
+                    order = self.orders[key]
+                    sort_key = self._sort_key(key)
+                    del order[bisect.bisect_left(order, sort_key(index), key=sort_key)]
+                    moved[key].append(index)
+
+        for row in rows:
+            index = self._index(row['id'])
+            if index is None:
+                index = self._append(row)
+                self.ages.add(row['age'])
+                self.game_types.add(row['game_type'])
+                self.platforms.add(row['platform'])
+                self.regions.add(row['region'])
+                for indexes in moved.values():
+                    indexes.append(index)
+                continue
+            for column, name in ((self.names, 'name'), (self.usernames, 'username'), (self.avatars, 'avatar')):
+                if column.get(index) != row[name]:
+                    column.set(index, row[name])
+            self.ages.set(index, row['age'])
+            self.game_types.set(index, row['game_type'])
+            self.platforms.set(index, row['platform'])
+            self.regions.set(index, row['region'])
+
+        for key, indexes in moved.items():
+            order = self.orders[key]
+            sort_key = self._sort_key(key)
+            for index in indexes:
+                bisect.insort(order, index, key=sort_key)
+        self.ranks.clear()
+        self.age_masks.clear()
+
+    def refresh(self, repository):
+        # Доводит снимок до текущей версии данных. Запросы ждут обновления на той же блокировке,
+        # поэтому страница никогда не старше версии, вошедшей в её ETag
+        version = repository.users_version()
+        if self.version is not None and version <= self.version:
+            return False
+        with self._lock:
+            if self.version is not None and version <= self.version:
+                return False
+            started = time.perf_counter()
+            if self.version is None:
+                rows = repository.users_since(None)
+                self._build(rows)
+            else:
+                rows = repository.users_since(self.version)
+                added = sum(1 for row in rows if self._index(row['id']) is None)
+                total = repository.count_users(None, None, None, None, None)
+                if self.size + added != total or len(rows) > self.rebuild_fraction * max(self.size, 1):
+                    # Удаления не видны по версиям строк, их выдаёт только несовпадение числа пользователей
+                    rows = repository.users_since(None)
+                    self._build(rows)
+                else:
+                    self._apply(rows)
+            self.version = max([version] + [row['version'] for row in rows])
+            self.refreshes += 1
+            self.last_refresh = time.perf_counter() - started
+            logger.debug("Снимок пользователей обновлён до версии %d: %d строк за %.1f мс",
+                         self.version, len(rows), self.last_refresh * 1000)
+        return True
+
+    def _walk_is_cheaper(self, matched, remaining, wanted):
+        # Обход: примерно wanted * remaining / matched шагов до конца страницы.
+        # Выборка из битовой карты: разбор всей карты плюс шаг на каждую подходящую строку
+        return wanted * remaining < matched * (self.size // _SCAN_RATIO + matched)
+
+    def _age_mask(self, age):
+        # age >= X как в SQL: NULL не проходит, текст больше любого числа
+        mask = self.age_masks.get(age)
+        if mask is None:
+            threshold = _order_key(age)
+            mask = 0
+            for value, key, bitmap in zip(self.ages.values, self.ages.keys, self.ages.bitmaps):
+                if value is not None and key >= threshold:
+                    mask |= bitmap
+            self.age_masks[age] = mask
+        return mask
+
+    def _mask(self, age_filter, game_type_filter, platform_filter, region_filter):
+        # None - фильтров нет; иначе битовая карта подходящих строк
+        mask = self._age_mask(age_filter) if age_filter else None
+        for column, value in ((self.game_types, game_type_filter), (self.platforms, platform_filter),
+                              (self.regions, region_filter)):
+            if value:
+                bitmap = column.bitmap(value)
+                mask = bitmap if mask is None else mask & bitmap
+        return mask
+
+    def _rows(self, indexes):
+        # Словари строятся только для строк страницы
+        ids, name, username, avatar = self.ids, self.names.get, self.usernames.get, self.avatars.get
+        ages, game_types, platforms, regions = self.ages, self.game_types, self.platforms, self.regions
+        return [{
+            'id': ids[index],
+            'name': name(index),
+            'age': ages.values[ages.codes[index]],
+            'game_type': game_types.values[game_types.codes[index]],
+            'avatar': avatar(index),
+            'username': username(index),
+            'platform': platforms.values[platforms.codes[index]],
+            'region': regions.values[regions.codes[index]],
+        } for index in indexes]
+
+    def page(self, sort_by='name', age_filter=None, game_type_filter=None, platform_filter=None, region_filter=None,
+             after=None, page_size=50):
+        # То же, что UserQuery.page() без поиска: (строки, курсор следующей страницы или None)
+        key = sort_by if sort_by in SORT_KEYS else DEFAULT_SORT
+        limit = max(1, min(int(page_size), MAX_PAGE_SIZE))
+        with self._lock:
+            order = self.orders[key]
+            sort_key = self._sort_key(key)
+            position = None
+            decoded = decode_cursor(after) if after else None
+            if decoded is not None and decoded[0] == key:
+                position = (_order_key(decoded[1]), decoded[2])
+            start = bisect.bisect_right(order, position, key=sort_key) if position is not None else 0
+            # Фильтр по колонке сортировки отсекает начало перестановки: age >= X или game_type = X
+            bound = {'age': age_filter, 'game_type': game_type_filter}.get(key)
+            if bound:
+                start = max(start, bisect.bisect_left(order, (_order_key(bound), 0), key=sort_key))
+
+            mask = self._mask(age_filter, game_type_filter, platform_filter, region_filter)
+            if mask is None:
+                indexes = order[start:start + limit + 1]
+            elif self._walk_is_cheaper(mask.bit_count(), self.size - start, limit + 1):
+                # Подходит много строк: идём по перестановке и проверяем флаг, до конца страницы недалеко
+                flags = _bits(mask).encode('ascii').translate(_FLAGS).ljust(self.size, b'\x00')
+                tail = memoryview(order)[start:]
+                selected = map(flags.__getitem__, tail)
+                indexes = list(itertools.islice(itertools.compress(tail, selected), limit + 1))
+            else:
+                # Подходит мало строк: берём их из битовой карты и упорядочиваем по позиции в перестановке
+                ranks = self._ranks(key)
+                candidates = _members(mask)
+                if start:
+                    candidates = [index for index in candidates if ranks[index] >= start]
+                indexes = heapq.nsmallest(limit + 1, candidates, key=ranks.__getitem__)
+            rows = self._rows(indexes)
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(key, rows[-1])
+        return rows, next_cursor
+
+    def count(self, age_filter=None, game_type_filter=None, platform_filter=None, region_filter=None):
+        with self._lock:
+            mask = self._mask(age_filter, game_type_filter, platform_filter, region_filter)
+            return self.size if mask is None else mask.bit_count()
+
+    def nbytes(self):
+        # Память под данные снимка (без объекта Directory и словарей-значений небольших колонок)
+        with self._lock:
+            total = sys.getsizeof(self.ids) + sys.getsizeof(self.slots) + sum(
+                sys.getsizeof(order) for order in itertools.chain(self.orders.values(), self.ranks.values()))
+            for column in (self.names, self.usernames, self.avatars, self.ages, self.game_types, self.platforms,
+                           self.regions):
+                total += column.nbytes()
+            return total
+
+    def stats(self):
+        return {
+            'users': self.size,
+            'version': self.version or 0,
+            'refreshes': self.refreshes,
+            'rebuilds': self.rebuilds,
+            'last_refresh_ms': self.last_refresh * 1000,
+            'bytes': self.nbytes(),
+        }
+
+
+def directory_from_config(config):
+    settings = settings_from(DEFAULT_CONFIG, config)
+    return Directory(rebuild_fraction=settings['DIRECTORY_REBUILD_FRACTION'])
+
+
+def get_directory():
+    # Снимок, доведённый до текущей версии, или None, если он выключен. В пределах одного HTTP-запроса
+    # версия проверяется один раз: список и подсчёт на главной видят одно и то же состояние
+    if not has_app_context():
+        return None
+    directory = current_app.extensions.get('directory')
+    if directory is None:
+        return None
+    if not has_request_context():
+        directory.refresh(get_repository())
+    elif not g.get('directory_fresh'):
+        directory.refresh(get_repository())
+        g.directory_fresh = True
+    return directory
+
+
+def init_app(app):
+    set_defaults(app, DEFAULT_CONFIG)
+    # Строится при первом запросе в процессе воркера, а не в мастере gunicorn
+    app.extensions['directory'] = directory_from_config(app.config) if app.config['DIRECTORY_SNAPSHOT'] else None
@@ -22,4 +22,6 @@ fi
 $VIRTUALENV/bin/pip install -r requirements.txt
 
 # Run your glorious application
-$VIRTUALENV/bin/python3 server.py
\ No newline at end of file
+# Число воркеров и потоков задаётся TEAMFINDER_WORKERS и TEAMFINDER_THREADS,
+# общий ключ сессий - TEAMFINDER_SECRET_KEY
+exec $VIRTUALENV/bin/gunicorn -c gunicorn.conf.py wsgi:app
\ No newline at end of file
@@ -0,0 +1,282 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from config import ProcessDefault, set_defaults, settings_from
+from metrics import observe_steam
+
+logger = logging.getLogger(__name__)
+
+STEAM_API_URL = "http://api.steampowered.com"
+STEAM_API_KEY = "8337B627A76CD0F2447464B6F59CFCE4"
+
+DEFAULT_CONFIG = {
+    'STEAM_API_URL': STEAM_API_URL,
+    'STEAM_API_KEY': STEAM_API_KEY,
+    'STEAM_TIMEOUT': (3.05, 10),  # (connect, read) в секундах
+    'STEAM_CACHE_TTL': 15 * 60,  # сколько библиотека считается свежей
+    'STEAM_CACHE_STALE_TTL': 24 * 60 * 60,  # сколько можно отдавать устаревшие данные
+    'STEAM_CACHE_ERROR_TTL': 60,  # негативный кэш для ошибок Steam
+    'STEAM_CACHE_MAX_ENTRIES': 10000,
+    'STEAM_WORKERS': 4,
+    'STEAM_POOL_SIZE': 10,
+}
+
+
+class SteamError(Exception):
+    pass
+
+
+class SteamRateLimited(SteamError):
+    # 429 от Steam: retry_after - сколько секунд не стоит обращаться к API
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _retry_after(response, default=60):
+    try:
+        return max(1, int(response.headers.get('Retry-After', default)))
+    except ValueError:
+        return default
+
+
+class SteamClient:
+    def __init__(self, base_url=STEAM_API_URL, api_key=STEAM_API_KEY, timeout=(3.05, 10), pool_size=10):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Одна keep-alive сессия на процесс, создаётся при первом запросе
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    def _call(self, method, path, params):
+        # Общая обработка запросов к Web API: таймауты, 429, метрики по исходу
+        import requests
+        params = dict(params, key=self.api_key, format='json')
+        started = time.perf_counter()
+        try:
+            response = self.session.get(f"{self.base_url}/{path}", params=params, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except requests.exceptions.Timeout as e:
+            observe_steam(method, started, 'timeout')
+            raise SteamError(f"Ошибка при запросе к Steam API: {e}") from e
+        except requests.exceptions.HTTPError as e:
+            observe_steam(method, started, f"http_{e.response.status_code}")
+            if e.response.status_code == 429:
+                raise SteamRateLimited(f"Steam API ограничил частоту запросов: {e}",
+                                       _retry_after(e.response)) from e
+            raise SteamError(f"Ошибка при запросе к Steam API: {e}") from e
+        except (requests.exceptions.RequestException, ValueError) as e:
+            observe_steam(method, started, 'error')
+            raise SteamError(f"Ошибка при запросе к Steam API: {e}") from e
+        observe_steam(method, started, 'ok')
+        return data.get('response', {})
+
+    def get_owned_games(self, steam_id):
+        data = self._call('GetOwnedGames', 'IPlayerService/GetOwnedGames/v0001/',
+                          {'steamid': steam_id, 'include_appinfo': 1})
+        return data.get('games', [])
+
+    def resolve_vanity_url(self, vanity):
+        # SteamID64 для короткого имени из ссылки /id/<vanity>, None если такого профиля нет
+        data = self._call('ResolveVanityURL', 'ISteamUser/ResolveVanityURL/v0001/', {'vanityurl': vanity})
+        if data.get('success') == 1:
+            return data.get('steamid')
+        return None
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+class _Entry:
+    # fetched_at - время последнего обращения к Steam, loaded_at - когда были получены сами games
+    __slots__ = ('games', 'fetched_at', 'loaded_at', 'error')
+
+    def __init__(self, games, fetched_at, error=None, loaded_at=None):
+        self.games = games
+        self.fetched_at = fetched_at
+        self.loaded_at = fetched_at if loaded_at is None else loaded_at
+        self.error = error
+
+
+class SteamLibraryCache:
+    def __init__(self, client, ttl=900, stale_ttl=86400, error_ttl=60, max_entries=10000, workers=4,
+                 clock=time.monotonic):
+        self.client = client
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.error_ttl = error_ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        # Записи идут в порядке последней загрузки: вытесняется первая, без поиска минимума
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='steam-refresh')
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.upstream_calls = 0
+
+    def _fetch(self, steam_id):
+        with self._lock:
+            self.upstream_calls += 1
+        try:
+            games = self.client.get_owned_games(steam_id)
+            entry = _Entry(games, self.clock())
+        except SteamError as e:
+            logger.error("%s", e)
+            with self._lock:
+                self.errors += 1
+                previous = self._entries.get(steam_id)
+            # При ошибке продолжаем отдавать старые данные, пока они не старше stale_ttl,
+            # в том числе если Steam недоступен несколько попыток подряд
+            now = self.clock()
+            if previous is not None and now - previous.loaded_at < self.stale_ttl:
+                entry = _Entry(previous.games, now, error=str(e), loaded_at=previous.loaded_at)
+            else:
+                entry = _Entry([], now, error=str(e))
+        with self._lock:
+            if steam_id in self._entries:
+                self._entries.move_to_end(steam_id)
+            elif self._entries and len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+            self._entries[steam_id] = entry
+            self._inflight.pop(steam_id, None)
+        return entry.games
+
+    def _schedule(self, steam_id):
+        # Склеивание запросов: на один steam_id одновременно идёт не больше одного вызова Steam
+        with self._lock:
+            future = self._inflight.get(steam_id)
+            if future is None:
+                future = Future()
+                self._inflight[steam_id] = future
+                started = True
+            else:
+                started = False
+        if started:
+            def run():
+                try:
+                    future.set_result(self._fetch(steam_id))
+                except BaseException as e:
+                    with self._lock:
+                        self._inflight.pop(steam_id, None)
+                    future.set_exception(e)
+            try:
+                self._executor.submit(run)
+            except RuntimeError as e:
+                with self._lock:
+                    self._inflight.pop(steam_id, None)
+                future.set_exception(e)
+        return future
+
+    def _lookup(self, steam_id):
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(steam_id)
+        if entry is None:
+            return None, True
+        age = now - entry.fetched_at
+        if now - entry.loaded_at >= self.stale_ttl:
+            return None, entry.error is None or age >= self.error_ttl
+        if entry.error is not None:
+            return entry, age >= self.error_ttl
+        return entry, age >= self.ttl
+
+    def get(self, steam_id):
+        # Никогда не ходит в Steam в вызывающем потоке: отдаёт то, что есть, и обновляет в фоне
+        if not steam_id:
+            return []
+        entry, refresh = self._lookup(steam_id)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            elif refresh:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+        if refresh:
+            self._schedule(steam_id)
+        return entry.games if entry is not None else []
+
+    def get_or_fetch(self, steam_id, timeout=None):
+        # Для мест, где библиотека нужна сразу (сохранение профиля); параллельные вызовы склеиваются
+        if not steam_id:
+            return []
+        entry, refresh = self._lookup(steam_id)
+        if entry is not None and not refresh:
+            with self._lock:
+                self.hits += 1
+            return entry.games
+        with self._lock:
+            self.misses += 1
+        return self._schedule(steam_id).result(timeout)
+
+    def invalidate(self, steam_id):
+        with self._lock:
+            self._entries.pop(steam_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'inflight': len(self._inflight),
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'errors': self.errors,
+                'upstream_calls': self.upstream_calls,
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+        self.client.close()
+
+
+def cache_from_config(config):
+    settings = settings_from(DEFAULT_CONFIG, config)
+    client = SteamClient(settings['STEAM_API_URL'], settings['STEAM_API_KEY'],
+                         timeout=tuple(settings['STEAM_TIMEOUT']), pool_size=settings['STEAM_POOL_SIZE'])
+    return SteamLibraryCache(client,
+                             ttl=settings['STEAM_CACHE_TTL'],
+                             stale_ttl=settings['STEAM_CACHE_STALE_TTL'],
+                             error_ttl=settings['STEAM_CACHE_ERROR_TTL'],
+                             max_entries=settings['STEAM_CACHE_MAX_ENTRIES'],
+                             workers=settings['STEAM_WORKERS'])
+
+
+_default_cache = ProcessDefault('steam_cache', lambda: cache_from_config(DEFAULT_CONFIG))
+
+
+def get_library_cache():
+    return _default_cache.get()
+
+
+def init_app(app):
+    set_defaults(app, DEFAULT_CONFIG)
+    cache = cache_from_config(app.config)
+    app.extensions['steam_cache'] = cache
+    _default_cache.offer(cache)
@@ -0,0 +1,139 @@
+import argparse
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from repository import get_repository
+from steam import SteamError, get_library_cache
+
+logger = logging.getLogger(__name__)
+
+# SteamID64 = ID64_BASE + номер аккаунта (для индивидуальных аккаунтов публичной вселенной)
+ID64_BASE = 76561197960265728
+STEAM_HOSTS = {'steamcommunity.com', 'www.steamcommunity.com'}
+
+_ID64 = re.compile(r'^7656119\d{10}$')
+_STEAM2 = re.compile(r'^STEAM_[0-5]:([01]):(\d+)$', re.IGNORECASE)
+_STEAM3 = re.compile(r'^\[?U:1:(\d+)\]?$', re.IGNORECASE)
+_VANITY = re.compile(r'^[A-Za-z0-9_-]{2,32}$')
+
+
+class InvalidSteamUrl(ValueError):
+    pass
+
+
+def parse_steam_id(value):
+    # SteamID64 из записи вида 7656119..., STEAM_0:1:123 или [U:1:246], иначе None
+    value = value.strip()
+    if _ID64.match(value):
+        return value
+    match = _STEAM2.match(value)
+    if match:
+        return str(ID64_BASE + int(match.group(2)) * 2 + int(match.group(1)))
+    match = _STEAM3.match(value)
+    if match:
+        return str(ID64_BASE + int(match.group(1)))
+    return None
+
+
+def parse_profile_url(value):
+    # Возвращает (нормализованная ссылка, SteamID64 или None, короткое имя или None).
+    # SteamID64 известен сразу для /profiles/<id> и «сырых» ID, для /id/<имя> нужен ResolveVanityURL
+    value = (value or '').strip()
+    steam_id = parse_steam_id(value)
+    if steam_id:
+        return f"https://steamcommunity.com/profiles/{steam_id}", steam_id, None
+
+    if '://' not in value:
+        value = 'https://' + value
+    parts = urlsplit(value)
+    segments = [segment for segment in parts.path.split('/') if segment]
+    if (parts.hostname or '').lower() not in STEAM_HOSTS or len(segments) < 2:
+        raise InvalidSteamUrl("Ссылка должна вести на профиль steamcommunity.com")
+    kind, key = segments[0].lower(), segments[1]
+    if kind == 'profiles':
+        steam_id = parse_steam_id(key)
+        if steam_id:
+            return f"https://steamcommunity.com/profiles/{steam_id}", steam_id, None
+    elif kind == 'id' and _VANITY.match(key):
+        vanity = key.lower()
+        return f"https://steamcommunity.com/id/{vanity}", None, vanity
+    raise InvalidSteamUrl("Не удалось распознать ссылку на профиль Steam")
+
+
+def resolve(url, client=None):
+    # SteamID64 для ссылки на профиль. Короткие имена разрешаются через Steam один раз и запоминаются
+    # в steam_ids; InvalidSteamUrl - ссылка неверна или профиля нет, SteamError - Steam недоступен
+    canonical, steam_id, vanity = parse_profile_url(url)
+    if steam_id:
+        return steam_id
+    steam_id = get_repository().steam_ids([canonical]).get(canonical)
+    if steam_id:
+        return steam_id
+    client = client or get_library_cache().client
+    steam_id = client.resolve_vanity_url(vanity)
+    if steam_id is None:
+        raise InvalidSteamUrl(f"Профиль Steam «{vanity}» не найден")
+    get_repository().store_steam_ids({canonical: steam_id})
+    return steam_id
+
+
+def resolve_many(urls, client=None, workers=4):
+    # Пакетное разрешение для импорта и пересинхронизации: {исходная ссылка: SteamID64 или None}
+    parsed = {}
+    for url in urls:
+        try:
+            parsed[url] = parse_profile_url(url)
+        except InvalidSteamUrl:
+            parsed[url] = None
+    vanity_urls = {item[0]: item[2] for item in parsed.values() if item and item[1] is None}
+    known = get_repository().steam_ids(vanity_urls)
+
+    missing = [canonical for canonical in vanity_urls if canonical not in known]
+    if missing:
+        client = client or get_library_cache().client
+
+        def lookup(canonical):
+            try:
+                return canonical, client.resolve_vanity_url(vanity_urls[canonical])
+            except SteamError as e:
+                logger.warning("Не удалось разрешить %s: %s", canonical, e)
+                return canonical, None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            resolved = {canonical: steam_id for canonical, steam_id in executor.map(lookup, missing) if steam_id}
+        get_repository().store_steam_ids(resolved)
+        known.update(resolved)
+
+    return {url: (item[1] or known.get(item[0])) if item else None for url, item in parsed.items()}
+
+
+def resolve_users(batch_size=500, client=None):
+    # Заполняет users.steam_id для профилей, у которых ссылка есть, а ID ещё не определён
+    updated = 0
+    last_id = 0
+    while True:
+        rows = get_repository().users_missing_steam_id(last_id, batch_size)
+        if not rows:
+            return updated
+        resolved = resolve_many([row['steam_profile_url'] for row in rows], client)
+        pairs = [(resolved[row['steam_profile_url']], row['id']) for row in rows
+                 if resolved[row['steam_profile_url']]]
+        get_repository().set_user_steam_ids(pairs)
+        updated += len(pairs)
+        last_id = rows[-1]['id']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Определение SteamID64 по ссылкам на профили")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    resolve_parser = subparsers.add_parser('resolve', help="заполнить users.steam_id для всех профилей")
+    resolve_parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    from teamfinder import create_app
+    # Через приложение: то же хранилище (SQLite или PostgreSQL) и поток записи, что у сайта
+    app = create_app({'STEAM_JOBS_WORKER': False})
+    with app.app_context():
+        print(f"Обновлено пользователей: {resolve_users(args.batch_size)}")
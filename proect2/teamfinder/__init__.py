@@ -0,0 +1,108 @@
+import atexit
+import logging
+import os
+
+from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from config import Config, load_secret_key, resolve_path
+
+logger = logging.getLogger(__name__)
+
+_logging_configured = False
+
+
+def configure_logging(level):
+    # Настройка логирования один раз на процесс, сколько бы приложений ни создавалось
+    global _logging_configured
+    if not _logging_configured:
+        logging.basicConfig(level=level, format='%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s')
+        _logging_configured = True
+    logging.getLogger().setLevel(level)
+
+
+def create_app(config=None):
+    # Шаблоны и статика лежат рядом с пакетом, в корне проекта
+    app = Flask(__name__, template_folder='../templates', static_folder='../static')
+    app.config.from_object(Config)
+    if isinstance(config, dict):
+        app.config.from_mapping(config)
+    elif config is not None:
+        app.config.from_object(config)
+    app.config.from_prefixed_env('TEAMFINDER')
+
+    configure_logging(app.config['LOG_LEVEL'])
+    for key in ('DATABASE', 'SECRET_KEY_FILE', 'UPLOAD_FOLDER'):
+        app.config[key] = resolve_path(app.config[key])
+    if not app.config['SECRET_KEY']:
+        app.config['SECRET_KEY'] = load_secret_key(app.config['SECRET_KEY_FILE'])
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    if app.config['PROXY_FIX_X_FOR'] or app.config['PROXY_FIX_X_PROTO']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'],
+                                x_proto=app.config['PROXY_FIX_X_PROTO'])
+
+    import avatars
+    import cache
+    import db
+    import jobs
+    import metrics
+    import passwords
+    import recommend
+    import rendering
+    import repository
+    import schema
+    import snapshot
+    import steam
+    import writer
+
+    # Латентность маршрутов, SQL, Steam и шаблонов на /metrics, выборочный cProfile (см. metrics.DEFAULT_CONFIG)
+    metrics.init_app(app)
+    # Пул соединений и PRAGMA настраиваются ключами DB_* (см. db.DEFAULT_CONFIG)
+    db.init_app(app)
+    # Единый поток записи с групповой фиксацией транзакций (см. writer.DEFAULT_CONFIG)
+    writer.init_app(app)
+    # Кэш библиотек Steam настраивается ключами STEAM_* (см. steam.DEFAULT_CONFIG)
+    steam.init_app(app)
+    schema.init_app(app)
+    # Хранилище пользователей, отзывов и данных Steam: SQLite или PostgreSQL (см. repository.DEFAULT_CONFIG)
+    repository.init_app(app)
+    # Снимок списка пользователей в памяти для главной (см. snapshot.DEFAULT_CONFIG), по умолчанию выключен
+    snapshot.init_app(app)
+    avatars.init_app(app)
+    # Справочники для форм, предзагрузка и кэш байткода шаблонов, отпечатки статики (см. rendering.DEFAULT_CONFIG)
+    rendering.init_app(app)
+    # Очередь фоновой загрузки библиотек Steam (см. jobs.DEFAULT_CONFIG), после миграций и клиента Steam
+    jobs.init_app(app)
+    # Хэширование паролей в пуле процессов и лимиты попыток входа (см. passwords.DEFAULT_CONFIG)
+    passwords.init_app(app)
+    # Рекомендации напарников (см. recommend.DEFAULT_CONFIG), numpy/scipy загружаются только при пересчёте
+    recommend.init_app(app)
+    # Кэш строк пользователей, отзывов и страниц профиля (см. cache.DEFAULT_CONFIG)
+    cache.init_app(app)
+
+    from teamfinder import auth, profile, recommendations, reviews, teammates
+    app.register_blueprint(auth.bp)
+    app.register_blueprint(teammates.bp)
+    app.register_blueprint(profile.bp)
+    app.register_blueprint(reviews.bp)
+    app.register_blueprint(recommendations.bp)
+
+    atexit.register(shutdown, app)
+    return app
+
+
+def shutdown(app, timeout=None):
+    # Плавная остановка воркера: дожидаемся фоновых задач и возврата соединений в пул.
+    # Вызывается и из worker_exit gunicorn, и через atexit - выполняется один раз
+    if app.extensions.get('shutdown_done'):
+        return
+    app.extensions['shutdown_done'] = True
+    timeout = app.config['GRACEFUL_TIMEOUT'] if timeout is None else timeout
+    app.extensions['steam_jobs'].stop(timeout)
+    app.extensions['recommender'].shutdown(wait=True)
+    app.extensions['passwords'].shutdown(wait=True)
+    app.extensions['steam_cache'].shutdown(wait=True)
+    app.extensions['repository'].close()
+    if app.extensions['writer'] is not None:
+        app.extensions['writer'].stop(timeout)
+    app.extensions['db_pool'].drain(timeout)
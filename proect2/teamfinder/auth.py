@@ -0,0 +1,123 @@
+import logging
+
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, session
+from werkzeug.utils import secure_filename
+
+import avatars
+import jobs
+import passwords
+import recommend
+import steamid
+import writer
+from funcs import allowed_file, create_user, get_credentials, update_password
+from steam import SteamError
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint('auth', __name__)
+
+
+@bp.route('/register', methods=['GET', 'POST'])
+def register():
+    if request.method == 'POST':
+        name = request.form['name']
+        username = request.form['username']
+        password = request.form['password']
+        age = request.form['age']
+        description = request.form['description']
+        game_type = request.form['game_type']
+        platform = request.form.get('platform') or None
+        region = request.form.get('region') or None
+        avatar = request.files['avatar']
+        steam_profile_url = request.form.get('steam_profile_url', '')
+
+        try:
+            passwords.check_attempt(None, request.remote_addr)
+        except passwords.TooManyAttempts as e:
+            return render_template('register.html', message=str(e)), 429, {'Retry-After': str(e.retry_after)}
+
+        steam_id = None
+        if steam_profile_url:
+            try:
+                steam_id = steamid.resolve(steam_profile_url)
+            except steamid.InvalidSteamUrl as e:
+                return render_template('register.html', message=str(e))
+            except SteamError:
+                return render_template('register.html', message="Не удалось проверить ссылку на Steam, попробуйте позже.")
+
+        if avatar and allowed_file(avatar.filename):
+            try:
+                avatar_hash, avatar_path = avatars.store_avatar(avatar.read(), secure_filename(avatar.filename))
+            except avatars.InvalidImage as e:
+                return render_template('register.html', message=str(e))
+            except Exception as e:
+                logger.error("Ошибка сохранения аватара: %s", e)
+                return render_template('register.html', message=f"Ошибка сохранения аватара: {e}")
+        else:
+            return render_template('register.html', message="Недопустимый тип файла.")
+
+        # Занятое имя проверяем до хэширования пароля; окончательная проверка - в транзакции записи
+        if get_credentials(username) is not None:
+            return render_template('register.html', message='Пользователь с таким именем уже существует')
+        try:
+            hashed_password = passwords.hash_password(password)
+            user_id = create_user(name, username, hashed_password, age, description, game_type, avatar_path,
+                                  avatar_hash, steam_profile_url, steam_id, platform, region)
+        except (passwords.PasswordBusy, writer.WriterBusy) as e:
+            return (render_template('register.html', message=f"{e}, попробуйте позже."), 503,
+                    {'Retry-After': str(current_app.config['PASSWORD_RETRY_AFTER'])})
+        except Exception as e:
+            logger.error("Ошибка при добавлении данных в БД: %s", e)
+            return render_template('register.html', message=f"Ошибка при добавлении данных в БД: {e}")
+        if user_id is None:
+            return render_template('register.html', message='Пользователь с таким именем уже существует')
+        logger.info("Новый пользователь зарегистрирован: %s", username)
+
+        if steam_id:
+            # Задача загрузки библиотеки поставлена в транзакции регистрации
+            jobs.wake()
+        recommend.schedule_update([user_id])
+        return redirect(url_for('auth.login'))
+
+    return render_template('register.html')
+
+
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        username = request.form['username']
+        password = request.form['password']
+        try:
+            # Лимит проверяется до хэширования: перебор не превращается в нагрузку на процессор
+            passwords.check_attempt(username, request.remote_addr)
+        except passwords.TooManyAttempts as e:
+            return render_template('login.html', message=str(e)), 429, {'Retry-After': str(e.retry_after)}
+
+        user = get_credentials(username)
+
+        try:
+            valid, new_hash = passwords.verify_password(user['password'] if user else None, password)
+        except passwords.PasswordBusy as e:
+            # Очередь хэширования заполнена (PASSWORD_QUEUE_*) или проверка не уложилась в PASSWORD_TIMEOUT:
+            # 503 с формой и Retry-After, попытка в лимит входа уже засчитана
+            return (render_template('login.html', message=f"{e}, попробуйте позже."), 503,
+                    {'Retry-After': str(current_app.config['PASSWORD_RETRY_AFTER'])})
+        if valid:
+            if new_hash:
+                # Параметры хэширования изменились - пароль перехэширован с новыми; вход от этого не зависит
+                try:
+                    update_password(user['id'], new_hash)
+                except Exception as e:
+                    logger.warning("Не удалось обновить хэш пароля %s: %s", username, e)
+            passwords.login_succeeded(username)
+            session['username'] = username
+            return redirect(url_for('teammates.index'))
+        else:
+            return render_template('login.html', message="Неверное имя пользователя или пароль.")
+    return render_template('login.html')
+
+
+@bp.route('/logout')
+def logout():
+    session.pop('username', None)
+    return redirect(url_for('teammates.index'))
@@ -0,0 +1,116 @@
+from flask import Blueprint, render_template, request, redirect, url_for, session
+
+import cache
+import jobs
+import recommend
+import rendering
+import steam
+import steamid
+import writer
+from funcs import edit_profile_data, get_user_by_username, get_user_games, get_profile_with_reviews, get_user_version
+
+bp = Blueprint('profile', __name__)
+
+
+@bp.route('/profile/<username>')
+def profile(username):
+    logged_in = session.get('username')
+    version = get_user_version(username)
+    if version is None:
+        return "Пользователь не найден", 404
+    # Версия строки меняется при правке профиля, новых отзывах и записи библиотеки Steam
+    tag = rendering.etag('profile', username, version, logged_in)
+    response = rendering.not_modified(tag)
+    if response is not None:
+        return response
+    if not logged_in:
+        # Гостям отдаём готовую страницу, пока профиль не изменится; вместе со страницей хранится версия
+        # строки, поэтому копия, не сброшенная в другом процессе, не получит свежий ETag
+        cached_version, page = cache.get_cache().get(cache.profile_page_key(username), (None, None))
+        if cached_version == version:
+            return rendering.with_etag(page, tag)
+    loaded = get_profile_with_reviews(username)
+    if not loaded:
+        return "Пользователь не найден", 404
+    user, reviews, reviews_cursor = loaded
+    user_id = user['id']
+    if user['version'] != version:
+        # Копия профиля в кэше этого процесса отстала от БД (сброс прошёл в другом процессе):
+        # сбрасываем записи пользователя и перечитываем, страница строится по свежим данным
+        cache.invalidate_user(user_id, username)
+        loaded = get_profile_with_reviews(username)
+        if not loaded:
+            return "Пользователь не найден", 404
+        user, reviews, reviews_cursor = loaded
+        user_id = user['id']
+        if user['version'] != version:
+            # Профиль изменился после чтения версии - ETag по версии прочитанных данных
+            version = user['version']
+            tag = rendering.etag('profile', username, version, logged_in)
+    steam_games = get_user_games(user_id)
+    cacheable = True
+    if not steam_games and user['steam_id']:
+        # Библиотека ещё не сохранена в БД - только чтение из кэша, обновление идёт в фоне
+        steam_games = steam.get_library_cache().get(user['steam_id'])
+        cacheable = False
+
+    page = render_template('profile.html', user=user, reviews=reviews, reviews_cursor=reviews_cursor,
+                           logged_in=logged_in, steam_games=steam_games)
+    if not cacheable:
+        # Библиотека из кэша Steam не отражена в версии строки - такие страницы не валидируем
+        return page
+    if not logged_in:
+        cache.get_cache().set(cache.profile_page_key(username), (version, page), cache.page_ttl())
+    return rendering.with_etag(page, tag)
+
+
+@bp.route('/edit_profile', methods=['GET', 'POST'])
+def edit_profile():
+    if 'username' not in session:
+        return redirect(url_for('auth.login'))
+
+    username = session['username']
+    user = get_user_by_username(username)
+
+    if request.method == 'POST':
+        user_id = user['id']
+        new_age = request.form['age']
+        new_description = request.form['description']
+        new_game_type = request.form['game_type']
+        new_platform = request.form.get('platform')
+        new_region = request.form.get('region')
+        steam_profile_url = request.form.get('steam_profile_url', '')
+
+        steam_id = None
+        if steam_profile_url:
+            # Ссылка проверяется при сохранении, страницы профиля SteamID уже не вычисляют
+            try:
+                steam_id = steamid.resolve(steam_profile_url)
+            except steamid.InvalidSteamUrl as e:
+                return render_template('edit_profile.html', user=user, message=str(e),
+                                       logged_in=session.get('username'))
+            except steam.SteamError:
+                return render_template('edit_profile.html', user=user,
+                                       message="Не удалось проверить ссылку на Steam, попробуйте позже.",
+                                       logged_in=session.get('username'))
+
+        # Библиотека Steam загружается в фоне; без ссылки старая библиотека удаляется сразу
+        steam_games = None if steam_id else []
+        try:
+            saved = edit_profile_data(user_id, new_age, new_description, new_game_type, steam_profile_url,
+                                      steam_games, new_platform, new_region, steam_id)
+        except writer.WriterBusy as e:
+            return render_template('edit_profile.html', user=user, message=f"{e}, попробуйте позже.",
+                                   logged_in=session.get('username')), 503
+        if saved:
+            # Задача загрузки библиотеки поставлена или снята в транзакции профиля
+            if steam_id:
+                jobs.wake()
+            # Возраст и жанр могли измениться; библиотеку Steam учтёт фоновая загрузка
+            recommend.schedule_update([user_id])
+            return redirect(url_for('profile.profile', username=username))
+        else:
+            return render_template('edit_profile.html', user=user, message="Ошибка при обновлении профиля.",
+                                   logged_in=session.get('username'))
+
+    return render_template('edit_profile.html', user=user, logged_in=session.get('username'))
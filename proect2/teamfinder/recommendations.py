@@ -0,0 +1,18 @@
+from flask import Blueprint, render_template, redirect, url_for, session
+
+import recommend
+from funcs import get_user_by_username, get_recommendations
+
+bp = Blueprint('recommendations', __name__)
+
+
+@bp.route('/recommendations')
+def recommendations():
+    if 'username' not in session:
+        return redirect(url_for('auth.login'))
+    user = get_user_by_username(session['username'])
+    users = get_recommendations(user['id'])
+    if not users:
+        # Новый профиль ещё не попал в предвычисленный индекс
+        recommend.schedule_update([user['id']])
+    return render_template('recommendations.html', user=user, users=users, logged_in=session.get('username'))
@@ -0,0 +1,49 @@
+import logging
+
+from flask import Blueprint, request, redirect, url_for, session, jsonify
+
+from funcs import add_review, get_reviews_page
+from writer import WriterBusy
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint('reviews', __name__)
+
+
+@bp.route('/reviews/<int:user_id>')
+def reviews_page(user_id):
+    # Подгрузка следующих отзывов на странице профиля
+    reviews, next_cursor = get_reviews_page(user_id, before=request.args.get('before'))
+    return jsonify(reviews=[{'reviewer_username': review['reviewer_username'],
+                             'review_text': review['review_text'],
+                             'created_at': review['created_at']} for review in reviews],
+                   next=next_cursor)
+
+
+@bp.route('/add_review/<user_id>', methods=['POST'])
+def add_review_route(user_id):
+    if 'username' not in session:
+        logger.warning("Пользователь не авторизован")
+        return redirect(url_for('auth.login'))
+
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        logger.error("Неверный user_id: %s", user_id)
+        return "Неверный user_id", 400
+
+    review_text = request.form['review']
+    reviewer_username = session['username']
+    # Текст отзыва в лог не пишем: это пользовательские данные и лишняя строка на каждый запрос
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("add_review: user_id=%d, длина=%d, reviewer_username=%s",
+                     user_id, len(review_text), reviewer_username)
+    try:
+        username = add_review(user_id, review_text, reviewer_username)
+    except WriterBusy as e:
+        return f"{e}, попробуйте позже.", 503
+    if username:
+        return redirect(url_for('profile.profile', username=username))
+    else:
+        logger.error("Пользователь с user_id %d не найден", user_id)
+        return "Пользователь не найден", 404
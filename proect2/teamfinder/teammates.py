@@ -0,0 +1,60 @@
+import csv
+import io
+
+from flask import Blueprint, render_template, request, session, Response, stream_with_context
+
+import rendering
+from funcs import get_users_page, count_users, iter_users, get_users_version
+
+bp = Blueprint('teammates', __name__)
+
+EXPORT_COLUMNS = ('id', 'username', 'name', 'age', 'game_type', 'platform', 'region')
+
+
+@bp.route('/')
+def index():
+    logged_in = session.get('username')
+    # Список зависит только от пользователей: при неизменной версии отвечаем 304 без поиска и подсчёта
+    tag = rendering.etag('index', get_users_version(), sorted(request.args.items(multi=True)), logged_in)
+    response = rendering.not_modified(tag)
+    if response is not None:
+        return response
+
+    sort_by = request.args.get('sort', 'name')
+    age_filter = request.args.get('age', type=int)
+    search_query = request.args.get('search')
+    game_type_filter = request.args.get('game_type')
+    platform_filter = request.args.get('platform')
+    region_filter = request.args.get('region')
+    after = request.args.get('after')
+    users, next_cursor = get_users_page(sort_by, age_filter, search_query, game_type_filter, platform_filter,
+                                        region_filter, after=after)
+    total = count_users(age_filter, search_query, game_type_filter, platform_filter, region_filter)
+    page = render_template('index.html', users=users, total=total, next_cursor=next_cursor, sort_by=sort_by,
+                           age_filter=age_filter, search_query=search_query,
+                           game_type_filter=game_type_filter, platform_filter=platform_filter,
+                           region_filter=region_filter,
+                           logged_in=logged_in)
+    return rendering.with_etag(page, tag)
+
+
+@bp.route('/export.csv')
+def export_users():
+    # Выгрузка списка с теми же фильтрами; строки отдаются по мере чтения из БД
+    args = (request.args.get('sort', 'name'), request.args.get('age', type=int), request.args.get('search'),
+            request.args.get('game_type'), request.args.get('platform'), request.args.get('region'))
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for number, user in enumerate(iter_users(*args), start=1):
+            writer.writerow([user[column] for column in EXPORT_COLUMNS])
+            if number % 500 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=users.csv'})
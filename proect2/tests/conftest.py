@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pytest
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from benchmarks.common import FakeSteam  # заглушка Steam общая с нагрузочными прогонами
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def app(tmp_path):
+    from teamfinder import create_app, shutdown
+
+    app = create_app({
+        'DATABASE': str(tmp_path / 'test.db'),
+        'UPLOAD_FOLDER': str(tmp_path / 'avatars'),
+        'SECRET_KEY': 'test',
+        'LOG_LEVEL': 'WARNING',
+        'STEAM_JOBS_WORKER': False,
+    })
+    yield app
+    shutdown(app, timeout=5)
+
+
+@pytest.fixture
+def fake_steam():
+    # Один Counter-Strike 2: тесты сверяют записанную библиотеку с ним
+    with FakeSteam(games=[{'appid': 730, 'name': 'Counter-Strike 2', 'playtime_forever': 1200}]) as steam:
+        yield steam
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
@@ -0,0 +1,67 @@
+import io
+import os
+import threading
+import time
+
+from PIL import Image
+
+import avatars
+from funcs import create_user, get_user_version
+
+
+def png(color='red'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (120, 120), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def test_variant_jobs_are_coalesced(app, monkeypatch):
+    release = threading.Event()
+    calls = []
+    make_variants = avatars.make_variants
+
+    def blocked(root, digest, data=None):
+        calls.append(digest)
+        release.wait(5)
+        return make_variants(root, digest, data)
+
+    monkeypatch.setattr(avatars, 'make_variants', blocked)
+    client = app.test_client()
+    with app.test_request_context():
+        digest, path = avatars.store_avatar(png(), 'a.png')
+        create_user('Игрок', 'player', 'x', 20, '', 'RPG', path, digest)
+        version = get_user_version('player')
+
+    for _ in range(5):
+        # Копий ещё нет: отдаётся оригинал, новая задача не ставится
+        response = client.get(f'/avatars/{digest}/50')
+        assert response.status_code == 200
+        assert 'no-cache' in response.headers['Cache-Control']
+    release.set()
+    deadline = time.monotonic() + 5
+    while digest in avatars._pending:
+        assert time.monotonic() < deadline, "копии аватарки не построены"
+        time.sleep(0.01)
+
+    assert calls == [digest]
+    assert avatars.variants_ready(app.config['UPLOAD_FOLDER'], digest)
+    with app.app_context():
+        # Готовые копии меняют версию строки владельца, а с ней ETag страниц
+        assert get_user_version('player') != version
+    assert 'immutable' in client.get(f'/avatars/{digest}/50').headers['Cache-Control']
+
+
+def test_avatar_url_points_to_original_until_variants_exist(app):
+    root = app.config['UPLOAD_FOLDER']
+    data = png('blue')
+    with app.test_request_context():
+        digest, _ = avatars.store_avatar(data, 'b.png', background=False)
+        user = {'avatar': f'static/avatars/{digest[:2]}/{digest}.png', 'avatar_hash': digest}
+        assert avatars.avatar_url(user) == f'/avatars/{digest}/50'
+
+        other = avatars.store_avatar(png('green'), 'c.png', background=False)[0]
+        for size in avatars.AVATAR_SIZES:
+            for ext in avatars.FORMATS:
+                os.remove(avatars.variant_path(root, other, size, ext))
+        user = {'avatar': f'static/avatars/{other[:2]}/{other}.png', 'avatar_hash': other}
+        assert avatars.avatar_url(user).startswith(f'/static/avatars/{other[:2]}/{other}.png')
@@ -0,0 +1,61 @@
+import pytest
+
+from bulk import import_records
+
+RECORDS = [{'username': f'user{number}', 'password': 'hash', 'name': f'Игрок {number}', 'age': 20 + number % 30,
+            'game_type': 'RPG'} for number in range(100)]
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupted(records, after):
+    # Поток записей, который обрывается после after записей, как упавший процесс загрузки
+    for number, record in enumerate(records):
+        if number == after:
+            raise Interrupted()
+        yield record
+
+
+@pytest.fixture
+def conn(app):
+    with app.app_context(), app.extensions['db_pool'].connection() as conn:
+        yield conn
+
+
+def schema_objects(conn):
+    return [row['name'] for row in
+            conn.execute("SELECT name FROM sqlite_master WHERE tbl_name = 'users' ORDER BY name")]
+
+
+def usernames(conn):
+    return [row['username'] for row in conn.execute("SELECT username FROM users ORDER BY id")]
+
+
+@pytest.mark.parametrize('defer', [False, True])
+def test_interrupted_import_resumes_from_checkpoint(conn, defer):
+    objects = schema_objects(conn)
+    with pytest.raises(Interrupted):
+        import_records(conn, 'users', interrupted(RECORDS, 55), 'users:test', chunk=10, commit_every=20, defer=defer)
+    # Закоммичены только целые транзакции: 40 записей и отметка прогресса вместе с ними
+    assert usernames(conn) == [record['username'] for record in RECORDS[:40]]
+    checkpoint = conn.execute("SELECT records, imported FROM bulk_checkpoints WHERE name = 'users:test'").fetchone()
+    assert tuple(checkpoint) == (40, 40)
+
+    # Повторный запуск с тем же именем читает файл сначала и пропускает уже записанное
+    result = import_records(conn, 'users', iter(RECORDS), 'users:test', chunk=10, commit_every=20, defer=defer)
+    assert result == {'records': 100, 'imported': 100, 'skipped': 0}
+    assert usernames(conn) == [record['username'] for record in RECORDS]
+    assert conn.execute("SELECT COUNT(*) FROM bulk_checkpoints").fetchone()[0] == 0
+    # Отложенные индексы и триггеры возвращены
+    assert schema_objects(conn) == objects
+
+
+def test_restart_forgets_checkpoint(conn):
+    with pytest.raises(Interrupted):
+        import_records(conn, 'users', interrupted(RECORDS, 30), 'users:test', chunk=10, commit_every=10)
+    result = import_records(conn, 'users', iter(RECORDS), 'users:test', chunk=10, restart=True)
+    # Уже загруженные имена заняты и пропускаются
+    assert result == {'records': 100, 'imported': 70, 'skipped': 30}
+    assert len(usernames(conn)) == 100
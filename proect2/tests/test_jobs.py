@@ -0,0 +1,75 @@
+import pytest
+
+from db import connection
+from funcs import create_user, edit_profile_data, get_user_games
+from jobs import SteamJobWorker, WorkerLock
+from steam import SteamClient
+
+STEAM_ID = '76561197960287930'
+
+
+@pytest.fixture
+def worker(app, fake_steam):
+    worker = SteamJobWorker(SteamClient(fake_steam.url, 'test', timeout=(1, 2)), app, rate=0)
+    yield worker
+    worker.stop(5)
+
+
+def create_steam_user(username='anya'):
+    return create_user('Аня', username, 'x', 20, '', 'RPG', 'static/avatars/a.png', None,
+                       f'https://steamcommunity.com/profiles/{STEAM_ID}', STEAM_ID, None, None)
+
+
+def job_rows(user_id):
+    with connection() as conn:
+        return conn.execute("SELECT steam_id, status FROM steam_jobs WHERE user_id = ?", (user_id,)).fetchall()
+
+
+def test_profile_writes_queue_steam_job(app):
+    with app.app_context():
+        user_id = create_steam_user()
+        assert [tuple(row) for row in job_rows(user_id)] == [(STEAM_ID, 'pending')]
+
+        assert edit_profile_data(user_id, 21, '', 'RPG', '', [], None, None, None)
+        assert job_rows(user_id) == []
+        assert edit_profile_data(user_id, 21, '', 'RPG', f'https://steamcommunity.com/profiles/{STEAM_ID}', None,
+                                 None, None, STEAM_ID)
+        assert [tuple(row) for row in job_rows(user_id)] == [(STEAM_ID, 'pending')]
+
+
+def test_worker_saves_library_and_finishes_job(app, worker, fake_steam):
+    with app.app_context():
+        user_id = create_steam_user()
+        assert worker.run_once() == 1
+        assert job_rows(user_id) == []
+        assert [game['appid'] for game in get_user_games(user_id)] == [730]
+    assert worker.stats()['fetched'] == 1
+
+
+def test_library_of_cancelled_job_is_not_saved(app, worker, fake_steam, monkeypatch):
+    with app.app_context():
+        user_id = create_steam_user()
+        fetch = worker._fetch
+
+        def fetch_then_unlink(steam_id):
+            # Пока шёл запрос к Steam, пользователь убрал ссылку на профиль
+            games = fetch(steam_id)
+            with app.app_context():
+                edit_profile_data(user_id, 21, '', 'RPG', '', [], None, None, None)
+            return games
+
+        monkeypatch.setattr(worker, '_fetch', fetch_then_unlink)
+        assert worker.run_once() == 1
+        assert get_user_games(user_id) == []
+        assert job_rows(user_id) == []
+    assert worker.stats()['discarded'] == 1
+
+
+def test_only_one_process_holds_worker_lock(tmp_path):
+    first = WorkerLock(str(tmp_path / 'jobs.lock'))
+    second = WorkerLock(str(tmp_path / 'jobs.lock'))
+    assert first.acquire()
+    assert not second.acquire()
+    first.release()
+    assert second.acquire()
+    second.release()
@@ -0,0 +1,68 @@
+import pytest
+
+from metrics import statement_label
+from search import build_user_query
+
+
+def test_query_variants_get_distinct_labels(app):
+    with app.app_context():
+        from db import connection
+        with connection() as conn:
+            first = build_user_query(conn, 'name', 30, None, 'RPG', 'PC', None).limit(20).sql()[0]
+            second = build_user_query(conn, 'name', 30, None, 'RPG', None, 'СНГ').limit(20).sql()[0]
+    assert statement_label(first) != statement_label(second)
+    assert statement_label(first) == statement_label(' '.join(first.split()))
+    assert statement_label(first).startswith('SELECT users ')
+    assert statement_label("SELECT * FROM users WHERE id IN (?, ?)") == \
+        statement_label("SELECT * FROM users WHERE id IN (?, ?, ?)")
+
+
+def test_metrics_restricted_to_allowed_addresses(app):
+    client = app.test_client()
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert b'teamfinder_sql_query_duration_seconds' in response.data
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.5'}).status_code == 404
+
+
+def test_values_inlined_by_psycopg2_share_a_label():
+    # execute_values присылает bytes с подставленными строками
+    first = b"INSERT INTO games (appid, name) VALUES (730,'Counter-Strike 2'),(570,'Dota, 2')"
+    second = b"INSERT INTO games (appid, name) VALUES (10,'It''s')"
+    assert statement_label(first) == statement_label(second)
+    assert statement_label(first).startswith('INSERT games ')
+    assert statement_label("SELECT * FROM users WHERE id = %s") == statement_label("SELECT * FROM users WHERE id = ?")
+
+
+def test_postgres_cursor_is_timed():
+    from metrics import QUERY_ERRORS, QUERY_LATENCY, timed_cursor_factory
+
+    class Error(Exception):
+        pass
+
+    class Cursor:
+        def execute(self, query, vars=None):
+            if 'broken' in query:
+                raise Error(query)
+
+        def executemany(self, query, vars_list):
+            pass
+
+    cursor = timed_cursor_factory(Cursor, Error)()
+    cursor.execute("SELECT id FROM users WHERE id = %s", (1,))
+    with pytest.raises(Error):
+        cursor.execute("SELECT broken FROM users")
+    rendered = '\n'.join(QUERY_LATENCY.render() + QUERY_ERRORS.render())
+    assert statement_label("SELECT id FROM users WHERE id = %s") in rendered
+    assert f'statement="{statement_label("SELECT broken FROM users")}",error="Error"' in rendered
+
+
+def test_unhandled_exception_is_recorded_as_500(app):
+    from metrics import REQUEST_LATENCY
+
+    @app.route('/boom')
+    def boom():
+        raise RuntimeError("boom")
+
+    assert app.test_client().get('/boom').status_code == 500
+    assert 'endpoint="boom",method="GET",status="500"' in '\n'.join(REQUEST_LATENCY.render())
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+from passwords import Hasher, PasswordBusy
+
+
+@pytest.fixture
+def hasher():
+    hasher = Hasher('pbkdf2:sha256:1000', workers=1, queue_per_worker=1, timeout=0.5, queue_min=1)
+    yield hasher
+    hasher.shutdown(wait=True)
+
+
+def test_full_queue_is_rejected_without_waiting(hasher):
+    # Первый вызов запускает процесс пула, чтобы таймаут ниже не зависел от его старта
+    hasher._run(time.sleep, 0)
+    # Единственное место занято задачей, которая ещё считается
+    with pytest.raises(PasswordBusy):
+        hasher._run(time.sleep, 2)
+    started = time.monotonic()
+    with pytest.raises(PasswordBusy):
+        hasher._run(time.sleep, 0)
+    assert time.monotonic() - started < 0.1
+    assert hasher.stats()['timeouts'] == 1
+    assert hasher.stats()['rejected'] == 1
+
+    # Место освобождается, когда задача в пуле закончилась
+    deadline = time.monotonic() + 5
+    while not hasher._slots.acquire(blocking=False):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    hasher._slots.release()
+    hasher._run(time.sleep, 0)
+
+
+def test_queue_has_minimum_depth_on_small_hosts():
+    from passwords import hasher_from_config
+
+    # Один CPU - один процесс пула, но восемь одновременных входов помещаются в очередь
+    assert hasher_from_config({'PASSWORD_WORKERS': 1}).queue_size == 16
+    assert hasher_from_config({'PASSWORD_WORKERS': 8}).queue_size == 32
+    assert hasher_from_config({'PASSWORD_WORKERS': 1, 'PASSWORD_QUEUE_MIN': 2}).queue_size == 4
+
+
+def test_busy_login_is_503_with_retry_after(app, monkeypatch):
+    def busy(*args):
+        raise PasswordBusy("Сервер перегружен проверкой паролей")
+
+    monkeypatch.setattr(app.extensions['passwords'], '_run', busy)
+    response = app.test_client().post('/login', data={'username': 'anya', 'password': 'x'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert 'попробуйте позже' in response.get_data(as_text=True)
+
+
+def test_proxy_fix_uses_forwarded_address(tmp_path):
+    from teamfinder import create_app, shutdown
+
+    app = create_app({'DATABASE': str(tmp_path / 'test.db'), 'UPLOAD_FOLDER': str(tmp_path / 'avatars'),
+                      'SECRET_KEY': 'test', 'LOG_LEVEL': 'WARNING', 'STEAM_JOBS_WORKER': False,
+                      'PROXY_FIX_X_FOR': 1, 'LOGIN_MAX_ATTEMPTS_IP': 1})
+    try:
+        client = app.test_client()
+        form = {'username': 'nobody', 'password': 'x'}
+        assert client.post('/login', data=form, headers={'X-Forwarded-For': '198.51.100.1'}).status_code == 200
+        assert client.post('/login', data=form, headers={'X-Forwarded-For': '198.51.100.1'}).status_code == 429
+        assert client.post('/login', data=form, headers={'X-Forwarded-For': '198.51.100.2'}).status_code == 200
+    finally:
+        shutdown(app, timeout=5)
@@ -0,0 +1,72 @@
+from concurrent.futures import Future
+
+import pytest
+
+import cache
+from funcs import add_review, create_user, get_profile_with_reviews
+
+
+def test_stale_cached_profile_is_reloaded(app):
+    with app.app_context():
+        user_id = create_user('Аня', 'anya', 'x', 20, 'Старое описание', 'RPG', 'static/avatars/a.png', None,
+                              '', None, None, None)
+        create_user('Борис', 'boris', 'x', 25, '', 'RPG', 'static/avatars/b.png', None, '', None, None, None)
+        get_profile_with_reviews('anya')
+        stale = cache.get_cache().get(cache.profile_key('anya'))
+        add_review(user_id, 'Отличный напарник', 'boris')
+        # Как будто сброс кэша прошёл только в другом процессе
+        cache.get_cache().set(cache.profile_key('anya'), stale)
+
+    response = app.test_client().get('/profile/anya')
+    assert response.status_code == 200
+    assert 'Отличный напарник' in response.get_data(as_text=True)
+    assert response.headers.get('ETag')
+
+
+@pytest.fixture
+def other_worker(app):
+    # Второй процесс gunicorn: та же БД, свои кэши
+    from teamfinder import create_app, shutdown
+
+    other = create_app(dict(app.config))
+    yield other
+    shutdown(other, timeout=5)
+
+
+def test_edit_form_shows_profile_saved_by_other_worker(app, other_worker):
+    with app.app_context():
+        create_user('Аня', 'anya', 'x', 20, 'Старое описание', 'RPG', 'static/avatars/a.png', None, '', None, None,
+                    None)
+    client = app.test_client()
+    other_client = other_worker.test_client()
+    for each in (client, other_client):
+        with each.session_transaction() as session:
+            session['username'] = 'anya'
+    assert 'Старое описание' in client.get('/edit_profile').get_data(as_text=True)
+
+    response = other_client.post('/edit_profile', data={'age': '21', 'description': 'Новое описание',
+                                                        'game_type': 'RPG'})
+    assert response.status_code == 302
+    assert 'Новое описание' in client.get('/edit_profile').get_data(as_text=True)
+
+
+def test_writer_uses_dedicated_full_sync_connection(app):
+    with app.app_context():
+        create_user('Аня', 'anya', 'x', 20, '', 'RPG', 'static/avatars/a.png', None, '', None, None, None)
+        writer = app.extensions['writer']
+        assert writer._conn.execute("PRAGMA synchronous").fetchone()[0] == 2
+        assert app.extensions['db_pool'].stats()['in_use'] == 0
+
+
+def test_review_write_timeout_is_503(app, monkeypatch):
+    with app.app_context():
+        user_id = create_user('Аня', 'anya', 'x', 20, '', 'RPG', 'static/avatars/a.png', None, '', None, None,
+                              None)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['username'] = 'boris'
+    writer = app.extensions['writer']
+    monkeypatch.setattr(writer, 'timeout', 0.2)
+    monkeypatch.setattr(writer, 'submit', lambda operation, *args: Future())
+    assert client.post(f'/add_review/{user_id}', data={'review': 'Привет'}).status_code == 503
+
@@ -0,0 +1,134 @@
+import random
+
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('scipy')
+
+from db import connection
+from funcs import create_user, edit_profile_data, save_user_libraries
+from recommend import Recommender
+
+TOP_K = 3
+GENRES = ['RPG', 'Шутеры', 'MMORPG', '']
+
+
+def similarity(first, second):
+    # Та же оценка, что SimilarityModel.scores, без матриц: 0.6 Жаккар + 0.25 жанр + 0.15 возраст
+    (first_age, first_genre, first_games), (second_age, second_genre, second_games) = first, second
+    union = first_games | second_games
+    games = len(first_games & second_games) / len(union) if union else 0.0
+    genre = 1.0 if first_genre and first_genre == second_genre else 0.0
+    age = max(0.0, 1 - abs(first_age - second_age) / 10) if first_age is not None and second_age is not None else 0.0
+    return 0.6 * games + 0.25 * genre + 0.15 * age
+
+
+def profiles():
+    with connection() as conn:
+        users = {row['id']: (row['age'], row['game_type'], set()) for row in
+                 conn.execute("SELECT id, age, game_type FROM users")}
+        for row in conn.execute("SELECT user_id, appid FROM user_games"):
+            users[row['user_id']][2].add(row['appid'])
+    return users
+
+
+def neighbors():
+    lists = {}
+    with connection() as conn:
+        for row in conn.execute("SELECT user_id, neighbor_id, score FROM user_neighbors ORDER BY score DESC"):
+            lists.setdefault(row['user_id'], {})[row['neighbor_id']] = row['score']
+    return lists
+
+
+def games(appids):
+    return [{'appid': appid, 'name': f'Игра {appid}', 'playtime_forever': 10} for appid in appids]
+
+
+@pytest.fixture
+def users(app):
+    rng = random.Random(5)
+    with app.app_context():
+        user_ids = [create_user('Игрок', f'user{number}', 'x', rng.choice([None] + list(range(16, 40))), '',
+                                rng.choice(GENRES), 'static/avatars/a.png', None)
+                    for number in range(30)]
+        save_user_libraries([(user_id, games(rng.sample(range(1, 15), rng.randint(0, 6)))) for user_id in user_ids])
+        yield user_ids
+
+
+@pytest.fixture
+def recommender(users):
+    recommender = Recommender(top_k=TOP_K, block_size=7)
+    recommender.rebuild()
+    return recommender
+
+
+def assert_stats_match(recommender):
+    # Размер списка и худшая оценка в памяти совпадают с user_neighbors
+    lists = neighbors()
+    model = recommender._model
+    for user_id, row in model.rows.items():
+        stored = lists.get(user_id, {})
+        assert recommender._counts[row] == len(stored)
+        if stored:
+            assert recommender._thresholds[row] == pytest.approx(min(stored.values()), abs=1e-6)
+
+
+def test_rebuild_stores_top_k_by_similarity(users, recommender):
+    data = profiles()
+    lists = neighbors()
+    for user_id in users:
+        stored = lists[user_id]
+        assert len(stored) == TOP_K
+        assert user_id not in stored
+        for neighbor_id, score in stored.items():
+            assert score == pytest.approx(similarity(data[user_id], data[neighbor_id]), abs=1e-5)
+        others = [similarity(data[user_id], data[other]) for other in users
+                  if other != user_id and other not in stored]
+        assert min(stored.values()) >= max(others) - 1e-5
+    assert_stats_match(recommender)
+
+
+def test_update_adds_user_to_lists_it_beats(users, recommender):
+    target, changed = users[0], users[1]
+    with connection() as conn:
+        age, genre = conn.execute("SELECT age, game_type FROM users WHERE id = ?", (target,)).fetchone()
+    before = neighbors()
+    # changed становится копией target: полное совпадение обходит любого соседа target
+    assert edit_profile_data(changed, age, '', genre or 'RPG', '')
+    if not genre:
+        assert edit_profile_data(target, age, '', 'RPG', '')
+    save_user_libraries([(changed, games([1, 2, 3])), (target, games([1, 2, 3]))])
+    recommender.update_users([changed, target])
+
+    data = profiles()
+    lists = neighbors()
+    assert next(iter(lists[target])) == changed
+    assert next(iter(lists[changed])) == target
+    for owner, stored in lists.items():
+        assert len(stored) == TOP_K
+        for neighbor_id in (changed, target):
+            if neighbor_id in stored:
+                # Оценка в чужом списке пересчитана
+                assert stored[neighbor_id] == pytest.approx(similarity(data[owner], data[neighbor_id]), abs=1e-5)
+            elif owner not in (changed, target):
+                # Не попал в список: не лучше худшего соседа до обновления или вытеснен при обрезке
+                worst = max(min(before[owner].values()), min(stored.values()))
+                assert similarity(data[owner], data[neighbor_id]) <= worst + 1e-5
+    assert_stats_match(recommender)
+
+
+def test_dissimilar_user_does_not_enter_full_lists(users, recommender):
+    changed = users[2]
+    before = neighbors()
+    listed_before = {owner for owner, stored in before.items() if changed in stored}
+    # Ни возраста, ни жанра, ни игр: оценка 0 со всеми
+    assert edit_profile_data(changed, None, '', '', '', [])
+    recommender.update_users([changed])
+
+    lists = neighbors()
+    for owner, stored in lists.items():
+        assert len(stored) == TOP_K
+        if changed in stored:
+            assert owner in listed_before
+            assert stored[changed] == pytest.approx(0.0, abs=1e-6)
+    assert_stats_match(recommender)
@@ -0,0 +1,225 @@
+import os
+import uuid
+
+import pytest
+
+STEAM_ID = '76561197960287930'
+OTHER_STEAM_ID = '76561197960287931'
+GAMES = [{'appid': 730, 'name': 'Counter-Strike 2', 'playtime_forever': 1200},
+         {'appid': 570, 'name': 'Dota 2', 'playtime_forever': 30}]
+
+
+@pytest.fixture
+def postgres_dsn():
+    # Отдельная схема на тест в БД из TEAMFINDER_TEST_POSTGRES_DSN, после теста удаляется
+    dsn = os.environ.get('TEAMFINDER_TEST_POSTGRES_DSN')
+    if not dsn:
+        pytest.skip("TEAMFINDER_TEST_POSTGRES_DSN не задан")
+    psycopg2 = pytest.importorskip('psycopg2')
+    schema = f"teamfinder_test_{uuid.uuid4().hex[:12]}"
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA {schema}")
+    try:
+        yield f"{dsn} options='-csearch_path={schema}'"
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA {schema} CASCADE")
+        conn.close()
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def repository(request, tmp_path):
+    from teamfinder import create_app, shutdown
+
+    config = {
+        'DATABASE': str(tmp_path / 'test.db'),
+        'UPLOAD_FOLDER': str(tmp_path / 'avatars'),
+        'SECRET_KEY': 'test',
+        'LOG_LEVEL': 'WARNING',
+        'STEAM_JOBS_WORKER': False,
+    }
+    if request.param == 'postgresql':
+        config.update(REPOSITORY_BACKEND='postgresql', POSTGRES_DSN=request.getfixturevalue('postgres_dsn'))
+    app = create_app(config)
+    try:
+        with app.app_context():
+            yield app.extensions['repository']
+    finally:
+        shutdown(app, timeout=5)
+
+
+def create(repository, username, steam_id=None, **fields):
+    values = {'name': username.title(), 'age': 20, 'game_type': 'RPG', 'platform': None, 'region': None}
+    values.update(fields)
+    url = f'https://steamcommunity.com/profiles/{steam_id}' if steam_id else ''
+    return repository.create_user(values['name'], username, 'hash', values['age'], 'описание', values['game_type'],
+                                  'static/avatars/a.png', None, url, steam_id, values['platform'], values['region'])
+
+
+def update(repository, user_id, steam_id=None, steam_games=None, age=21):
+    url = f'https://steamcommunity.com/profiles/{steam_id}' if steam_id else ''
+    return repository.update_profile(user_id, age, 'описание', 'RPG', url, steam_games, None, None, steam_id)
+
+
+def test_create_user_rejects_taken_username(repository):
+    user_id = create(repository, 'anya')
+    assert user_id is not None
+    assert create(repository, 'anya') is None
+    assert repository.user_by_username('anya')['id'] == user_id
+    assert repository.credentials('anya')['password'] == 'hash'
+
+
+def test_row_version_changes_on_profile_write(repository):
+    user_id = create(repository, 'anya')
+    version = repository.user_version('anya')
+    users_version = repository.users_version()
+    assert update(repository, user_id) == 'anya'
+    assert repository.user_version('anya') > version
+    assert repository.users_version() > users_version
+    assert update(repository, 10 ** 6) is None
+
+
+def test_users_page_sorts_nulls_first_and_pages_by_cursor(repository):
+    ids = [create(repository, username, name=name)
+           for username, name in [('a', 'Борис'), ('b', None), ('c', 'Аня'), ('d', None), ('e', 'Борис')]]
+    seen = []
+    after = None
+    while True:
+        rows, after = repository.users_page('name', None, None, None, None, None, after, 2)
+        seen.extend(row['id'] for row in rows)
+        if not after:
+            break
+    assert seen == [ids[1], ids[3], ids[2], ids[0], ids[4]]
+    assert repository.count_users(None, None, 'RPG', None, None) == 5
+
+
+def test_reviews_are_paged_newest_first(repository):
+    user_id = create(repository, 'anya')
+    for number in range(3):
+        assert repository.add_review(user_id, f'отзыв {number}', 'boris') == 'anya'
+    assert repository.add_review(10 ** 6, 'отзыв', 'boris') is None
+    user, reviews, cursor = repository.profile_with_reviews('anya', 2)
+    assert user['review_count'] == 3
+    assert [review['review_text'] for review in reviews] == ['отзыв 2', 'отзыв 1']
+    rest, next_cursor = repository.reviews_page(user_id, cursor, 2)
+    assert [review['review_text'] for review in rest] == ['отзыв 0']
+    assert next_cursor is None
+
+
+def test_profile_write_queues_and_cancels_steam_job(repository):
+    user_id = create(repository, 'anya', STEAM_ID)
+    assert repository.steam_job_stats() == {'pending': 1}
+    update(repository, user_id, steam_games=[])
+    assert repository.steam_job_stats() == {}
+    update(repository, user_id, STEAM_ID)
+    assert [(job['user_id'], job['steam_id'], job['attempts'])
+            for job in repository.claim_steam_jobs(10, 300)] == [(user_id, STEAM_ID, 1)]
+    assert repository.claim_steam_jobs(10, 300) == []
+
+
+def test_finished_job_saves_library(repository):
+    user_id = create(repository, 'anya', STEAM_ID)
+    repository.claim_steam_jobs(10, 300)
+    assert repository.finish_steam_jobs([(user_id, STEAM_ID, GAMES)], [], []) == [user_id]
+    assert [game['appid'] for game in repository.user_games(user_id)] == [730, 570]
+    assert repository.steam_job_stats() == {}
+    assert [owner['id'] for owner in repository.game_owners(570)] == [user_id]
+
+
+def test_requeued_or_cancelled_job_does_not_save_library(repository):
+    requeued = create(repository, 'anya', STEAM_ID)
+    cancelled = create(repository, 'boris', STEAM_ID)
+    repository.claim_steam_jobs(10, 300)
+    # Пока шёл запрос к Steam, один сменил ссылку, другой её убрал
+    update(repository, requeued, OTHER_STEAM_ID)
+    repository.cancel_steam_job(cancelled)
+    saved = repository.finish_steam_jobs([(requeued, STEAM_ID, GAMES), (cancelled, STEAM_ID, GAMES)], [], [])
+    assert saved == []
+    assert repository.user_games(requeued) == []
+    assert repository.user_games(cancelled) == []
+    assert repository.steam_job_stats() == {'pending': 1}
+
+
+def test_retried_and_failed_jobs(repository):
+    retried = create(repository, 'anya', STEAM_ID)
+    failed = create(repository, 'boris', OTHER_STEAM_ID)
+    jobs = repository.claim_steam_jobs(10, 300)
+    assert len(jobs) == 2
+    repository.finish_steam_jobs([], [(2 ** 40, 'ошибка Steam', 1, retried)], [('ошибка Steam', failed)])
+    assert repository.steam_job_stats() == {'pending': 1, 'failed': 1}
+    # Повтор ещё не наступил
+    assert repository.claim_steam_jobs(10, 300) == []
+    repository.enqueue_steam_jobs([(retried, STEAM_ID), (failed, OTHER_STEAM_ID)])
+    assert {job['user_id'] for job in repository.claim_steam_jobs(10, 300)} == {retried, failed}
+
+
+def test_steam_ids_are_stored_and_backfilled(repository):
+    user_id = repository.create_user('Аня', 'anya', 'hash', 20, '', 'RPG', 'static/avatars/a.png', None,
+                                     'https://steamcommunity.com/id/anya', None, None, None)
+    assert repository.steam_ids(['https://steamcommunity.com/id/anya']) == {}
+    repository.store_steam_ids({'https://steamcommunity.com/id/anya': STEAM_ID})
+    assert repository.steam_ids(['https://steamcommunity.com/id/anya', 'https://steamcommunity.com/id/x']) == \
+        {'https://steamcommunity.com/id/anya': STEAM_ID}
+    assert [(row['id'], row['steam_profile_url']) for row in repository.users_missing_steam_id(0, 10)] == \
+        [(user_id, 'https://steamcommunity.com/id/anya')]
+    repository.set_user_steam_ids([(STEAM_ID, user_id)])
+    assert repository.users_missing_steam_id(0, 10) == []
+    assert [row['steam_id'] for row in repository.users_with_steam_id(0, 10)] == [STEAM_ID]
+
+
+
+def test_neighbor_lists_are_replaced_and_trimmed(repository):
+    anya, boris, vera = (create(repository, username) for username in ('anya', 'boris', 'vera'))
+    repository.replace_neighbors([anya, boris], [(anya, boris, 0.5), (anya, vera, 0.2), (boris, anya, 0.5)])
+    assert {row['user_id']: (row['neighbors'], pytest.approx(row['threshold'])) for row in
+            repository.neighbor_stats()} == {anya: (2, 0.2), boris: (1, 0.5)}
+    assert repository.neighbor_owners([vera, boris]) == {vera: [anya], boris: [anya]}
+
+    # vera пересчитана: обходит boris в списке anya, список обрезается до двух
+    stats = repository.update_neighbors([vera], [(vera, anya, 0.9)], [(anya, vera, 0.9), (boris, vera, 0.1)],
+                                        [anya, boris], 2)
+    assert {row['user_id']: row['neighbors'] for row in stats} == {anya: 2, boris: 2}
+    assert [row['id'] for row in repository.recommendations(anya, 10)] == [vera, boris]
+    assert [row['id'] for row in repository.recommendations(vera, 10)] == [anya]
+    repository.update_neighbors([boris], [], [], [], 2)
+    assert [row['user_id'] for row in repository.neighbor_stats([boris, vera])] == [vera]
+
+
+def test_recommender_builds_neighbors_in_repository(repository):
+    recommend = pytest.importorskip('recommend')
+    pytest.importorskip('scipy')
+    anya = create(repository, 'anya', game_type='RPG', age=20)
+    boris = create(repository, 'boris', game_type='RPG', age=21)
+    vera = create(repository, 'vera', game_type='FPS', age=40)
+    recommender = recommend.Recommender(top_k=1)
+    assert recommender.rebuild() == 3
+    assert [row['id'] for row in repository.recommendations(anya, 10)] == [boris]
+    assert [row['id'] for row in repository.recommendations(boris, 10)] == [anya]
+
+    # vera стала похожа на anya больше, чем boris
+    assert repository.update_profile(vera, 20, '', 'RPG', '', None, None, None, None) == 'vera'
+    repository.save_user_libraries([(vera, GAMES), (anya, GAMES)])
+    recommender.update_users([vera, anya])
+    assert [row['id'] for row in repository.recommendations(anya, 10)] == [vera]
+    assert [row['id'] for row in repository.recommendations(vera, 10)] == [anya]
+
+
+def test_avatar_hashes_are_backfilled(repository):
+    user_id = create(repository, 'anya')
+    assert [(row['id'], row['avatar']) for row in repository.users_missing_avatar_hash()] == \
+        [(user_id, 'static/avatars/a.png')]
+    repository.set_avatar_hashes([('a' * 64, user_id)])
+    assert repository.users_missing_avatar_hash() == []
+    assert repository.user_by_id(user_id)['avatar_hash'] == 'a' * 64
+
+def test_shutdown_closes_repository_once(app, monkeypatch):
+    from teamfinder import shutdown
+
+    calls = []
+    monkeypatch.setattr(app.extensions['repository'], 'close', lambda: calls.append(1))
+    shutdown(app, timeout=5)
+    # worker_exit gunicorn, затем atexit
+    shutdown(app, timeout=5)
+    assert calls == [1]
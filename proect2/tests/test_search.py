@@ -0,0 +1,107 @@
+import itertools
+import random
+import sqlite3
+
+import pytest
+
+import schema
+from search import build_user_query, encode_cursor
+
+GAME_TYPES = ['Шутеры', 'RPG', 'MMORPG', None]
+PLATFORMS = ['PC', 'PlayStation', 'Xbox', None]
+REGIONS = ['СНГ', 'Европа', 'Азия', None]
+FILTERS = {'game_type': 'RPG', 'platform': 'PC', 'region': 'СНГ'}
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    schema.migrate(conn)
+    return conn
+
+
+def insert_users(conn, users):
+    conn.executemany("""
+        INSERT INTO users (username, password, name, age, game_type, platform, region) VALUES (?, 'x', ?, ?, ?, ?, ?)
+    """, [(f"user{number}", *user) for number, user in enumerate(users)])
+    conn.commit()
+
+
+@pytest.fixture(params=[False, True], ids=['no-stats', 'analyzed'])
+def users_db(request, tmp_path):
+    # Около тысячи пользователей, у части нет имени, возраста, типа игр, платформы или региона
+    conn = connect(str(tmp_path / 'users.db'))
+    rng = random.Random(7)
+    insert_users(conn, [(f"{rng.choice(['Аня', 'Борис', 'dark', 'Wolf'])}{rng.randint(1, 50)}"
+                         if rng.random() < 0.9 else None,
+                         rng.randint(14, 60) if rng.random() < 0.9 else None,
+                         rng.choice(GAME_TYPES), rng.choice(PLATFORMS), rng.choice(REGIONS))
+                        for _ in range(1000)])
+    if request.param:
+        conn.execute("ANALYZE")
+        conn.commit()
+    yield conn
+    conn.close()
+
+
+def query(conn, sort_by, age=None, filters=(), after=None, page_size=20):
+    values = {column: FILTERS[column] for column in filters}
+    return (build_user_query(conn, sort_by, age, None, values.get('game_type'), values.get('platform'),
+                             values.get('region'))
+            .after(after).limit(page_size))
+
+
+def all_pages(conn, sort_by, age=None, filters=(), page_size=20):
+    rows, cursor = query(conn, sort_by, age, filters, page_size=page_size).page(conn)
+    result = list(rows)
+    while cursor:
+        rows, cursor = query(conn, sort_by, age, filters, cursor, page_size).page(conn)
+        result.extend(rows)
+    return [row['id'] for row in result]
+
+
+def expected_order(conn, sort_by, age=None, filters=()):
+    # NULL первыми, затем по значению, при равенстве по id
+    rows = conn.execute("SELECT * FROM users").fetchall()
+    rows = [row for row in rows
+            if all(row[column] == FILTERS[column] for column in filters)
+            and (not age or (row['age'] is not None and row['age'] >= age))]
+    rows.sort(key=lambda row: (row[sort_by] is not None, row[sort_by] if row[sort_by] is not None else 0,
+                               row['id']))
+    return [row['id'] for row in rows]
+
+
+def test_pages_past_null_group(tmp_path):
+    conn = connect(str(tmp_path / 'nulls.db'))
+    insert_users(conn, [('Игрок', 20, game_type, 'PC', 'СНГ')
+                        for game_type in [None, 'RPG', None, None, 'Шутеры', None, 'MMORPG', None, 'RPG']])
+    ids = all_pages(conn, 'game_type', page_size=3)
+    assert ids == [1, 3, 4, 6, 8, 7, 2, 9, 5]
+    conn.close()
+
+
+@pytest.mark.parametrize('sort_by', ['name', 'age', 'game_type'])
+@pytest.mark.parametrize('filters', [(), ('game_type',), ('platform', 'region'), ('game_type', 'platform', 'region')])
+@pytest.mark.parametrize('age', [None, 30])
+def test_pages_cover_every_row_once(users_db, sort_by, filters, age):
+    assert all_pages(users_db, sort_by, age, filters) == expected_order(users_db, sort_by, age, filters)
+
+
+def plan_problems(conn, builder):
+    return [line for line in builder.explain(conn) if line == 'SCAN users' or 'TEMP B-TREE' in line]
+
+
+@pytest.mark.parametrize('sort_by', ['name', 'age', 'game_type'])
+@pytest.mark.parametrize('age', [None, 30])
+def test_explain_reads_pages_in_index_order(users_db, sort_by, age):
+    # Любой набор фильтров-равенств с любой сортировкой: без полного прохода по таблице и без сортировки
+    # результата, на первой странице, после обычного курсора и после курсора внутри группы NULL
+    for filters in itertools.chain.from_iterable(itertools.combinations(FILTERS, n) for n in range(4)):
+        rows = [row for row in query(users_db, sort_by, age, filters, page_size=500).execute(users_db)
+                if row[sort_by] is not None]
+        cursors = [None, encode_cursor(sort_by, {sort_by: None, 'id': 1})]
+        if rows:
+            cursors.append(encode_cursor(sort_by, rows[len(rows) // 2]))
+        for cursor in cursors:
+            builder = query(users_db, sort_by, age, filters, cursor)
+            assert plan_problems(users_db, builder) == [], (filters, cursor, builder.explain(users_db))
@@ -0,0 +1,98 @@
+import itertools
+import random
+
+import pytest
+
+import writer
+from search import SORT_KEYS
+from snapshot import DIRECTORY_COLUMNS, Directory
+
+GAME_TYPES = ['Шутеры', 'RPG', 'MMORPG', None]
+PLATFORMS = ['PC', 'PlayStation', 'Xbox', None]
+REGIONS = ['СНГ', 'Европа', 'Азия', None]
+FILTERS = {'game_type': 'RPG', 'platform': 'PC', 'region': 'СНГ'}
+COMBINATIONS = [(sort_by, age, filters) for sort_by in SORT_KEYS for age in (None, 30)
+                for filters in itertools.chain.from_iterable(itertools.combinations(FILTERS, n) for n in range(4))]
+
+
+def _insert_users(conn, users):
+    conn.executemany("""
+        INSERT INTO users (username, password, name, age, game_type, platform, region) VALUES (?, 'x', ?, ?, ?, ?, ?)
+    """, users)
+
+
+def _update_users(conn, users):
+    conn.executemany("UPDATE users SET name = ?, age = ?, game_type = ?, platform = ? WHERE id = ?", users)
+
+
+def _delete_users(conn, user_ids):
+    conn.executemany("DELETE FROM users WHERE id = ?", [(user_id,) for user_id in user_ids])
+
+
+def random_user(rng):
+    # У части пользователей нет имени, возраста, типа игр, платформы или региона; имена повторяются
+    return (f"{rng.choice(['Аня', 'Борис', 'dark', 'Wolf'])}{rng.randint(1, 30)}" if rng.random() < 0.9 else None,
+            rng.randint(14, 60) if rng.random() < 0.9 else None,
+            rng.choice(GAME_TYPES), rng.choice(PLATFORMS), rng.choice(REGIONS))
+
+
+def walk(page, sort_by, age, filters, page_size=37):
+    # Полный keyset-обход: (id, колонки снимка) всех строк по порядку
+    values = {column: FILTERS[column] for column in filters}
+    arguments = (sort_by, age, values.get('game_type'), values.get('platform'), values.get('region'))
+    rows, cursor = page(*arguments, None, page_size)
+    result = list(rows)
+    while cursor:
+        rows, cursor = page(*arguments, cursor, page_size)
+        result.extend(rows)
+    return [tuple(row[column] for column in DIRECTORY_COLUMNS) for row in result]
+
+
+def assert_matches_sql(directory, repository):
+    def sql_page(sort_by, age, game_type, platform, region, after, page_size):
+        return repository.users_page(sort_by, age, None, game_type, platform, region, after, page_size)
+
+    directory.refresh(repository)
+    for sort_by, age, filters in COMBINATIONS:
+        expected = walk(sql_page, sort_by, age, filters)
+        assert walk(directory.page, sort_by, age, filters) == expected, (sort_by, age, filters)
+        values = {column: FILTERS[column] for column in filters}
+        assert directory.count(age, values.get('game_type'), values.get('platform'), values.get('region')) == \
+            repository.count_users(age, None, values.get('game_type'), values.get('platform'),
+                                   values.get('region')) == len(expected)
+
+
+@pytest.fixture
+def repository(app):
+    rng = random.Random(11)
+    with app.app_context():
+        writer.execute(_insert_users, [(f"user{number}", *random_user(rng)) for number in range(600)])
+        yield app.extensions['repository']
+
+
+def test_snapshot_matches_sql(repository):
+    assert_matches_sql(Directory(), repository)
+
+
+def test_snapshot_matches_sql_after_updates(repository):
+    directory = Directory(rebuild_fraction=0.05)
+    directory.refresh(repository)
+    rng = random.Random(12)
+    # Меньше доли перестроения: изменения применяются к снимку на месте
+    changed = rng.sample(range(1, 601), 20)
+    writer.execute(_update_users, [(*random_user(rng)[:4], user_id) for user_id in changed])
+    writer.execute(_insert_users, [(f"new{number}", *random_user(rng)) for number in range(5)])
+    assert_matches_sql(directory, repository)
+    assert directory.stats()['refreshes'] == 2
+    assert directory.stats()['rebuilds'] == 1
+
+
+def test_snapshot_matches_sql_after_deletes(repository):
+    directory = Directory()
+    directory.refresh(repository)
+    rng = random.Random(13)
+    writer.execute(_delete_users, rng.sample(range(1, 601), 10))
+    writer.execute(_update_users, [(*random_user(rng)[:4], user_id) for user_id in rng.sample(range(1, 601), 5)])
+    # Удаления видны только по числу пользователей - снимок строится заново
+    assert_matches_sql(directory, repository)
+    assert directory.stats()['rebuilds'] == 2
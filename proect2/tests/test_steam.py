@@ -0,0 +1,121 @@
+import time
+
+import pytest
+
+from steam import SteamClient, SteamLibraryCache, SteamRateLimited
+
+STEAM_ID = '76561197960287930'
+NEW_GAMES = [{'appid': 570, 'name': 'Dota 2', 'playtime_forever': 800}]
+
+
+@pytest.fixture
+def cache(fake_steam, clock):
+    cache = SteamLibraryCache(SteamClient(fake_steam.url, 'test', timeout=(1, 2)),
+                              ttl=60, stale_ttl=3600, error_ttl=30, max_entries=100, workers=2, clock=clock)
+    yield cache
+    cache.shutdown()
+
+
+def wait_idle(cache, timeout=5):
+    # Фоновые обновления запускаются внутри get(), ждём, пока они закончатся
+    deadline = time.monotonic() + timeout
+    while cache.stats()['inflight']:
+        assert time.monotonic() < deadline, "фоновое обновление не завершилось"
+        time.sleep(0.01)
+
+
+def test_get_or_fetch_caches_library(cache, fake_steam):
+    assert cache.get_or_fetch(STEAM_ID, timeout=5) == fake_steam.games
+    assert cache.get(STEAM_ID) == fake_steam.games
+    assert fake_steam.calls == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_get_on_miss_returns_empty_and_loads_in_background(cache, fake_steam):
+    assert cache.get(STEAM_ID) == []
+    wait_idle(cache)
+    assert cache.get(STEAM_ID) == fake_steam.games
+    assert fake_steam.calls == 1
+
+
+def test_stale_entry_is_served_and_refreshed(cache, fake_steam, clock):
+    old_games = cache.get_or_fetch(STEAM_ID, timeout=5)
+    fake_steam.games = NEW_GAMES
+    clock.now += 61
+
+    assert cache.get(STEAM_ID) == old_games
+    wait_idle(cache)
+    assert cache.get(STEAM_ID) == NEW_GAMES
+    assert fake_steam.calls == 2
+    assert cache.stats()['stale_hits'] == 1
+
+
+def test_stale_data_served_when_steam_fails(cache, fake_steam, clock):
+    old_games = cache.get_or_fetch(STEAM_ID, timeout=5)
+    fake_steam.status = 500
+    clock.now += 61
+
+    assert cache.get(STEAM_ID) == old_games
+    wait_idle(cache)
+    assert cache.get(STEAM_ID) == old_games
+    assert cache.stats()['errors'] == 1
+
+    # Ошибка кэшируется на error_ttl: Steam не опрашивается на каждом запросе
+    clock.now += 10
+    cache.get(STEAM_ID)
+    wait_idle(cache)
+    assert fake_steam.calls == 2
+
+    fake_steam.status = 200
+    fake_steam.games = NEW_GAMES
+    clock.now += 30
+    cache.get(STEAM_ID)
+    wait_idle(cache)
+    assert cache.get(STEAM_ID) == NEW_GAMES
+
+
+def test_stale_data_survives_repeated_failures(cache, fake_steam, clock):
+    old_games = cache.get_or_fetch(STEAM_ID, timeout=5)
+    fake_steam.status = 500
+    for _ in range(3):
+        clock.now += 61
+        cache.get(STEAM_ID)
+        wait_idle(cache)
+        assert cache.get(STEAM_ID) == old_games
+    assert cache.stats()['errors'] == 3
+
+
+def test_expired_entry_is_not_served(cache, fake_steam, clock):
+    cache.get_or_fetch(STEAM_ID, timeout=5)
+    fake_steam.status = 500
+    clock.now += 3601
+    assert cache.get(STEAM_ID) == []
+    wait_idle(cache)
+    assert cache.get(STEAM_ID) == []
+
+
+def test_oldest_fetch_is_evicted(fake_steam, clock):
+    cache = SteamLibraryCache(SteamClient(fake_steam.url, 'test', timeout=(1, 2)), max_entries=2, clock=clock)
+    try:
+        for steam_id in ('1', '2'):
+            cache.get_or_fetch(steam_id, timeout=5)
+            clock.now += 1
+        # Обновлённая запись становится самой свежей, вытесняется '2'
+        clock.now += 900
+        cache.get_or_fetch('1', timeout=5)
+        cache.get_or_fetch('3', timeout=5)
+        assert set(cache._entries) == {'1', '3'}
+    finally:
+        cache.shutdown()
+
+
+def test_rate_limit_reports_retry_after(fake_steam):
+    fake_steam.status = 429
+    fake_steam.retry_after = 120
+    client = SteamClient(fake_steam.url, 'test', timeout=(1, 2))
+    try:
+        with pytest.raises(SteamRateLimited) as error:
+            client.get_owned_games(STEAM_ID)
+        assert error.value.retry_after == 120
+    finally:
+        client.close()
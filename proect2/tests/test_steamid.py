@@ -0,0 +1,78 @@
+import pytest
+
+from steamid import InvalidSteamUrl, parse_profile_url, parse_steam_id
+
+STEAM_ID = '76561197960287930'
+PROFILE = f'https://steamcommunity.com/profiles/{STEAM_ID}'
+
+
+@pytest.mark.parametrize('value, expected', [
+    (STEAM_ID, STEAM_ID),
+    (f'  {STEAM_ID}\n', STEAM_ID),
+    ('STEAM_0:0:11101', STEAM_ID),
+    ('STEAM_1:0:11101', STEAM_ID),
+    ('steam_0:1:11101', '76561197960287931'),
+    ('[U:1:22202]', STEAM_ID),
+    ('U:1:22202', STEAM_ID),
+    ('u:1:22202', STEAM_ID),
+    ('7656119796028793', None),
+    ('765611979602879300', None),
+    ('12345678901234567', None),
+    ('STEAM_0:2:11101', None),
+    ('STEAM_6:0:11101', None),
+    ('[U:2:22202]', None),
+    ('anya', None),
+    ('', None),
+])
+def test_parse_steam_id(value, expected):
+    assert parse_steam_id(value) == expected
+
+
+@pytest.mark.parametrize('value, expected', [
+    # /profiles/<id64> и «сырые» ID
+    (PROFILE, (PROFILE, STEAM_ID, None)),
+    (PROFILE + '/', (PROFILE, STEAM_ID, None)),
+    (PROFILE + '/games/?tab=all', (PROFILE, STEAM_ID, None)),
+    (f'http://www.steamcommunity.com/profiles/{STEAM_ID}', (PROFILE, STEAM_ID, None)),
+    (f'steamcommunity.com/profiles/{STEAM_ID}', (PROFILE, STEAM_ID, None)),
+    (f'https://STEAMCOMMUNITY.COM/Profiles/{STEAM_ID}', (PROFILE, STEAM_ID, None)),
+    ('https://steamcommunity.com/profiles/[U:1:22202]', (PROFILE, STEAM_ID, None)),
+    (STEAM_ID, (PROFILE, STEAM_ID, None)),
+    ('STEAM_0:0:11101', (PROFILE, STEAM_ID, None)),
+    (f'  {PROFILE}  ', (PROFILE, STEAM_ID, None)),
+    # Короткие имена приводятся к нижнему регистру, ID для них разрешает Steam
+    ('https://steamcommunity.com/id/Anya', ('https://steamcommunity.com/id/anya', None, 'anya')),
+    ('https://steamcommunity.com/id/anya/', ('https://steamcommunity.com/id/anya', None, 'anya')),
+    ('https://steamcommunity.com//id//anya//', ('https://steamcommunity.com/id/anya', None, 'anya')),
+    ('https://steamcommunity.com/id/anya?l=russian', ('https://steamcommunity.com/id/anya', None, 'anya')),
+    ('steamcommunity.com/id/pro_gamer-1', ('https://steamcommunity.com/id/pro_gamer-1', None, 'pro_gamer-1')),
+    (f'https://steamcommunity.com/id/{STEAM_ID}', (f'https://steamcommunity.com/id/{STEAM_ID}', None, STEAM_ID)),
+])
+def test_parse_profile_url(value, expected):
+    assert parse_profile_url(value) == expected
+
+
+@pytest.mark.parametrize('value', [
+    '',
+    None,
+    'anya',
+    'https://steamcommunity.com',
+    'https://steamcommunity.com/',
+    'https://steamcommunity.com/id/',
+    'https://steamcommunity.com/profiles/',
+    'https://steamcommunity.com/profiles/anya',
+    'https://steamcommunity.com/profiles/12345',
+    'https://steamcommunity.com/groups/anya',
+    'https://steamcommunity.com/id/a',
+    'https://steamcommunity.com/id/' + 'a' * 33,
+    'https://steamcommunity.com/id/an%20ya',
+    'https://steamcommunity.com/id/аня',
+    f'https://store.steampowered.com/profiles/{STEAM_ID}',
+    f'https://steamcommunity.com.evil.example/profiles/{STEAM_ID}',
+    f'https://evil.example/steamcommunity.com/profiles/{STEAM_ID}',
+    f'https://steamcommunity.com@evil.example/profiles/{STEAM_ID}',
+    'https://evil.example/id/anya',
+])
+def test_parse_profile_url_rejects(value):
+    with pytest.raises(InvalidSteamUrl):
+        parse_profile_url(value)
@@ -0,0 +1,277 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from config import ProcessDefault, set_defaults, settings_from
+from db import connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    # Все записи процесса идут через один поток и группируются в общие транзакции;
+    # False - каждая операция выполняется сразу в потоке запроса своей транзакцией
+    'WRITER_ENABLED': True,
+    # Транзакция закрывается, когда набралось WRITER_BATCH_SIZE операций или прошло WRITER_MAX_DELAY секунд
+    'WRITER_BATCH_SIZE': 64,
+    'WRITER_MAX_DELAY': 0.005,
+    # Ограниченная очередь: если она заполнена дольше WRITER_QUEUE_TIMEOUT, запрос получает WriterBusy
+    'WRITER_QUEUE_SIZE': 1024,
+    'WRITER_QUEUE_TIMEOUT': 1.0,
+    # Сколько ждать подтверждения записи
+    'WRITER_TIMEOUT': 10.0,
+    # Повторы всей транзакции, если БД занята другим процессом дольше busy_timeout
+    'WRITER_RETRIES': 3,
+    # У потока записи своё соединение вне пула запросов; FULL - fsync на каждый COMMIT пачки,
+    # подтверждённая запись переживает и отключение питания
+    'WRITER_SYNCHRONOUS': 'FULL',
+}
+
+_STOP = object()
+
+# SQLITE_BUSY, SQLITE_LOCKED: младший байт расширенного кода ошибки
+_BUSY_CODES = {5, 6}
+
+
+class WriterBusy(Exception):
+    pass
+
+
+def _is_busy(error):
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    return (getattr(error, 'sqlite_errorcode', 0) & 0xff) in _BUSY_CODES
+
+
+class Writer:
+    # Единственный поток записи: операции - функции op(conn, *args) без commit. Каждая выполняется
+    # в своём SAVEPOINT, так что ошибка одной откатывает только её, а вся пачка фиксируется одним COMMIT
+    # (один fsync на пачку). Future операции завершается только после COMMIT
+    def __init__(self, pool, batch_size=64, max_delay=0.005, queue_size=1024, queue_timeout=1.0, timeout=10.0,
+                 retries=3, synchronous='FULL'):
+        self.pool = pool
+        self.synchronous = synchronous
+        self._conn = None
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.retries = retries
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stopped = False
+        self._stats_lock = threading.Lock()
+
+        self.operations = 0
+        self.failed = 0
+        self.batches = 0
+        self.commit_retries = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.max_batch = 0
+
+    def _ensure_started(self):
+        # Поток запускается при первой записи уже в процессе воркера, как и пул хэширования паролей
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                    self._thread.start()
+
+    def submit(self, operation, *args):
+        if self._stopped:
+            raise WriterBusy("Запись остановлена")
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put((operation, args, future), timeout=self.queue_timeout)
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected += 1
+            raise WriterBusy("Очередь записи переполнена") from None
+        return future
+
+    def execute(self, operation, *args):
+        # Результат операции после фиксации транзакции; исключение операции пробрасывается вызывающему.
+        # Не дождались подтверждения - WriterBusy (503): операция может ещё выполниться позже
+        try:
+            return self.submit(operation, *args).result(self.timeout)
+        except FutureTimeout:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise WriterBusy(f"Запись не подтверждена за {self.timeout} с") from None
+
+    def _run(self):
+        try:
+            self._loop()
+        finally:
+            self._close_connection()
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            if stop:
+                return
+
+    def _connection(self):
+        # Своё соединение: поток записи не ждёт свободного соединения в пуле запросов и не занимает его
+        if self._conn is None:
+            self._conn = self.pool.open_dedicated(self.synchronous)
+        return self._conn
+
+    def _close_connection(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _commit(self, batch):
+        for attempt in range(self.retries + 1):
+            try:
+                results = self._apply(self._connection(), batch)
+                break
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e):
+                    logger.exception("Ошибка записи пачки из %d операций", len(batch))
+                    # Соединение могло испортиться: следующая пачка откроет новое
+                    self._close_connection()
+                    results = [(None, e)] * len(batch)
+                    break
+                # Блокировку держит другой процесс: откатываем и повторяем всю пачку
+                if attempt >= self.retries:
+                    logger.error("Не удалось записать пачку из %d операций: %s", len(batch), e)
+                    results = [(None, e)] * len(batch)
+                    break
+                with self._stats_lock:
+                    self.commit_retries += 1
+                time.sleep(0.01 * (attempt + 1))
+            except Exception as e:
+                logger.exception("Ошибка записи пачки из %d операций", len(batch))
+                results = [(None, e)] * len(batch)
+                break
+
+        failed = 0
+        for (_, _, future), (result, error) in zip(batch, results):
+            if error is None:
+                future.set_result(result)
+            else:
+                failed += 1
+                future.set_exception(error)
+        with self._stats_lock:
+            self.batches += 1
+            self.operations += len(batch)
+            self.failed += failed
+            self.max_batch = max(self.max_batch, len(batch))
+
+    def _apply(self, conn, batch):
+        results = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for operation, args, _ in batch:
+                conn.execute("SAVEPOINT write_op")
+                try:
+                    result = operation(conn, *args)
+                except Exception as e:
+                    if _is_busy(e):
+                        # Занятая БД касается всей транзакции, а не одной операции
+                        raise
+                    conn.execute("ROLLBACK TO write_op")
+                    conn.execute("RELEASE write_op")
+                    results.append((None, e))
+                    continue
+                conn.execute("RELEASE write_op")
+                results.append((result, None))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return results
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queued': self._queue.qsize(),
+                'operations': self.operations,
+                'failed': self.failed,
+                'batches': self.batches,
+                'avg_batch': self.operations / self.batches if self.batches else 0.0,
+                'max_batch': self.max_batch,
+                'commit_retries': self.commit_retries,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+            }
+
+    def stop(self, timeout=None):
+        # Уже принятые операции дописываются, новые получают WriterBusy
+        self._stopped = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+
+def _execute_inline(operation, *args):
+    with connection() as conn:
+        try:
+            result = operation(conn, *args)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return result
+
+
+def writer_from_config(config, pool):
+    settings = settings_from(DEFAULT_CONFIG, config)
+    return Writer(pool,
+                  batch_size=settings['WRITER_BATCH_SIZE'],
+                  max_delay=settings['WRITER_MAX_DELAY'],
+                  queue_size=settings['WRITER_QUEUE_SIZE'],
+                  queue_timeout=settings['WRITER_QUEUE_TIMEOUT'],
+                  timeout=settings['WRITER_TIMEOUT'],
+                  retries=settings['WRITER_RETRIES'],
+                  synchronous=settings['WRITER_SYNCHRONOUS'])
+
+
+# Без приложения поток записи не создаётся: операции выполняются сразу (_execute_inline)
+_default_writer = ProcessDefault('writer')
+
+
+def get_writer():
+    return _default_writer.get()
+
+
+def execute(operation, *args):
+    # Точка входа для funcs: через поток записи, если он включён, иначе сразу в этом потоке
+    writer = get_writer()
+    if writer is None:
+        return _execute_inline(operation, *args)
+    return writer.execute(operation, *args)
+
+
+def init_app(app):
+    set_defaults(app, DEFAULT_CONFIG)
+    if not app.config['WRITER_ENABLED']:
+        app.extensions['writer'] = None
+        return
+    writer = writer_from_config(app.config, app.extensions['db_pool'])
+    app.extensions['writer'] = writer
+    # Фоновые потоки без контекста приложения пишут через тот же поток записи
+    _default_writer.offer(writer)